@@ -285,7 +285,9 @@ def to_flag(m: str) -> CondFlag:
     like Z or NEVER or might be a combination
     like PZ.
     """
-    if m in [flag.name for flag in CondFlag]:
+    # Iterating CondFlag omits the aliases ALWAYS and NEVER
+    # in Python 3.11+, so look in __members__ instead
+    if m in CondFlag.__members__:
         return CondFlag[m]
     composite = CondFlag.NEVER
     for bitname in m:
@@ -293,7 +295,7 @@ def to_flag(m: str) -> CondFlag:
     return composite
 
 
-def transform(lines: list[str]) -> list[str]:
+def transform(lines: list[str], errors: list[str]=None) -> list[str]:
     """
     Transform some assembly language lines, leaving others
     unchanged.
@@ -311,7 +313,17 @@ def transform(lines: list[str]) -> list[str]:
                 ADD   r15,r0,r15[-2]
                 HALT r0,r0,r0
        x:       DATA 0
+
+    Error messages are printed, or, if an errors list is given,
+    appended to it (and too many errors end the transformation
+    rather than the program).
     """
+    def report(message: str):
+        if errors is None:
+            print(message, file=sys.stderr)
+        else:
+            errors.append(message)
+
     labels = resolve(lines)
     error_count = 0
     transformed = []
@@ -354,16 +366,19 @@ def transform(lines: list[str]) -> list[str]:
         # Relay error messages to user if any occur
         except SyntaxError as e:
             error_count += 1
-            print(f"Syntax error in line {lnum}: {line}", file=sys.stderr)
+            report(f"Syntax error in line {lnum}: {line}")
         except KeyError as e:
             error_count += 1
-            print("phase1 error")
-            print(f"Unknown word in line {lnum}: {e}", file=sys.stderr)
+            if errors is None:
+                print("phase1 error")
+            report(f"Unknown word in line {lnum}: {e}")
         except Exception as e:
             error_count += 1
-            print(f"Exception encountered in line {lnum}: {e}", file=sys.stderr)
+            report(f"Exception encountered in line {lnum}: {e}")
         if error_count > ERROR_LIMIT:
-            print("Too many errors; abandoning", file=sys.stderr)
+            report("Too many errors; abandoning")
+            if errors is not None:
+                break
             sys.exit(1)
     return transformed
 
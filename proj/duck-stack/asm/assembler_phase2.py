@@ -49,6 +49,7 @@ import io
 
 import context
 from instruction_set.instr_format import Instruction, OpCode, CondFlag, NAMED_REGS
+from instruction_set.objfile import write_binary
 
 import argparse
 from enum import Enum, auto
@@ -228,7 +229,9 @@ def to_flag(m: str) -> CondFlag:
     like Z or NEVER or might be a combination
     like PZ.
     """
-    if m in [ flag.name for flag in CondFlag ]:
+    # Iterating CondFlag omits the aliases ALWAYS and NEVER
+    # in Python 3.11+, so look in __members__ instead
+    if m in CondFlag.__members__:
         return CondFlag[m]
     composite = CondFlag.NEVER
     for bitname in m:
@@ -250,11 +253,13 @@ def instruction_from_dict(d: dict) -> Instruction:
     return Instruction(opcode, pred, target, src1, src2, offset)
 
 
-def assemble(lines: list[str]) -> list[int]:
+def assemble(lines: list[str], symbols: dict[str, int]=None,
+             errors: list[str]=None) -> list[int]:
     """
     Simple one-pass translation of assembly language
     source code into instructions.  Empty lines and lines
-    with only labels and comments are skipped.
+    with only labels and comments are skipped.  If a symbols
+    dict is given, the address of each label is added to it.
     Handles *only* numerical offsets, not symbolic labels.
     For example:
         STORE   r1,r0,r15[8]    # OK, store value of r1 at location pc+8
@@ -262,7 +267,16 @@ def assemble(lines: list[str]) -> list[int]:
     but not
         STORE   r1,variable     # cannot use symbolic address of variable
         JUMP/Z  again           # cannot use pseudo-instruction JUMP or symbolic label 'again'
+    Error messages are printed, or, if an errors list is given,
+    appended to it (and too many errors end the assembly rather
+    than the program).
     """
+    def report(message: str):
+        if errors is None:
+            print(message, file=sys.stderr)
+        else:
+            errors.append(message)
+
     error_count = 0
     instructions = [ ]
     for lnum in range(len(lines)):
@@ -270,6 +284,8 @@ def assemble(lines: list[str]) -> list[int]:
         log.debug(f"Processing line {lnum}: {line}")
         try: 
             fields = parse_line(line)
+            if symbols is not None and fields["label"]:
+                symbols[fields["label"]] = len(instructions)
             if fields["kind"] == AsmSrcKind.FULL:
                 log.debug("Constructing instruction")
                 fill_defaults(fields)
@@ -283,16 +299,19 @@ def assemble(lines: list[str]) -> list[int]:
                 log.debug(f"No instruction on line {lnum}: {line}")
         except SyntaxError as e:
             error_count += 1
-            print(f"Syntax error in line {lnum}: {line}", file=sys.stderr)
+            report(f"Syntax error in line {lnum}: {line}")
         except KeyError as e:
             error_count += 1
-            print("phase 2 error")
-            print(f"Unknown word in line {lnum}: {e}", file=sys.stderr)
+            if errors is None:
+                print("phase 2 error")
+            report(f"Unknown word in line {lnum}: {e}")
         except Exception as e:
             error_count += 1
-            print(f"Exception encountered in line {lnum}: {e}", file=sys.stderr)
+            report(f"Exception encountered in line {lnum}: {e}")
         if error_count > ERROR_LIMIT:
-            print("Too many errors; abandoning", file=sys.stderr)
+            report("Too many errors; abandoning")
+            if errors is not None:
+                break
             sys.exit(1)
     return instructions
 
@@ -305,20 +324,31 @@ def cli() -> object:
     parser.add_argument("objfile", type=argparse.FileType('w'),
                             nargs="?", default=sys.stdout, 
                             help="Object file output")
+    parser.add_argument("-b", "--binary", action="store_true",
+                            help="Write a binary object file, with symbols")
     args = parser.parse_args()
     return args
 
 
-def main(sourcefile: io.IOBase, objfile: io.IOBase):
-    """"Assemble a Duck Machine program"""
+def main(sourcefile: io.IOBase, objfile: io.IOBase, binary: bool=False):
+    """"Assemble a Duck Machine program.  A binary object file
+    may be opened in text mode; its underlying buffer is used.
+    """
     lines = sourcefile.readlines()
-    object_code = assemble(lines)
+    symbols = {}
+    object_code = assemble(lines, symbols)
     log.debug(f"Object code: \n{object_code}")
+    if binary:
+        if isinstance(objfile, io.TextIOBase):
+            objfile.flush()
+            objfile = objfile.buffer
+        write_binary(object_code, objfile, symbols)
+        return
     for word in object_code:
         log.debug(f"Instruction word {word}")
         print(word,file=objfile)
 
 if __name__ == "__main__":
     args = cli()
-    main(args.sourcefile, args.objfile)
+    main(args.sourcefile, args.objfile, binary=args.binary)
 
@@ -0,0 +1,89 @@
+"""
+Disassembler for Duck Machine object code.
+
+Lists each word of a text or binary object file as an instruction
+(in the same form as Instruction.__str__) or, if it does not hold
+a valid operation code, as DATA.  Labels from the symbol table of
+a binary object file are shown at their addresses, and memory
+references relative to r15 or r0 are annotated with the label of
+the address they refer to.
+
+Decoding is done for the whole image at once (see
+instruction_set/vector.py), so large images list quickly.
+"""
+import io
+
+import context
+from instruction_set.instr_format import OpCode, CondFlag
+from instruction_set.objfile import read_object
+from instruction_set.vector import decode_image, is_instruction
+
+import argparse
+import sys
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Text for each operation code and condition mask, as in Instruction.__str__
+OP_NAMES = {op.value: op.name for op in OpCode}
+PREDICATES = {value: "" if value == CondFlag.ALWAYS.value else f"/{CondFlag(value)}"
+              for value in range(16)}
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Duck Machine disassembler")
+    parser.add_argument("objfile", type=argparse.FileType('rb'),
+                        nargs="?", default=sys.stdin.buffer,
+                        help="Object file (text or binary)")
+    parser.add_argument("listing", type=argparse.FileType('w'),
+                        nargs="?", default=sys.stdout,
+                        help="Listing output")
+    args = parser.parse_args()
+    return args
+
+
+def listing(words: list[int], symbols: dict[str, int]) -> list[str]:
+    """Lines of the disassembly listing"""
+    labels: dict[int, str] = {}
+    for name, addr in symbols.items():
+        labels.setdefault(addr, name)
+    fields = decode_image(words)
+    valid = is_instruction(fields).tolist()
+    columns = zip(range(len(words)), list(words), valid,
+                  *(fields[name].tolist()
+                    for name in ["op", "cond", "target", "src1", "src2", "offset"]))
+    lines = []
+    for addr, word, ok, op, cond, target, src1, src2, offset in columns:
+        label = labels.get(addr)
+        if label is not None:
+            lines.append(f"{label}:")
+        if not ok:
+            lines.append(f"{addr:>7}  {word:>11}    DATA {word}")
+            continue
+        text = (f"{OP_NAMES[op]}{PREDICATES[cond]}   "
+                f"r{target},r{src1},r{src2}[{offset}]")
+        # Annotate an address the instruction refers to
+        if src1 == 0 and src2 == 15:
+            referent = labels.get(addr + offset)
+        elif src1 == 0 and src2 == 0 and op in (OpCode.LOAD.value, OpCode.STORE.value):
+            referent = labels.get(offset)
+        else:
+            referent = None
+        if referent is not None:
+            text = f"{text:<32}# {referent}"
+        lines.append(f"{addr:>7}  {word:>11}    {text}")
+    return lines
+
+
+def main(objfile: io.IOBase, out: io.IOBase):
+    """Disassemble an object file"""
+    words, symbols = read_object(objfile)
+    out.write("".join(f"{line}\n" for line in listing(list(words), symbols)))
+
+
+if __name__ == "__main__":
+    args = cli()
+    main(args.objfile, args.listing)
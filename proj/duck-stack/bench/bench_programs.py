@@ -0,0 +1,232 @@
+"""
+Instructions-per-second benchmark for the Duck Machine.
+
+Runs every program in programs/obj and programs/asm (assembling
+the latter first), plus generated scaled-up workloads, headless
+through cpu/duck_machine.py, each in its own process.  Input for
+the memory-mapped input port (address 510) comes from the fixture
+file bench/inputs/<program>.txt, if there is one.
+
+Reports steps, run time, wall time (including interpreter start),
+instructions per second and peak resident set size per program
+as JSON, and optionally compares instructions per second against
+a stored baseline.
+"""
+
+import context
+import asm.assembler_phase1 as asm1
+import asm.assembler_phase2 as asm2
+
+import argparse
+import contextlib
+import io
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+PROJECT_DIR = BENCH_DIR.parent
+PROGRAMS_DIR = PROJECT_DIR / "programs"
+INPUTS_DIR = BENCH_DIR / "inputs"
+DUCK_MACHINE = PROJECT_DIR / "cpu" / "duck_machine.py"
+
+
+# Generated workloads, as assembly language source.  Each is
+# parameterized by a scale n, e.g., count down from n.
+
+def countdown_asm(n: int) -> str:
+    """Count down from n to zero, keeping the counter in
+    memory the way compiled Mallard code does
+    """
+    return f"""
+        LOAD  r14,start
+        STORE r14,x
+loop:   LOAD  r14,x
+        SUB   r0,r14,r0
+        JUMP/ZM done
+        LOAD  r13,one
+        SUB   r14,r14,r13
+        STORE r14,x
+        JUMP  loop
+done:   HALT  r0,r0,r0
+start:  DATA {n}
+one:    DATA 1
+x:      DATA 0
+"""
+
+def muldiv_asm(n: int) -> str:
+    """n rounds of multiplication and division in registers"""
+    return f"""
+        LOAD  r1,start
+        ADD   r2,r0,r0[7]
+        ADD   r3,r0,r0[1]
+loop:   MUL   r4,r3,r2
+        DIV   r3,r4,r2
+        SUB   r1,r1,r0[1]
+        JUMP/P loop
+        STORE r3,r0,r0[511]
+        HALT  r0,r0,r0
+start:  DATA {n}
+"""
+
+GENERATORS = {
+    "countdown": countdown_asm,
+    "muldiv": muldiv_asm
+}
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Duck Machine benchmark")
+    parser.add_argument("-e", "--engine", default="step",
+                        choices=["step", "threaded", "blocks"],
+                        help="Execution engine to benchmark")
+    parser.add_argument("--scale", type=int, default=10**6,
+                        help="Size of generated workloads (0 for none)")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="Seconds allowed per program")
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'),
+                        default=sys.stdout, help="Write results (JSON) here")
+    parser.add_argument("-b", "--baseline", type=argparse.FileType('r'),
+                        help="Compare against results (JSON) from an earlier run")
+    parser.add_argument("-t", "--threshold", type=float, default=0.10,
+                        help="Allowed fractional drop in instructions per second")
+    parser.add_argument("--min-steps", type=int, default=1000,
+                        help="Programs with fewer steps are too noisy to compare")
+    return parser.parse_args()
+
+
+def assemble(lines: list[str]) -> list[int]:
+    """Object code for assembly source lines.  Raises ValueError
+    if the assembler reports any errors.
+    """
+    errors = io.StringIO()
+    try:
+        # The assemblers also print some error notes to stdout
+        with contextlib.redirect_stderr(errors), contextlib.redirect_stdout(errors):
+            words = asm2.assemble(asm1.transform(lines))
+    except SystemExit:
+        pass  # Too many errors; they are in the log
+    if errors.getvalue():
+        raise ValueError(errors.getvalue().strip())
+    return words
+
+
+def collect(work_dir: pathlib.Path, scale: int) -> dict[str, pathlib.Path]:
+    """Object files to run, by benchmark name.  Assembly programs
+    and generated workloads are assembled into work_dir.
+    """
+    programs = {}
+    for path in sorted((PROGRAMS_DIR / "obj").glob("*.obj")):
+        programs[f"obj/{path.stem}"] = path
+    sources = {f"asm/{path.stem}": path.read_text()
+               for path in sorted((PROGRAMS_DIR / "asm").glob("*.asm"))}
+    if scale > 0:
+        for kind, generator in GENERATORS.items():
+            sources[f"gen/{kind}_{scale}"] = generator(scale)
+    for name, text in sources.items():
+        try:
+            words = assemble(text.splitlines(keepends=True))
+        except ValueError as e:
+            log.warning(f"Cannot assemble {name}: {e}")
+            programs[name] = None
+            continue
+        obj_path = work_dir / (name.replace("/", "_") + ".obj")
+        obj_path.write_text("".join(f"{word}\n" for word in words))
+        programs[name] = obj_path
+    return programs
+
+
+def run_one(name: str, obj_path: pathlib.Path, engine: str,
+            timeout: float, work_dir: pathlib.Path) -> dict:
+    """Run one program in a fresh duck_machine.py process"""
+    stats_path = work_dir / "stats.json"
+    fixture = INPUTS_DIR / (name.split("/")[-1] + ".txt")
+    command = [sys.executable, str(DUCK_MACHINE), str(obj_path),
+               "--engine", engine, "--stats", str(stats_path)]
+    stdin = open(fixture) if fixture.exists() else subprocess.DEVNULL
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(command, stdin=stdin, capture_output=True,
+                                text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"status": "timeout"}
+    finally:
+        if stdin is not subprocess.DEVNULL:
+            stdin.close()
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        message = result.stderr.strip().splitlines()
+        return {"status": "error", "message": message[-1] if message else ""}
+    record = json.loads(stats_path.read_text())
+    return {
+        "status": "ok",
+        "steps": record["steps"],
+        "seconds": record["seconds"],
+        "wall_seconds": wall,
+        "ips": record["ips"],
+        "peak_rss_kb": record["peak_rss_kb"]
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float,
+            min_steps: int) -> list[str]:
+    """Descriptions of programs whose instructions per second
+    dropped by more than threshold relative to the baseline
+    """
+    regressions = []
+    for name, now in results["programs"].items():
+        before = baseline["programs"].get(name)
+        if (before is None or now["status"] != "ok"
+                or before["status"] != "ok" or now["steps"] < min_steps):
+            continue
+        ratio = now["ips"] / before["ips"]
+        log.info(f"{name}: {now['ips']:,.0f} ips, {ratio:.2f}x baseline")
+        if ratio < 1.0 - threshold:
+            regressions.append(f"{name}: {now['ips']:,.0f} ips "
+                               f"vs {before['ips']:,.0f} in baseline")
+    return regressions
+
+
+def main(engine: str, scale: int, timeout: float, output: io.IOBase,
+         baseline: io.IOBase=None, threshold: float=0.10,
+         min_steps: int=1000) -> bool:
+    """Run the benchmark; False if it found a regression"""
+    results = {
+        "engine": engine,
+        "python": sys.version.split()[0],
+        "programs": {}
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = pathlib.Path(tmp)
+        for name, obj_path in collect(work_dir, scale).items():
+            if obj_path is None:
+                results["programs"][name] = {"status": "assembly error"}
+                continue
+            log.debug(f"Running {name}")
+            results["programs"][name] = run_one(name, obj_path, engine,
+                                                timeout, work_dir)
+    json.dump(results, output, indent=2)
+    print(file=output)
+    if baseline is None:
+        return True
+    regressions = compare(results, json.load(baseline), threshold, min_steps)
+    for regression in regressions:
+        log.warning(f"Regression: {regression}")
+    return not regressions
+
+
+if __name__ == "__main__":
+    args = cli()
+    ok = main(args.engine, args.scale, args.timeout, args.output,
+              baseline=args.baseline, threshold=args.threshold,
+              min_steps=args.min_steps)
+    sys.exit(0 if ok else 1)
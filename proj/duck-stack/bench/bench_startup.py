@@ -0,0 +1,178 @@
+"""
+Startup-time benchmark for the duck-stack command line tools.
+
+Runs each entry point on a tiny input, in a fresh process, several
+times, and reports the minimum and median wall time as JSON.  The
+programs do almost no work, so the time is dominated by starting
+the interpreter and importing modules.  A bare interpreter
+("python") is measured too, as the floor.
+
+With --budget, e.g. --budget duck_machine=100, the exit status
+is 1 if an entry point's median exceeds its budget in milliseconds.
+With --imports, the slowest imports of each entry point (from
+python -X importtime) are logged, to show what to make lazy.
+"""
+
+import context
+
+import argparse
+import io
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+PROJECT_DIR = BENCH_DIR.parent
+PROGRAMS_DIR = PROJECT_DIR / "programs"
+INPUTS_DIR = BENCH_DIR / "inputs"
+
+# Entry point name -> (script and arguments, input file or None)
+ENTRY_POINTS = {
+    "python": (["-c", "pass"], None),
+    "duck_machine": (["cpu/duck_machine.py", str(PROGRAMS_DIR / "obj" / "sum.obj")],
+                     INPUTS_DIR / "sum.txt"),
+    "compile": (["compiler/compile.py", str(PROGRAMS_DIR / "mal" / "print.mal"),
+                 "/dev/null"], None),
+    "assembler_phase1": (["asm/assembler_phase1.py", str(PROGRAMS_DIR / "asm" / "print.asm"),
+                          "/dev/null"], None),
+    "assembler_phase2": (["asm/assembler_phase2.py", str(PROGRAMS_DIR / "dasm" / "print.dasm"),
+                          "/dev/null"], None),
+    "disasm": (["asm/disasm.py", str(PROGRAMS_DIR / "obj" / "sum.obj"), "/dev/null"], None),
+    "asmgo": (["run/asmgo.py", str(PROGRAMS_DIR / "asm" / "print.asm")], None),
+    "malgo": (["run/malgo.py", str(PROGRAMS_DIR / "mal" / "print.mal")], None)
+}
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Duck Machine tool startup benchmark")
+    parser.add_argument("entry_points", nargs="*",
+                        help=f"Entry points to measure: {', '.join(ENTRY_POINTS)} (default all)")
+    parser.add_argument("-n", "--repeat", type=int, default=10,
+                        help="Runs per entry point")
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'),
+                        default=sys.stdout, help="Write results (JSON) here")
+    parser.add_argument("--budget", action="append", default=[],
+                        metavar="NAME=MS", help="Allowed median startup time")
+    parser.add_argument("--imports", action="store_true",
+                        help="Log the slowest imports of each entry point")
+    args = parser.parse_args()
+    unknown = [name for name in args.entry_points if name not in ENTRY_POINTS]
+    if unknown:
+        parser.error(f"Unknown entry point {unknown[0]}")
+    return args
+
+
+def command(name: str, *options: str) -> tuple[list[str], pathlib.Path]:
+    """Command line and input file for an entry point"""
+    args, stdin = ENTRY_POINTS[name]
+    return [sys.executable, *options, *args], stdin
+
+
+def time_run(name: str) -> float:
+    """Wall seconds for one run of an entry point.  Raises
+    RuntimeError if it fails.
+    """
+    argv, stdin = command(name)
+    stdin = open(stdin) if stdin else subprocess.DEVNULL
+    try:
+        started = time.perf_counter()
+        result = subprocess.run(argv, cwd=PROJECT_DIR, stdin=stdin,
+                                capture_output=True, text=True)
+        wall = time.perf_counter() - started
+    finally:
+        if stdin is not subprocess.DEVNULL:
+            stdin.close()
+    if result.returncode != 0:
+        message = result.stderr.strip().splitlines()
+        raise RuntimeError(message[-1] if message else f"exit status {result.returncode}")
+    return wall
+
+
+def slowest_imports(name: str, count: int=8) -> list[tuple[str, int]]:
+    """The count modules with the largest cumulative import
+    time (microseconds) in one run of an entry point
+    """
+    argv, stdin = command(name, "-X", "importtime")
+    stdin = open(stdin) if stdin else subprocess.DEVNULL
+    try:
+        result = subprocess.run(argv, cwd=PROJECT_DIR, stdin=stdin,
+                                capture_output=True, text=True)
+    finally:
+        if stdin is not subprocess.DEVNULL:
+            stdin.close()
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((fields[2].strip(), int(fields[1])))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return imports[:count]
+
+
+def measure(name: str, repeat: int) -> dict:
+    """Startup time of an entry point, in milliseconds"""
+    try:
+        walls = [time_run(name) for _ in range(repeat)]
+    except RuntimeError as e:
+        return {"status": "error", "message": str(e)}
+    return {
+        "status": "ok",
+        "min_ms": 1000 * min(walls),
+        "median_ms": 1000 * statistics.median(walls)
+    }
+
+
+def over_budget(results: dict, budgets: list[str]) -> list[str]:
+    """Descriptions of entry points slower than their budget"""
+    failures = []
+    for budget in budgets:
+        name, _, limit = budget.partition("=")
+        result = results["entry_points"].get(name)
+        if result is None:
+            continue
+        if result["status"] != "ok":
+            failures.append(f"{name}: {result['message']}")
+        elif result["median_ms"] > float(limit):
+            failures.append(f"{name}: {result['median_ms']:.1f} ms, budget {limit} ms")
+    return failures
+
+
+def main(names: list[str], repeat: int, output: io.IOBase,
+         budgets: list[str]=[], imports: bool=False) -> bool:
+    """Run the benchmark; False if an entry point is over budget"""
+    results = {
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "entry_points": {}
+    }
+    for name in names or ENTRY_POINTS:
+        log.debug(f"Starting {name}")
+        results["entry_points"][name] = measure(name, repeat)
+        if imports and name != "python":
+            for module, micros in slowest_imports(name):
+                log.info(f"{name}: {module} {micros / 1000:.1f} ms")
+    json.dump(results, output, indent=2)
+    print(file=output)
+    failures = over_budget(results, budgets)
+    for failure in failures:
+        log.warning(f"Over budget: {failure}")
+    return not failures
+
+
+if __name__ == "__main__":
+    args = cli()
+    ok = main(args.entry_points, args.repeat, args.output,
+              budgets=args.budget, imports=args.imports)
+    sys.exit(0 if ok else 1)
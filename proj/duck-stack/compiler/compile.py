@@ -34,19 +34,27 @@ def cli() -> object:
     return args
 
 
-def main(sourcefile: io.FileIO, objfile: io.IOBase):
+def compile_program(sourcefile: io.IOBase) -> list[str]:
+    """Assembly code lines for a Mallard program.  Raises
+    InputError or LexicalError if the program cannot be parsed.
+    """
     context = codegen_context.Context()
     context.add_line("# Lovingly crafted by the robots of CIS 211")
-    context.add_line(f"# {datetime.datetime.now()} from {sourcefile.name}")
+    name = getattr(sourcefile, "name", "<string>")
+    context.add_line(f"# {datetime.datetime.now()} from {name}")
     context.add_line("#")
+    exp = parse(sourcefile)
+    log.debug(f"Parsed to: {exp}")
+    work_register = context.allocate_register()
+    exp.gen(context, work_register)
+    context.free_register(work_register)
+    context.add_line("\tHALT  r0,r0,r0")
+    return context.get_lines()
+
+
+def main(sourcefile: io.FileIO, objfile: io.IOBase):
     try:
-        exp = parse(sourcefile)
-        log.debug(f"Parsed to: {exp}")
-        work_register = context.allocate_register()
-        exp.gen(context, work_register)
-        context.free_register(work_register)
-        context.add_line("\tHALT  r0,r0,r0")
-        assm = context.get_lines()
+        assm = compile_program(sourcefile)
         log.debug(f"assm = {assm}")
         for line in assm:
             print(line, file=objfile)
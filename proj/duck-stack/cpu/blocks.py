@@ -0,0 +1,411 @@
+"""
+Basic-block translator for the Duck Machine.
+
+For long-running headless jobs, this engine finds basic blocks
+(straight-line runs of instructions ending in a jump or HALT)
+in the object code and translates each block into Python source
+code, which is compiled with compile() and exec().  Registers
+become local variables of the generated function, and loads and
+stores at constant (PC-relative) addresses become direct accesses
+to the memory array.  A block that jumps back to its own start (the usual
+shape of a loop in compiled Mallard) becomes a Python while loop,
+so its registers stay in local variables for the whole loop.
+
+Each block function returns the address of the next block, or
+None to halt.  Anything the translator cannot handle (a fetch
+from a memory-mapped device address, or a word that is not a
+valid instruction) is executed by CPU.step instead.
+
+Like the threaded engine, this engine bypasses memory events, so
+it is only for headless use.
+"""
+
+import context  # Python import search from project root
+from instruction_set.instr_format import Instruction, OpCode, CondFlag, decode, to_word
+from cpu.threaded import alu_result, M, Z, P, V, NEVER, ALWAYS
+
+from typing import Callable, Optional
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Longest block we will translate; longer straight-line
+# code just continues in the next block.
+MAX_BLOCK = 128
+
+SYMBOLS = {
+    OpCode.ADD: "+",
+    OpCode.SUB: "-",
+    OpCode.MUL: "*",
+    OpCode.DIV: "//"
+}
+
+# A block function takes the register list and the engine state
+# (condition code and step count), and returns the address of
+# the next block (or None)
+Block = Callable[[list[int], list[int]], Optional[int]]
+
+
+def _flag_expr(var: str) -> str:
+    """Python expression for the condition code of a result"""
+    return f"{M} if {var} < 0 else {P} if {var} > 0 else {Z}"
+
+
+class _Source(object):
+    """Lines of generated Python source, with indentation"""
+
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+        self.depth = 0
+
+    def add(self, line: str) -> None:
+        self.lines.append("    " * self.depth + line)
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+class BlockEngine(object):
+    """Translates and runs the program in a CPU's memory one
+    basic block at a time.  As with the threaded engine, blocks
+    work on the CPU's register file (copying the registers they
+    use into locals) and keep the condition code as an int.
+    """
+
+    def __init__(self, cpu: "CPU") -> None:
+        self.cpu = cpu
+        self.memory = cpu.memory
+        self.regs = cpu.regs
+        # Condition code (as an int) and count of steps executed
+        self.state = [CondFlag.ALWAYS.value, 0]
+        # Translated blocks by start address
+        self.blocks: dict[int, Block] = {}
+        # Addresses covered by each block, and blocks covering
+        # each address, so that a store into code can discard the
+        # blocks it changes.
+        self.extent: dict[int, range] = {}
+        self.owners: dict[int, set[int]] = {}
+        self.globals = {
+            # A flat array of words, unless memory is paged
+            "mem": getattr(self.memory, "_mem", None),
+            "get": self.memory.get,
+            "put": self.memory.put,
+            "to_word": to_word,
+            "owners": self.owners,
+            "devices": getattr(self.memory, "hooks_write", {}),
+            "invalidate": self.invalidate
+        }
+
+    def run(self, from_addr: int = 0) -> None:
+        """Execute from from_addr until a HALT"""
+        self._sync_in()
+        blocks, regs, state = self.blocks, self.regs, self.state
+        pc = from_addr
+        self.memory.block_write_hooks.append(self.invalidate_range)
+        try:
+            while pc is not None:
+                try:
+                    while pc is not None:
+                        pc = blocks[pc](regs, state)
+                except KeyError:
+                    if pc in blocks:
+                        raise  # From inside the block, not ours
+                    self._translate(pc)
+        finally:
+            self.memory.block_write_hooks.remove(self.invalidate_range)
+            self._sync_out(halted=pc is None)
+
+    def _sync_in(self) -> None:
+        self.state[0] = self.cpu.cc
+        self.state[1] = 0
+
+    def _sync_out(self, halted: bool) -> None:
+        self.cpu.cc = self.state[0]
+        self.cpu.step_count = self.state[1]
+        self.cpu.halted = halted
+
+    def invalidate(self, addr: int) -> None:
+        """Memory at addr has changed; discard blocks covering it"""
+        for start in self.owners.pop(addr, ()):
+            self.blocks.pop(start, None)
+            for covered in self.extent.pop(start):
+                owners = self.owners.get(covered)
+                if owners is not None:
+                    owners.discard(start)
+                    if not owners:
+                        del self.owners[covered]
+
+    def invalidate_range(self, base: int, length: int) -> None:
+        """Memory from base to base + length - 1 has changed"""
+        if length > len(self.owners):
+            changed = [addr for addr in self.owners if base <= addr < base + length]
+        else:
+            changed = [addr for addr in range(base, base + length) if addr in self.owners]
+        for addr in changed:
+            self.invalidate(addr)
+
+    def _install(self, start: int, end: int, block: Block) -> None:
+        self.blocks[start] = block
+        self.extent[start] = range(start, end)
+        for addr in range(start, end):
+            self.owners.setdefault(addr, set()).add(start)
+
+    def _fetch(self, addr: int) -> Optional[Instruction]:
+        """The instruction at addr, or None if it cannot be
+        translated
+        """
+        if addr < 0 or addr >= self.memory.capacity:
+            return None
+        if addr in getattr(self.memory, "hooks_read", {}):
+            return None
+        try:
+            return decode(self.memory.dump(range(addr, addr + 1))[0])
+        except ValueError:
+            return None
+
+    def _translate(self, start: int) -> None:
+        """Find the block starting at start and install its
+        translation (or a fallback to CPU.step)
+        """
+        instrs: list[tuple[int, Instruction]] = []
+        addr = start
+        while len(instrs) < MAX_BLOCK:
+            instr = self._fetch(addr)
+            if instr is None:
+                break
+            instrs.append((addr, instr))
+            addr += 1
+            if instr.cond.value == ALWAYS and (
+                    instr.op is OpCode.HALT or
+                    (instr.reg_target == 15 and instr.op is not OpCode.STORE)):
+                break
+        if not instrs:
+            self._install(start, start + 1, self._fallback(start))
+            return
+        source = self._generate(start, instrs, addr)
+        log.debug(f"Block at {start}:\n{source}")
+        namespace = dict(self.globals)
+        exec(compile(source, f"<block {start}>", "exec"), namespace)
+        self._install(start, addr, namespace[f"block_{start}"])
+
+    def _fallback(self, addr: int) -> Block:
+        """Execute one instruction with CPU.step"""
+        cpu = self.cpu
+        def step(regs: list[int], state: list[int]) -> Optional[int]:
+            regs[15] = addr
+            cpu.cc = state[0]
+            try:
+                cpu.step()
+            finally:
+                state[0] = cpu.cc
+            state[1] += 1
+            return None if cpu.halted else regs[15]
+        return step
+
+    def _generate(self, start: int, instrs: list[tuple[int, Instruction]],
+                  end: int) -> str:
+        """Python source for the block start..end-1"""
+        written = sorted({instr.reg_target for _, instr in instrs
+                          if instr.op is not OpCode.STORE} - {0, 15})
+        used = sorted({reg for _, instr in instrs
+                       for reg in (instr.reg_target, instr.reg_src1, instr.reg_src2)}
+                      - {0, 15})
+        sets_cc = any(instr.op in SYMBOLS for _, instr in instrs)
+        flag_live = self._flag_liveness(instrs)
+        loops = any(self._const_jump(addr, instr) == start
+                    for addr, instr in instrs)
+
+        src = _Source()
+
+        def reg(r: int, addr: int) -> str:
+            if r == 0:
+                return "0"
+            if r == 15:
+                return str(addr)
+            return f"r{r}"
+
+        def const(r: int, addr: int) -> Optional[int]:
+            return 0 if r == 0 else addr if r == 15 else None
+
+        def sync(done: int, pc: Optional[int] = None) -> None:
+            """Write back registers, condition code, and the step
+            count after done instructions of the block
+            """
+            for r in written:
+                src.add(f"R[{r}] = r{r}")
+            if sets_cc:
+                src.add("S[0] = cc")
+            src.add(f"S[1] = n + {done}")
+            if pc is not None:
+                src.add(f"R[15] = {pc}")
+
+        def exit_to(target: str, done: int) -> None:
+            if target == str(start) and loops:
+                src.add(f"n += {done}")
+                src.add("continue")
+            else:
+                sync(done)
+                src.add(f"return {target}")
+
+        src.add(f"def block_{start}(R, S):")
+        src.depth += 1
+        for r in used:
+            src.add(f"r{r} = R[{r}]")
+        src.add("cc = S[0]")
+        src.add("n = S[1]")
+        if loops:
+            src.add("while True:")
+            src.depth += 1
+
+        for i, (addr, instr) in enumerate(instrs):
+            mask = instr.cond.value
+            op, t = instr.op, instr.reg_target
+            src.add(f"# {addr}: {instr}")
+            if mask == NEVER:
+                continue
+            base = src.depth
+            if mask != ALWAYS:
+                src.add(f"if cc & {mask}:")
+                src.depth += 1
+            left_c = const(instr.reg_src1, addr)
+            right_c = const(instr.reg_src2, addr)
+            if right_c is not None:
+                right_c += instr.offset
+            left = reg(instr.reg_src1, addr)
+            if right_c is not None:
+                right = str(right_c)
+            elif instr.offset:
+                right = f"{reg(instr.reg_src2, addr)} + {instr.offset}"
+            else:
+                right = reg(instr.reg_src2, addr)
+            if left_c is not None and right_c is not None:
+                address = str(left_c + right_c)
+            elif left_c == 0:
+                address = right
+            else:
+                address = f"{left} + {right}"
+            nxt = addr + 1
+
+            if op is OpCode.HALT:
+                sync(i + 1, pc=nxt)
+                src.add("return None")
+            elif op is OpCode.LOAD:
+                target = "_x" if t in (0, 15) else f"r{t}"
+                if self._direct(address):
+                    if t != 0:
+                        src.add(f"{target} = mem[{address}]")
+                    elif mask != ALWAYS:
+                        src.add("pass")  # Nothing to do, but a body
+                else:
+                    sync(i, pc=nxt)
+                    src.add(f"{target} = get({address})")
+                if t == 15:
+                    exit_to(target, i + 1)
+            elif op is OpCode.STORE:
+                value = str(nxt) if t == 15 else reg(t, addr)
+                if self._direct(address):
+                    src.add("try:")
+                    src.add(f"    mem[{address}] = {value}")
+                    src.add("except OverflowError:")
+                    src.add(f"    mem[{address}] = to_word({value})")
+                    src.add(f"if {address} in owners:")
+                    src.depth += 1
+                    sync(i + 1)
+                    src.add(f"invalidate({address})")
+                    src.add(f"return {nxt}")
+                    src.depth -= 1
+                else:
+                    sync(i, pc=nxt)
+                    src.add(f"_a = {address}")
+                    src.add(f"put(_a, {value})")
+                    # A device (e.g., DMA) may have changed any of memory
+                    src.add("if _a in owners or _a in devices:")
+                    src.depth += 1
+                    src.add("invalidate(_a)")
+                    src.add(f"S[1] = n + {i + 1}")
+                    src.add(f"return {nxt}")
+                    src.depth -= 1
+            else:
+                target = "_x" if t in (0, 15) else f"r{t}"
+                if left_c is not None and right_c is not None:
+                    result, flag = alu_result(op, left_c, right_c)
+                    if t == 15:
+                        target = str(result)
+                    else:
+                        src.add(f"{target} = {result}")
+                    if flag_live[i]:
+                        src.add(f"cc = {flag}")
+                elif op is OpCode.DIV:
+                    src.add("try:")
+                    src.add(f"    {target} = {left} // ({right})")
+                    if flag_live[i]:
+                        src.add(f"    cc = {_flag_expr(target)}")
+                    src.add("except ZeroDivisionError:")
+                    src.add(f"    {target} = 0")
+                    src.add(f"    cc = {V}")
+                else:
+                    src.add(f"{target} = {left} {SYMBOLS[op]} ({right})")
+                    if flag_live[i]:
+                        src.add(f"cc = {_flag_expr(target)}")
+                if t == 15:
+                    exit_to(target, i + 1)
+            src.depth = base
+
+        last_addr, last = instrs[-1]
+        if not (last.cond.value == ALWAYS and
+                (last.op is OpCode.HALT or
+                 (last.reg_target == 15 and last.op is not OpCode.STORE))):
+            # Fell off the end of the block
+            exit_to(str(end), len(instrs))
+        return src.text()
+
+    def _direct(self, address: str) -> bool:
+        """Can a constant address be accessed directly in the
+        memory list (in bounds and not a device address)?
+        """
+        try:
+            addr = int(address)
+        except ValueError:
+            return False
+        return (self.globals["mem"] is not None and
+                0 <= addr < self.memory.capacity and
+                addr not in getattr(self.memory, "hooks_read", {}) and
+                addr not in getattr(self.memory, "hooks_write", {}))
+
+    @staticmethod
+    def _const_jump(addr: int, instr: Instruction) -> Optional[int]:
+        """Target of a jump to a constant address, e.g.,
+        ADD r15,r0,r15[-4]
+        """
+        if instr.reg_target != 15 or instr.op not in SYMBOLS:
+            return None
+        if instr.reg_src1 not in (0, 15) or instr.reg_src2 not in (0, 15):
+            return None
+        left = 0 if instr.reg_src1 == 0 else addr
+        right = (0 if instr.reg_src2 == 0 else addr) + instr.offset
+        return alu_result(instr.op, left, right)[0]
+
+    @staticmethod
+    def _flag_liveness(instrs: list[tuple[int, Instruction]]) -> list[bool]:
+        """For each instruction, whether the condition code it sets
+        can be observed before the next unconditional ALU operation
+        overwrites it.  Predicated instructions, memory operations
+        (which may exit the block), and the end of the block all
+        observe it.
+        """
+        live = True
+        result = len(instrs) * [True]
+        for i in range(len(instrs) - 1, -1, -1):
+            _, instr = instrs[i]
+            mask = instr.cond.value
+            if instr.op in SYMBOLS:
+                result[i] = live or instr.reg_target == 15
+                if mask == ALWAYS:
+                    live = False
+            else:
+                live = True
+            if mask != ALWAYS:
+                live = True
+        return result
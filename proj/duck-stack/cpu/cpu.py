@@ -9,14 +9,36 @@ import context  #  Python import search from project root
 from instruction_set.instr_format import Instruction, OpCode, CondFlag, decode
 
 from cpu.memory import Memory
-from cpu.register import Register, ZeroRegister
+from cpu.register import RegisterView
 from cpu.mvc import MVCEvent, MVCListenable
+# cpu.threaded and cpu.blocks are imported when first used,
+# since most runs use only one engine (or none)
+
+import operator
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# The execution core works on plain ints rather than OpCode and
+# CondFlag members, whose operations are comparatively slow.
+# Enums appear only at the API and in displays (e.g. Instruction).
+HALT = OpCode.HALT.value
+LOAD = OpCode.LOAD.value
+STORE = OpCode.STORE.value
+CC_M = CondFlag.M.value
+CC_Z = CondFlag.Z.value
+CC_P = CondFlag.P.value
+CC_V = CondFlag.V.value
+
+# ALU.ALU_OPS for the arithmetic operations, indexed by opcode
+ARITH_BY_CODE = [None] * (max(op.value for op in OpCode) + 1)
+for _op, _fn in [(OpCode.ADD, operator.add), (OpCode.SUB, operator.sub),
+                 (OpCode.MUL, operator.mul), (OpCode.DIV, operator.floordiv)]:
+    ARITH_BY_CODE[_op.value] = _fn
+ARITH_BY_CODE = tuple(ARITH_BY_CODE)
+
 class ALU(object):
     """The arithmetic logic unit (also called a "functional unit"
     in a modern CPU) executes a selected function but does not
@@ -62,6 +84,40 @@ class CPUStep(MVCEvent):
         self.instr_word = instr_word
         self.instr = instr
 
+class DecodeCache(object):
+    """Decoded instructions, keyed by the memory address they
+    were fetched from.  A loop body that runs millions of times
+    is decoded only once.  Each entry remembers the word it was
+    decoded from, and is replaced if the word at that address has
+    changed, so self-modifying code still sees its new
+    instructions.  (Checking the fetched word, rather than
+    listening for memory writes, keeps memory free of listeners
+    in headless runs.)
+    """
+
+    def __init__(self) -> None:
+        # addr -> (word, fields) where fields is as from decode_fields
+        self._decoded: dict[int, tuple[int, tuple]] = {}
+
+    def decode(self, addr: int, word: int) -> Instruction:
+        """The decoded form of word, which was fetched from addr"""
+        return self.decode_fields(addr, word)[6]
+
+    def decode_fields(self, addr: int, word: int) -> tuple:
+        """The fields of word, which was fetched from addr, as ints
+        (opcode, condition mask, target, src1, src2, offset),
+        followed by the Instruction
+        """
+        entry = self._decoded.get(addr)
+        if entry is not None and entry[0] == word:
+            return entry[1]
+        instr = decode(word)
+        fields = (instr.op.value, instr.cond.value, instr.reg_target,
+                  instr.reg_src1, instr.reg_src2, instr.offset, instr)
+        self._decoded[addr] = (word, fields)
+        return fields
+
+
 class CPU(MVCListenable):
     """Duck Machine central processing unit (CPU)
     has 16 registers (including r0 that always holds zero
@@ -75,60 +131,143 @@ class CPU(MVCListenable):
     def __init__(self, memory: Memory):
         super().__init__()
         self.memory = memory  # Not part of CPU; what we really have is a connection
-        self.registers = [ ZeroRegister(), Register(), Register(), Register(),
-                   Register(), Register(), Register(), Register(),
-                   Register(), Register(), Register(), Register(),
-                   Register(), Register(), Register(), Register() ]
-        self.condition = CondFlag.ALWAYS
+        # The register file is a flat list of ints.  The execution
+        # core never writes regs[0], so r0 always holds zero, and
+        # regs[15] is the program counter.
+        self.regs = 16 * [0]
+        # Register objects are a view of the same list, for the
+        # graphical display and other code outside the core
+        self.registers = [ RegisterView(self.regs, i) for i in range(16) ]
+        self.cc = CondFlag.ALWAYS.value  # Condition code, as an int
         self.halted = False
+        self.step_count = 0  # Steps executed by the last run
         self.alu = ALU()
         self.pc = self.registers[15]
+        self.decoder = DecodeCache()
+        self.profiler = None  # See cpu/profiler.py
+        self.tracer = None    # See cpu/trace.py
+
+    @property
+    def condition(self) -> CondFlag:
+        """The condition code"""
+        return CondFlag(self.cc)
+
+    @condition.setter
+    def condition(self, flag: CondFlag) -> None:
+        self.cc = flag.value
+
+    def clone(self) -> "CPU":
+        """A CPU in the same state, with a copy-on-write fork of
+        the memory (see Memory.fork), but no listeners.  Clones
+        share the decode cache, which checks every word it reuses.
+        """
+        twin = CPU(self.memory.fork())
+        twin.regs[:] = self.regs
+        twin.cc = self.cc
+        twin.halted = self.halted
+        twin.step_count = self.step_count
+        twin.decoder = self.decoder
+        return twin
 
     def step(self):
         """One fetch/decode/execute step"""
+        regs = self.regs
         # Fetch
-        instr_addr = self.pc.get()
+        instr_addr = regs[15]
         instr_word = self.memory.get(instr_addr)
 
-        # Decode
-        instr = decode(instr_word)
+        # Decode (or reuse the instruction decoded at this address)
+        op, cond, target, src1, src2, offset, instr = \
+            self.decoder.decode_fields(instr_addr, instr_word)
         # Display the CPU state when we have decoded the instruction,
-        # before we have executed it
-        self.notify_all(CPUStep(self, instr_addr, instr_word, instr))
+        # before we have executed it (if anything is displaying it)
+        if self.listeners:
+            self.notify_all(CPUStep(self, instr_addr, instr_word, instr))
+        if self.profiler is not None:
+            self.profiler.record(self, instr_addr, instr)
+        if self.tracer is not None:
+            self.tracer.fetched(self, instr_addr, instr_word)
 
         # Execute
         # Check instruction predicate
-        predicate = self.condition & instr.cond
-        if predicate is CondFlag.NEVER:
+        if not self.cc & cond:
             # Increment program counter
-            self.pc.put(self.pc.get() + 1)
-        else:
-            # Predicate satisfied
-            left = self.registers[instr.reg_src1].get()
-            right = self.registers[instr.reg_src2].get() + instr.offset
-            result, cond_flag = self.alu.exec(instr.op, left, right)
+            regs[15] = instr_addr + 1
+            return
+        # Predicate satisfied
+        left = regs[src1]
+        right = regs[src2] + offset
 
-            # Increment program counter
-            self.pc.put(self.pc.get() + 1)
-
-            # Now act based on OpCode
-            if instr.op is OpCode.STORE:
-                self.memory.put(result, self.registers[instr.reg_target].get())
-            elif instr.op is OpCode.LOAD:
-                self.registers[instr.reg_target].put(self.memory.get(result))
-            elif instr.op is OpCode.HALT:
-                self.halted = True
-            else: # ADD, SUB, MUL, or DIV
-                self.registers[instr.reg_target].put(result)
-                self.condition = cond_flag
-
-    def run(self, from_addr=0,  single_step=False) -> None:
-        """Step the CPU until it executes a HALT"""
+        # Increment program counter
+        regs[15] = instr_addr + 1
+
+        # Now act based on OpCode
+        if op == STORE:
+            self.memory.put(left + right, regs[target])
+        elif op == LOAD:
+            value = self.memory.get(left + right)
+            if target != 0:
+                regs[target] = value
+        elif op == HALT:
+            self.halted = True
+        else: # ADD, SUB, MUL, or DIV
+            try:
+                result = ARITH_BY_CODE[op](left, right)
+            except ZeroDivisionError:
+                result, cc = 0, CC_V
+            else:
+                cc = CC_M if result < 0 else CC_P if result > 0 else CC_Z
+            if target != 0:
+                regs[target] = result
+            self.cc = cc
+
+    def run(self, from_addr=0,  single_step=False, profiler=None,
+            tracer=None) -> None:
+        """Step the CPU until it executes a HALT.  If a profiler
+        (see cpu/profiler.py) is given, it records every step;
+        if a tracer (see cpu/trace.py) is given, it writes a trace
+        record for every step.
+        """
         self.halted = False
-        self.registers[15].put(from_addr)
+        self.regs[15] = from_addr
+        self.profiler = profiler
+        self.tracer = tracer
         step_count = 0
-        while not self.halted:
-            if single_step:
-                input(f"Step {step_count}; press enter")
-            self.step()
-            step_count += 1
+        try:
+            while not self.halted:
+                if single_step:
+                    input(f"Step {step_count}; press enter")
+                self.step()
+                if tracer is not None:
+                    tracer.retired(self)
+                step_count += 1
+        finally:
+            self.step_count = step_count
+            self.profiler = None
+            self.tracer = None
+            if tracer is not None:
+                tracer.flush()
+
+    def run_threaded(self, from_addr=0, tracer=None) -> None:
+        """Like run, but executing the program as threaded code
+        (see cpu/threaded.py). Much faster, but without CPUStep
+        events, so not for use with the graphical display.  A
+        tracer records the same steps as it would for run.
+        """
+        from cpu.threaded import ThreadedEngine
+        self.halted = False
+        try:
+            ThreadedEngine(self, tracer).run(from_addr)
+        finally:
+            if tracer is not None:
+                tracer.flush()
+
+    def run_blocks(self, from_addr=0) -> None:
+        """Like run, but translating each basic block of the
+        program to Python code (see cpu/blocks.py). Fastest
+        for loops, but only for headless use, and it cannot be
+        traced (a block does not stop between instructions).
+        """
+        from cpu.blocks import BlockEngine
+        self.halted = False
+        BlockEngine(self).run(from_addr)
@@ -0,0 +1,118 @@
+"""
+Devices for the memory-mapped input and output ports.
+
+A device is just the hook function MemoryMappedIO calls:  an input
+device is called with the address and returns a value, and an
+output device is called with the address and the value.  The
+interactive ones in duck_machine.py prompt and print for every
+value; these instead take input from any iterable (or a file of
+integers) and collect output in a buffer that is written in bulk.
+
+AsyncInput feeds input from an asyncio coroutine, for running the
+CPU in a worker thread (see run_async) while an event loop
+produces its input.
+"""
+
+import context  # Python import search from project root
+from cpu.memory import MemoryMappedIO
+
+import io
+from typing import AsyncIterator, Iterable, Optional
+
+# The addresses of the ports
+INPUT_PORT = 510
+OUTPUT_PORT = 511
+
+
+class InputExhausted(Exception):
+    """The program read more input than was supplied"""
+    pass
+
+
+class InputDevice(object):
+    """Supplies the values of an iterable, one per read"""
+
+    def __init__(self, values: Iterable[int]) -> None:
+        self.values = iter(values)
+        self.count = 0   # Values read so far
+
+    @classmethod
+    def from_file(cls, file: io.IOBase) -> "InputDevice":
+        """Integers from a text file, separated by whitespace"""
+        return cls(int(token) for line in file for token in line.split())
+
+    def __call__(self, addr: int) -> int:
+        try:
+            value = next(self.values)
+        except StopIteration:
+            raise InputExhausted(f"Program read more than {self.count} inputs")
+        self.count += 1
+        return value
+
+
+class BufferedOutput(object):
+    """Collects output values, writing them to a sink (if any) a
+    buffer at a time.  Without a sink, keeps every value in the
+    list self.values.
+    """
+
+    def __init__(self, sink: Optional[io.IOBase]=None, fmt: str="{}\n",
+                 buffer_size: int=1024) -> None:
+        self.sink = sink
+        self.fmt = fmt
+        self.buffer_size = buffer_size
+        self.values: list[int] = []
+
+    def __call__(self, addr: int, value: int) -> None:
+        self.values.append(value)
+        if self.sink is not None and len(self.values) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write out buffered values"""
+        if self.sink is None:
+            return
+        self.sink.write("".join(self.fmt.format(value) for value in self.values))
+        self.sink.flush()
+        self.values.clear()
+
+
+class AsyncInput(object):
+    """Input from an asynchronous iterator running on an event
+    loop, for a CPU running in another thread.  Each read blocks
+    the CPU thread until the loop produces the next value.
+    """
+
+    def __init__(self, values: AsyncIterator[int],
+                 loop: "asyncio.AbstractEventLoop") -> None:
+        self.values = values
+        self.loop = loop
+        self.count = 0
+
+    async def _next(self) -> int:
+        try:
+            return await self.values.__anext__()
+        except StopAsyncIteration:
+            raise InputExhausted(f"Program read more than {self.count} inputs")
+
+    def __call__(self, addr: int) -> int:
+        import asyncio   # Only for asynchronous runs; slow to import
+        value = asyncio.run_coroutine_threadsafe(self._next(), self.loop).result()
+        self.count += 1
+        return value
+
+
+def attach(memory: MemoryMappedIO, input_device=None, output_device=None) -> None:
+    """Map devices to the input and output ports"""
+    if input_device is not None:
+        memory.map_address_in(INPUT_PORT, input_device)
+    if output_device is not None:
+        memory.map_address_out(OUTPUT_PORT, output_device)
+
+
+async def run_async(cpu: "CPU", from_addr: int=0) -> None:
+    """Run the CPU in a worker thread, so that the event loop
+    remains free to feed an AsyncInput device
+    """
+    import asyncio
+    await asyncio.get_running_loop().run_in_executor(None, cpu.run, from_addr)
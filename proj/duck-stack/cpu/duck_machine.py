@@ -8,40 +8,75 @@ of the Duck Machine series of projects.)
 """
 
 import context
-from cpu.memory import Memory, MemoryMappedIO
+from cpu.memory import Memory, MemoryMappedIO, PagedMemoryMappedIO, DMAController
 from cpu.cpu import CPU
-import cpu.view as view
+from cpu.devices import InputDevice, BufferedOutput, attach
+from instruction_set.objfile import read_object
+# Optional subsystems (cpu.view with its graphical display,
+# cpu.profiler, cpu.trace) are imported only when requested,
+# so that a headless run starts quickly.
 
 import argparse
 import io
+import sys
+import time
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Memory size in words.  The input and output ports are at
+# 510 and 511, so memory must be at least this large.
+MEMORY_SIZE = 512
+# Larger memories are allocated a page at a time, as used
+PAGED_OVER = 1 << 16
+
 
 def cli() -> object:
     """Get arguments from command line"""
     parser = argparse.ArgumentParser(description="Duck Machine Simulator")
-    parser.add_argument("objfile", type=argparse.FileType('r'),
-                            help="Object file input")
+    parser.add_argument("objfile", type=argparse.FileType('rb'),
+                            help="Object file input (text or binary)")
     parser.add_argument("-d", "--display", help="Graphical cpu_display",
                         action="store_true")
     parser.add_argument("-s", "--step", help="Single step mode",
                         action="store_true")
+    parser.add_argument("--fps", type=float, default=30,
+                        help="Redraw the display at most this often per second")
+    parser.add_argument("--steps-per-frame", type=int,
+                        help="Redraw the display every this many steps instead")
+    parser.add_argument("--input-file", type=argparse.FileType('r'),
+                        help="Read input values from this file instead of prompting")
+    parser.add_argument("--output-file", type=argparse.FileType('w'),
+                        help="Write output values to this file, one per line")
+    parser.add_argument("--memory", type=int, default=MEMORY_SIZE,
+                        help=f"Memory size in words (over {PAGED_OVER} uses paged memory)")
+    parser.add_argument("--dma", help="Host file for the DMA device (addresses 506-509)")
+    parser.add_argument("--dma-writable", action="store_true",
+                        help="Allow DMA transfers into the host file")
+    parser.add_argument("-e", "--engine", help="Execution engine",
+                        choices=["step", "threaded", "blocks"], default="step")
+    parser.add_argument("--stats", type=argparse.FileType('w'),
+                        help="Write run statistics (JSON) to this file")
+    parser.add_argument("-p", "--profile", action="store_true",
+                        help="Print execution counts per instruction at halt")
+    parser.add_argument("-t", "--trace", type=argparse.FileType('wb'),
+                        help="Write a binary execution trace to this file")
+    parser.add_argument("--trace-ring", type=int, metavar="N",
+                        help="Trace only the last N steps, saved when the run stops")
     args = parser.parse_args()
+    if args.trace_ring and not args.trace:
+        parser.error("--trace-ring needs --trace FILE to save the steps in")
+    if args.trace and args.engine == "blocks":
+        parser.error("the blocks engine cannot be traced; use -e step or -e threaded")
     return args
 
 def load(file: io.IOBase, memory: Memory) -> None:
-    addr = 0
     log.debug(f"Loading from address 0")
-    for line in file:
-        word = int(line)
-        log.debug(f"Instruction value {word}")
-        memory.put(addr, word)
-        log.debug(f"Loaded {word} from address {addr} ")
-        addr += 1
+    words, symbols = read_object(file)
+    memory.load_words(words, 0)
+    log.debug(f"Loaded {len(words)} words")
 
 def duck_output(addr: int, value: int) -> None:
     print(f"Quack!: {value}")
@@ -49,12 +84,48 @@ def duck_output(addr: int, value: int) -> None:
 def duck_input(addr: int) -> int:
     return int(input("Quack! Gimme an int! "))
 
-def main(objfile: io.IOBase, display=False, single_step=False):
+def peak_rss_kb() -> int:
+    """Peak resident set size of this process in KiB,
+    or None where the platform does not report it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024  # Reported in bytes rather than KiB
+    return rss
+
+def write_stats(stats: io.IOBase, cpu: CPU, engine: str, seconds: float) -> None:
+    """Steps, run time, and memory use of a completed run, as JSON"""
+    import json
+    record = {
+        "engine": engine,
+        "steps": cpu.step_count,
+        "seconds": seconds,
+        "ips": cpu.step_count / seconds if seconds > 0 else None,
+        "peak_rss_kb": peak_rss_kb()
+    }
+    json.dump(record, stats)
+    print(file=stats)
+
+def main(objfile: io.IOBase, display=False, single_step=False, engine="step",
+         stats: io.IOBase=None, profile=False, fps: float=30,
+         steps_per_frame: int=None, input_file: io.IOBase=None,
+         output_file: io.IOBase=None, dma: str=None, dma_writable=False,
+         memory_size: int=MEMORY_SIZE, trace: io.IOBase=None,
+         trace_ring: int=None):
     """" Run a Duck Machine program from
     object code file.
     """
     log.debug("Creating the memory")
-    mem = MemoryMappedIO(512)
+    if memory_size < MEMORY_SIZE:
+        raise ValueError(f"Memory must be at least {MEMORY_SIZE} words")
+    if memory_size > PAGED_OVER:
+        mem = PagedMemoryMappedIO(memory_size)
+    else:
+        mem = MemoryMappedIO(memory_size)
     # We'd like to make it simple to trigger I/O with
     # a single instruction, so it would be good to fit
     # the memory mapped addresses into the offset field.
@@ -62,21 +133,69 @@ def main(objfile: io.IOBase, display=False, single_step=False):
     # reserve addresses 510 and 511 for input and output
     # respectively.
     log.debug("Mapping addresses 510,511 to input and output ports")
-    mem.map_address_in(510, duck_input)
-    mem.map_address_out(511, duck_output)
+    input_device = InputDevice.from_file(input_file) if input_file else duck_input
+    output_device = BufferedOutput(output_file) if output_file else duck_output
+    attach(mem, input_device, output_device)
+    if dma:
+        log.debug(f"Mapping addresses 506-509 to DMA with {dma}")
+        dma_device = DMAController(mem, dma, writable=dma_writable)
     cpu = CPU(mem)
     if display:
         log.debug("Creating a cpu_display")
-        cpu_display = view.MachineStateView(cpu, 1200, 800)
+        import cpu.view as view
+        if single_step:
+            fps, steps_per_frame = None, None  # Show every step
+        cpu_display = view.MachineStateView(cpu, 1200, 800, fps=fps,
+                                            steps_per_frame=steps_per_frame)
     log.debug(f"Loading object file {objfile}")
     load(objfile, mem)
+    if display:
+        cpu_display.flush()   # Show the program before it runs
     log.debug(f"Loaded, running from start")
-    cpu.run(single_step=single_step)
+    if engine != "step" and (display or single_step or profile
+                             or (trace and engine == "blocks")):
+        log.warning("Display, single step, profiling, and tracing blocks "
+                    "need the step engine; using it")
+        engine = "step"
+    profiler = None
+    if profile:
+        from cpu.profiler import Profiler
+        profiler = Profiler()
+    tracer = None
+    if trace:
+        from cpu.trace import TraceWriter, RingTracer
+        tracer = RingTracer(trace_ring) if trace_ring else TraceWriter(trace)
+    started = time.perf_counter()
+    try:
+        if engine == "threaded":
+            cpu.run_threaded(tracer=tracer)
+        elif engine == "blocks":
+            cpu.run_blocks()
+        else:
+            cpu.run(single_step=single_step, profiler=profiler, tracer=tracer)
+    finally:
+        if trace_ring and trace:
+            tracer.save(trace)
+        if output_file:
+            output_device.flush()
+        if dma:
+            dma_device.close()
+    seconds = time.perf_counter() - started
     print("Halted")
+    if profiler:
+        profiler.report(mem)
+    if stats:
+        write_stats(stats, cpu, engine, seconds)
     if display:
+      cpu_display.flush()
       input("Press enter to end")
 
 
 if __name__ == "__main__":
     args = cli()
-    main(args.objfile, display=args.display, single_step=args.step)
+    main(args.objfile, display=args.display, single_step=args.step,
+         engine=args.engine, stats=args.stats, profile=args.profile,
+         fps=args.fps, steps_per_frame=args.steps_per_frame,
+         input_file=args.input_file, output_file=args.output_file,
+         dma=args.dma, dma_writable=args.dma_writable,
+         memory_size=args.memory, trace=args.trace, trace_ring=args.trace_ring)
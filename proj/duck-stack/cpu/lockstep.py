@@ -0,0 +1,238 @@
+"""
+Lockstep ("SIMD") execution of one Duck Machine program
+over many inputs at once, using NumPy.
+
+Each lane is a complete machine:  registers are an (N, 16) array,
+memory an (N, capacity) array, and condition codes an (N,) array.
+At each step we choose the lowest program counter among the lanes
+still running and execute the instruction there for every lane at
+that address, as whole-array operations; lanes whose predicate
+fails just advance their program counter.  Lanes whose control
+flow diverges fall into separate groups, and are regrouped
+whenever their program counters meet again.
+
+The results match CPU.run for each lane, except that registers
+are 64-bit integers rather than unbounded Python ints, so a
+product that overflows 64 bits wraps rather than growing.
+Input (address 510) comes from a list per lane, and output
+(address 511) is collected into a list per lane.
+
+Requires NumPy, which the rest of the simulator does not.
+"""
+
+import context  # Python import search from project root
+from instruction_set.instr_format import Instruction, OpCode, CondFlag, decode
+from instruction_set.objfile import read_object
+
+import numpy as np
+
+import argparse
+import io
+import json
+import sys
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+M = CondFlag.M.value
+Z = CondFlag.Z.value
+P = CondFlag.P.value
+V = CondFlag.V.value
+
+INPUT_PORT = 510
+OUTPUT_PORT = 511
+
+# Vector versions of ALU.ALU_OPS (DIV is handled separately,
+# because of division by zero)
+VECTOR_OPS = {
+    OpCode.ADD: np.add,
+    OpCode.SUB: np.subtract,
+    OpCode.MUL: np.multiply
+}
+
+
+class Lockstep(object):
+    """N copies of a Duck Machine running the same program"""
+
+    def __init__(self, words: list[int], inputs: list[list[int]],
+                 capacity: int=512) -> None:
+        n = len(inputs)
+        self.n = n
+        self.capacity = capacity
+        self.regs = np.zeros((n, 16), dtype=np.int64)
+        self.mem = np.zeros((n, capacity), dtype=np.int32)
+        image = np.array(words, dtype=np.int64).astype(np.int32)
+        self.mem[:, :len(image)] = image
+        self.cond = np.full(n, CondFlag.ALWAYS.value, dtype=np.uint8)
+        self.running = np.ones(n, dtype=bool)
+        self.halted = np.zeros(n, dtype=bool)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.inputs = [list(lane_inputs) for lane_inputs in inputs]
+        self._next_input = [0] * n
+        self.outputs: list[list[int]] = [[] for _ in range(n)]
+        self.errors: list[str] = [None] * n
+        self._decoded: dict[int, Instruction] = {}
+
+    def run(self, max_steps: int=None) -> None:
+        """Run until every lane halts or faults (or, with
+        max_steps, has executed that many steps)
+        """
+        regs, running = self.regs, self.running
+        while running.any():
+            if max_steps is not None:
+                over = running & (self.steps >= max_steps)
+                if over.any():
+                    for lane in np.nonzero(over)[0]:
+                        self.errors[lane] = "step limit"
+                    running &= ~over
+                    continue
+            pc = int(regs[running, 15].min())
+            lanes = np.nonzero(running & (regs[:, 15] == pc))[0]
+            if not 0 <= pc < self.capacity:
+                self._fault(lanes, f"Memory address {pc} out of bounds")
+                continue
+            words = self.mem[lanes, pc]
+            first = int(words[0])
+            if (words == first).all():
+                self._fetched(lanes, pc, first)
+            else:
+                # Some lanes have modified this instruction
+                for word in np.unique(words):
+                    self._fetched(lanes[words == word], pc, int(word))
+
+    def _fetched(self, lanes: np.ndarray, pc: int, word: int) -> None:
+        """Execute the word at pc in the given lanes, or fault
+        them if it is not an instruction
+        """
+        try:
+            instr = self._decode(word)
+        except ValueError:
+            self._fault(lanes, f"Word {word} at address {pc} is not an instruction")
+            return
+        self._execute(lanes, pc, instr)
+
+    def _decode(self, word: int) -> Instruction:
+        instr = self._decoded.get(word)
+        if instr is None:
+            instr = decode(word)
+            self._decoded[word] = instr
+        return instr
+
+    def _fault(self, lanes: np.ndarray, message: str) -> None:
+        """These lanes did something that would stop a CPU, e.g.,
+        an address out of bounds, an invalid instruction, or
+        reading past the end of input
+        """
+        for lane in lanes:
+            self.errors[lane] = message
+        self.running[lanes] = False
+
+    def _execute(self, lanes: np.ndarray, pc: int, instr: Instruction) -> None:
+        """Execute instr, at address pc, in the given lanes"""
+        regs, cond = self.regs, self.cond
+        self.steps[lanes] += 1
+        taken = (cond[lanes] & instr.cond.value) != 0
+        if not taken.all():
+            regs[lanes[~taken], 15] = pc + 1
+            lanes = lanes[taken]
+            if len(lanes) == 0:
+                return
+        # r15 already holds pc in these lanes, as CPU.step requires
+        left = regs[lanes, instr.reg_src1]
+        right = regs[lanes, instr.reg_src2] + instr.offset
+        regs[lanes, 15] = pc + 1
+        op, target = instr.op, instr.reg_target
+        if op is OpCode.HALT:
+            self.halted[lanes] = True
+            self.running[lanes] = False
+        elif op is OpCode.LOAD:
+            values = self._load(lanes, left + right)
+            if target != 0:
+                regs[lanes, target] = values
+        elif op is OpCode.STORE:
+            self._store(lanes, left + right, regs[lanes, target])
+        else:
+            if op is OpCode.DIV:
+                zero = right == 0
+                result = np.floor_divide(left, np.where(zero, 1, right))
+                result[zero] = 0
+            else:
+                result = VECTOR_OPS[op](left, right)
+                zero = None
+            flags = np.where(result < 0, M, np.where(result > 0, P, Z)).astype(np.uint8)
+            if zero is not None:
+                flags[zero] = V
+            if target != 0:
+                regs[lanes, target] = result
+            cond[lanes] = flags
+
+    def _bounds(self, lanes: np.ndarray, addrs: np.ndarray) -> np.ndarray:
+        """Mask of the lanes whose address is in bounds; the
+        others fault.
+        """
+        ok = (addrs >= 0) & (addrs < self.capacity)
+        if not ok.all():
+            for lane, addr in zip(lanes[~ok], addrs[~ok]):
+                self._fault([lane], f"Memory address {addr} out of bounds")
+        return ok
+
+    def _load(self, lanes: np.ndarray, addrs: np.ndarray) -> np.ndarray:
+        ok = self._bounds(lanes, addrs)
+        values = np.zeros(len(lanes), dtype=np.int64)
+        values[ok] = self.mem[lanes[ok], addrs[ok]]
+        # The input port is a device rather than memory
+        for i in np.nonzero(ok & (addrs == INPUT_PORT))[0]:
+            lane = lanes[i]
+            position = self._next_input[lane]
+            if position >= len(self.inputs[lane]):
+                self._fault([lane], "Read past the end of input")
+                continue
+            values[i] = self.inputs[lane][position]
+            self._next_input[lane] = position + 1
+        return values
+
+    def _store(self, lanes: np.ndarray, addrs: np.ndarray, values: np.ndarray) -> None:
+        ok = self._bounds(lanes, addrs)
+        port = ok & (addrs == OUTPUT_PORT)
+        for i in np.nonzero(port)[0]:
+            self.outputs[lanes[i]].append(int(values[i]))
+        # The output port is a device rather than memory.  Memory
+        # words are 32 bits; casting keeps the low-order bits.
+        ok &= ~port
+        self.mem[lanes[ok], addrs[ok]] = values[ok].astype(np.int32)
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(
+        description="Run one Duck Machine program over many inputs in lockstep")
+    parser.add_argument("objfile", type=argparse.FileType('rb'),
+                        help="Object file (text or binary)")
+    parser.add_argument("inputs", type=argparse.FileType('r'),
+                        nargs="?", default=sys.stdin,
+                        help="Inputs for each run, one JSON list per line")
+    parser.add_argument("--max-steps", type=int, default=10**7,
+                        help="Step budget per run")
+    return parser.parse_args()
+
+
+def main(objfile: io.IOBase, inputs: io.IOBase, max_steps: int=10**7) -> None:
+    words, _symbols = read_object(objfile)
+    lane_inputs = [json.loads(line) for line in inputs if line.strip()]
+    machine = Lockstep(list(words), lane_inputs)
+    machine.run(max_steps=max_steps)
+    for lane in range(machine.n):
+        print(json.dumps({
+            "inputs": lane_inputs[lane],
+            "status": "ok" if machine.halted[lane] else "error",
+            "message": machine.errors[lane],
+            "output": machine.outputs[lane],
+            "steps": int(machine.steps[lane])
+        }))
+
+
+if __name__ == "__main__":
+    args = cli()
+    main(args.objfile, args.inputs, max_steps=args.max_steps)
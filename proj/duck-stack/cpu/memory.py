@@ -5,14 +5,28 @@ is an array of 32-bit integers.
 """
 import context
 from cpu.mvc import MVCEvent, MVCListenable
+from instruction_set.instr_format import to_word
 
-from typing import Callable
+from array import array
+import copy
+import mmap
+import sys
+from typing import Callable, Iterable
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Memory words are 32-bit two's complement integers (see
+# to_word), stored compactly in an array of C ints.
+WORD_TYPECODE = "i"
+assert array(WORD_TYPECODE).itemsize == 4, "Need a 32-bit array type"
+
+# Words per page of a PagedMemory
+PAGE_SIZE = 1024
+
+
 class SegFault(Exception):
     """Segmentation fault is actually an operating-system 
     level fault, not a hardware fault, but it's what you 
@@ -41,13 +55,17 @@ class MemoryWrite(MemoryEvent):
 
 class Memory(MVCListenable):
     """Just an array of integers.  Other values are 
-    encoded as integers. 
+    encoded as integers.  Each cell holds a 32-bit word;
+    storing a larger value keeps only its low-order 32 bits.
     """
 
     def __init__(self, capacity: int=1024) -> None:
         super().__init__()  # Make it listenable
         self.capacity = capacity
-        self._mem = capacity * [ 0 ]
+        self._mem = array(WORD_TYPECODE, [0]) * capacity
+        # Called as hook(base, length) after load_words, e.g., so
+        # that execution engines can discard stale translations
+        self.block_write_hooks: list[Callable[[int, int], None]] = []
 
     def _check_bounds(self, index):
         if index < 0 or index >= self.capacity:
@@ -55,19 +73,90 @@ class Memory(MVCListenable):
 
     def get(self, index: int) -> int:
         """Fetch a word from memory"""
-        log.debug("Fetching word at memory address {}".format(index))
         self._check_bounds(index)
-        self.notify_all(MemoryRead(self,index,self._mem[index]))
-        return self._mem[index]
+        value = self._mem[index]
+        # Events and log messages only if someone is listening
+        if self.listeners:
+            log.debug("Fetching word at memory address {}".format(index))
+            self.notify_all(MemoryRead(self, index, value))
+        return value
 
     def put(self, index: int, value: int) -> None:
         """Store a word into memory"""
         assert isinstance(index, int), "Memory address must be an int"
         assert isinstance(value, int), f"Cannot store a {value.__class__.__name__} into memory, only int"
         self._check_bounds(index)
-        log.debug("Storing value {} at memory address {}".format(value, index))
-        self._mem[index] = value
-        self.notify_all(MemoryWrite(self,index,value))
+        try:
+            self._mem[index] = value
+        except OverflowError:
+            value = to_word(value)
+            self._mem[index] = value
+        if self.listeners:
+            log.debug("Storing value {} at memory address {}".format(value, index))
+            self.notify_all(MemoryWrite(self, index, value))
+
+
+    def load_words(self, words: Iterable[int], base: int=0) -> None:
+        """Store a sequence of words at base, base+1, ... in one
+        operation.  Unlike put, this announces no events and does
+        not trigger memory-mapped devices.
+        """
+        if isinstance(words, array) and words.typecode == WORD_TYPECODE:
+            block = words  # Already 32-bit words, e.g., a binary object file
+        else:
+            block = self._to_block(words)
+        if len(block) > 0:
+            self._check_bounds(base)
+            self._check_bounds(base + len(block) - 1)
+        self._mem[base:base + len(block)] = block
+        for hook in self.block_write_hooks:
+            hook(base, len(block))
+
+    @staticmethod
+    def _to_block(words: Iterable[int]) -> array:
+        block = array(WORD_TYPECODE)
+        for word in words:
+            try:
+                block.append(word)
+            except OverflowError:
+                block.append(to_word(word))
+        return block
+
+    def dump(self, addrs: range) -> list[int]:
+        """Words at a range of addresses, without announcing
+        events or triggering memory-mapped devices
+        """
+        if len(addrs) > 0:
+            self._check_bounds(addrs[0])
+            self._check_bounds(addrs[-1])
+        if addrs.step != 1:
+            return [self._mem[addr] for addr in addrs]
+        return self._mem[addrs.start:addrs.stop].tolist()
+
+    def snapshot(self) -> array:
+        """A copy of the whole memory, for restore"""
+        return self._mem[:]
+
+    def restore(self, snapshot: array) -> None:
+        """Return to the contents of a snapshot (in place, since
+        execution engines may hold the underlying array)
+        """
+        self._mem[:] = snapshot
+
+    def fork(self) -> "Memory":
+        """An independent copy of this memory, without listeners.
+        Writes to either one are not seen by the other.
+        """
+        clone = copy.copy(self)
+        clone.listeners = []
+        clone.block_write_hooks = []
+        self._fork_storage(clone)
+        return clone
+
+    def _fork_storage(self, clone: "Memory") -> None:
+        # A flat memory is small enough that copying it outright
+        # is cheaper than tracking which words were written
+        clone._mem = self._mem[:]
 
 
 class MemoryMappedIO(Memory):
@@ -99,6 +188,15 @@ class MemoryMappedIO(Memory):
             return hook(index)
         return super().get(index)
 
+    def fork(self) -> "MemoryMappedIO":
+        """A copy of memory with the same devices mapped; map
+        new devices into the copy to give it its own I/O.
+        """
+        clone = super().fork()
+        clone.hooks_read = dict(self.hooks_read)
+        clone.hooks_write = dict(self.hooks_write)
+        return clone
+
     def put(self, index: int, value: int) -> None:
         """Hook OR Store a word into memory"""
         if index in self.hooks_write:
@@ -106,3 +204,227 @@ class MemoryMappedIO(Memory):
             hook(index, value)
             return
         super().put(index, value)
+
+
+class PagedMemory(Memory):
+    """Sparse memory for large address spaces.  Memory is divided
+    into pages of page_size words (a power of 2), and a page is
+    only allocated when a word in it is first written; words in
+    untouched pages read as zero.  Memory use is proportional to
+    the number of pages touched rather than to capacity.
+
+    Forks share pages copy-on-write:  a page is copied only when
+    the parent or the fork first writes into it.
+    """
+
+    def __init__(self, capacity: int=1024, page_size: int=PAGE_SIZE) -> None:
+        MVCListenable.__init__(self)  # Make it listenable, but no flat array
+        assert page_size > 0 and page_size & (page_size - 1) == 0, \
+            "Page size must be a power of 2"
+        self.capacity = capacity
+        self.page_size = page_size
+        self._shift = page_size.bit_length() - 1
+        self._offset_mask = page_size - 1
+        self._pages: dict[int, array] = {}
+        self._owned: set[int] = set()   # Pages not shared with a fork
+        self.block_write_hooks: list[Callable[[int, int], None]] = []
+
+    def pages_allocated(self) -> int:
+        return len(self._pages)
+
+    def _page(self, page_num: int) -> array:
+        """The page, to write into:  allocated if it was not
+        already, and copied if it is shared with a fork
+        """
+        if page_num in self._owned:
+            return self._pages[page_num]
+        page = self._pages.get(page_num)
+        if page is None:
+            page = array(WORD_TYPECODE, [0]) * self.page_size
+        else:
+            page = page[:]
+        self._pages[page_num] = page
+        self._owned.add(page_num)
+        return page
+
+    def _peek(self, index: int) -> int:
+        page = self._pages.get(index >> self._shift)
+        return page[index & self._offset_mask] if page is not None else 0
+
+    def get(self, index: int) -> int:
+        """Fetch a word from memory"""
+        self._check_bounds(index)
+        value = self._peek(index)
+        if self.listeners:
+            log.debug("Fetching word at memory address {}".format(index))
+            self.notify_all(MemoryRead(self, index, value))
+        return value
+
+    def put(self, index: int, value: int) -> None:
+        """Store a word into memory"""
+        assert isinstance(index, int), "Memory address must be an int"
+        assert isinstance(value, int), f"Cannot store a {value.__class__.__name__} into memory, only int"
+        self._check_bounds(index)
+        page = self._page(index >> self._shift)
+        try:
+            page[index & self._offset_mask] = value
+        except OverflowError:
+            value = to_word(value)
+            page[index & self._offset_mask] = value
+        if self.listeners:
+            log.debug("Storing value {} at memory address {}".format(value, index))
+            self.notify_all(MemoryWrite(self, index, value))
+
+    def load_words(self, words: Iterable[int], base: int=0) -> None:
+        """Store a sequence of words at base, base+1, ... a page
+        at a time, without events or memory-mapped devices
+        """
+        if isinstance(words, array) and words.typecode == WORD_TYPECODE:
+            block = words
+        else:
+            block = self._to_block(words)
+        if len(block) == 0:
+            return
+        self._check_bounds(base)
+        self._check_bounds(base + len(block) - 1)
+        pos = 0
+        while pos < len(block):
+            addr = base + pos
+            offset = addr & self._offset_mask
+            count = min(self.page_size - offset, len(block) - pos)
+            self._page(addr >> self._shift)[offset:offset + count] = block[pos:pos + count]
+            pos += count
+        for hook in self.block_write_hooks:
+            hook(base, len(block))
+
+    def dump(self, addrs: range) -> list[int]:
+        """Words at a range of addresses, without announcing
+        events or triggering memory-mapped devices
+        """
+        if len(addrs) > 0:
+            self._check_bounds(addrs[0])
+            self._check_bounds(addrs[-1])
+        if addrs.step != 1:
+            return [self._peek(addr) for addr in addrs]
+        words = []
+        addr = addrs.start
+        while addr < addrs.stop:
+            offset = addr & self._offset_mask
+            count = min(self.page_size - offset, addrs.stop - addr)
+            page = self._pages.get(addr >> self._shift)
+            if page is None:
+                words.extend([0] * count)
+            else:
+                words.extend(page[offset:offset + count])
+            addr += count
+        return words
+
+    def snapshot(self) -> dict[int, array]:
+        return {page_num: page[:] for page_num, page in self._pages.items()}
+
+    def restore(self, snapshot: dict[int, array]) -> None:
+        self._pages = {page_num: page[:] for page_num, page in snapshot.items()}
+        self._owned = set(self._pages)
+
+    def _fork_storage(self, clone: "PagedMemory") -> None:
+        # Every page is now shared, until someone writes into it
+        clone._pages = dict(self._pages)
+        clone._owned = set()
+        self._owned = set()
+
+
+class PagedMemoryMappedIO(MemoryMappedIO, PagedMemory):
+    """Paged memory with memory-mapped input/output"""
+
+    def __init__(self, capacity: int=1024, page_size: int=PAGE_SIZE) -> None:
+        PagedMemory.__init__(self, capacity, page_size)
+        self.hooks_read = { }
+        self.hooks_write = { }
+
+
+class DMAController(object):
+    """Direct memory access:  block transfers between a host file
+    and memory, controlled through four memory-mapped registers
+    starting at a base address (by default 506..509, just below
+    the input and output ports):
+
+        base + 0   file offset, in words
+        base + 1   memory address
+        base + 2   length, in words
+        base + 3   command:  writing TO_MEMORY or TO_FILE starts
+                   a transfer; reading gives the number of words
+                   the last transfer moved, or -1 if it was out
+                   of bounds (and moved nothing)
+
+    The file holds 32-bit little-endian words (like the payload
+    of a binary object file) and is memory-mapped, so a transfer
+    is a single slice copy.  Transfers do not announce memory
+    events, and are not seen by memory-mapped devices.
+    """
+    FILE_OFFSET, MEM_ADDR, LENGTH, COMMAND = range(4)
+    TO_MEMORY = 1
+    TO_FILE = 2
+
+    def __init__(self, memory: MemoryMappedIO, path: str,
+                 writable: bool=False, base: int=506) -> None:
+        self.memory = memory
+        self.base = base
+        self.regs = [0, 0, 0, 0]
+        self._file = open(path, "r+b" if writable else "rb")
+        try:
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._map = mmap.mmap(self._file.fileno(), 0, access=access)
+        except ValueError:
+            self._map = None   # Empty file; every transfer is out of bounds
+        self.writable = writable
+        for addr in range(base, base + 4):
+            memory.map_address_in(addr, self._read)
+            memory.map_address_out(addr, self._write)
+
+    def file_words(self) -> int:
+        return len(self._map) // 4 if self._map is not None else 0
+
+    def _read(self, addr: int) -> int:
+        return self.regs[addr - self.base]
+
+    def _write(self, addr: int, value: int) -> None:
+        reg = addr - self.base
+        if reg == self.COMMAND:
+            self.regs[reg] = self.transfer(value)
+        else:
+            self.regs[reg] = value
+
+    def transfer(self, command: int) -> int:
+        """Carry out a command with the current register values;
+        the number of words moved, or -1 on error
+        """
+        offset, addr, length = self.regs[:3]
+        if (length < 0 or offset < 0 or offset + length > self.file_words()
+                or command not in (self.TO_MEMORY, self.TO_FILE)
+                or (command == self.TO_FILE and not self.writable)):
+            log.warning(f"DMA command {command} out of bounds or not allowed "
+                        f"(file offset {offset}, address {addr}, length {length})")
+            return -1
+        if length == 0:
+            return 0
+        try:
+            if command == self.TO_MEMORY:
+                block = array(WORD_TYPECODE)
+                block.frombytes(self._map[4 * offset:4 * (offset + length)])
+                if sys.byteorder == "big":
+                    block.byteswap()
+                self.memory.load_words(block, addr)
+            else:
+                block = array(WORD_TYPECODE, self.memory.dump(range(addr, addr + length)))
+                if sys.byteorder == "big":
+                    block.byteswap()
+                self._map[4 * offset:4 * (offset + length)] = block.tobytes()
+        except SegFault as e:
+            log.warning(f"DMA transfer failed: {e}")
+            return -1
+        return length
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
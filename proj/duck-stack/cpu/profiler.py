@@ -0,0 +1,85 @@
+"""
+Execution profiler for the Duck Machine.
+
+While CPU.run is given a Profiler, the CPU reports each decoded
+instruction to it directly (not through MVC events, which would
+cost far more than the counting).  The profiler counts executions
+per instruction address and per operation code, predicated
+instructions that were skipped, and data reads and writes per
+memory address.  At the end of the run it can print an annotated
+disassembly with hit counts and percentages.
+"""
+
+import context  # Python import search from project root
+from instruction_set.instr_format import Instruction, OpCode, decode
+
+from collections import Counter
+import io
+import sys
+
+
+class Profiler(object):
+    """Counts what the CPU executes"""
+
+    def __init__(self) -> None:
+        self.hits: Counter[int] = Counter()      # Steps at each address
+        self.skipped: Counter[int] = Counter()   # Predicate not satisfied
+        self.ops: Counter[OpCode] = Counter()    # Steps by operation
+        self.reads: Counter[int] = Counter()     # LOADs by address
+        self.writes: Counter[int] = Counter()    # STOREs by address
+
+    def record(self, cpu: "CPU", addr: int, instr: Instruction) -> None:
+        """The CPU is about to execute instr, fetched from addr"""
+        self.hits[addr] += 1
+        self.ops[instr.op] += 1
+        if not cpu.cc & instr.cond.value:
+            self.skipped[addr] += 1
+            return
+        if instr.op is OpCode.LOAD or instr.op is OpCode.STORE:
+            regs = cpu.regs
+            target = regs[instr.reg_src1] + regs[instr.reg_src2] + instr.offset
+            if instr.op is OpCode.LOAD:
+                self.reads[target] += 1
+            else:
+                self.writes[target] += 1
+
+    def total_steps(self) -> int:
+        return sum(self.hits.values())
+
+    def report(self, memory: "Memory", file: io.IOBase=sys.stdout) -> None:
+        """Print an annotated disassembly of every address that was
+        executed, read, or written, followed by per-operation and
+        predication summaries.
+        """
+        total = self.total_steps()
+        print(f"Profile: {total} steps", file=file)
+        if total == 0:
+            return
+        print(f"{'addr':>6} {'hits':>10} {'%':>6} {'skipped':>8} "
+              f"{'reads':>8} {'writes':>8}  instruction", file=file)
+        touched = set(self.hits) | set(self.reads) | set(self.writes)
+        for addr in sorted(touched):
+            hits = self.hits[addr]
+            if 0 <= addr < memory.capacity:
+                word = memory.dump(range(addr, addr + 1))[0]
+            else:
+                word = None
+            if word is None:
+                text = "(out of bounds)"
+            else:
+                text = f"DATA {word}"
+                if hits:
+                    try:
+                        text = str(decode(word))
+                    except ValueError:
+                        pass   # Overwritten since it was executed
+            print(f"{addr:>6} {hits:>10} {100 * hits / total:>5.1f}% "
+                  f"{self.skipped[addr]:>8} {self.reads[addr]:>8} "
+                  f"{self.writes[addr]:>8}  {text}", file=file)
+        print(f"\n{'op':>6} {'count':>10} {'%':>6}", file=file)
+        for op, count in self.ops.most_common():
+            print(f"{op.name:>6} {count:>10} {100 * count / total:>5.1f}%",
+                  file=file)
+        skipped = sum(self.skipped.values())
+        print(f"\nPredicated: {total - skipped} taken, {skipped} skipped",
+              file=file)
@@ -1,6 +1,10 @@
 """
 A Duck Machine register holds a 32 bit integer. 
 The Zero register is special: It always holds 0. 
+
+The CPU keeps its registers in a flat list of ints;
+a RegisterView presents one element of that list
+with the same interface as a Register.
 """
 
 
@@ -22,4 +26,19 @@ class ZeroRegister(Register):
     def put(self, value) -> None:
         pass
 
-    
+
+class RegisterView(Register):
+    """One register in a flat register file (a list of ints).
+    Register 0 always holds 0.
+    """
+
+    def __init__(self, regs: list[int], index: int):
+        self._regs = regs
+        self._index = index
+
+    def get(self) -> int:
+        return self._regs[self._index]
+
+    def put(self, value) -> None:
+        if self._index != 0:
+            self._regs[self._index] = value
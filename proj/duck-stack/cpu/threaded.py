@@ -0,0 +1,343 @@
+"""
+Closure-threaded execution engine for the Duck Machine.
+
+CPU.step fetches, decodes, and interprets an instruction every
+time it executes it.  The threaded engine instead translates each
+instruction word, the first time it is executed, into a small
+Python function with its operands, operation, and predicate
+already bound.  Running a program is then just a loop that calls
+the function for the current address; each function returns the
+address of the next instruction (or None to halt).
+
+The results (registers, condition code, memory, input and output)
+are the same as for CPU.step, but no CPUStep events are announced,
+so the graphical display must still use CPU.run.  Given a tracer
+(see cpu/trace.py), each translation is wrapped to report its step,
+so the trace can be compared with one from CPU.run.
+"""
+
+import context  # Python import search from project root
+from instruction_set.instr_format import Instruction, OpCode, CondFlag, decode
+
+from typing import Callable, Optional
+import operator
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Condition codes as plain integers
+M = CondFlag.M.value
+Z = CondFlag.Z.value
+P = CondFlag.P.value
+V = CondFlag.V.value
+NEVER = CondFlag.NEVER.value
+ALWAYS = CondFlag.ALWAYS.value
+
+# The same functions as ALU.ALU_OPS, but as C-level callables
+# rather than lambdas.
+ARITH = {
+    OpCode.ADD: operator.add,
+    OpCode.SUB: operator.sub,
+    OpCode.MUL: operator.mul,
+    OpCode.DIV: operator.floordiv
+}
+
+# A translated instruction takes no arguments and returns the
+# address of the next instruction to execute, or None to halt.
+Op = Callable[[], Optional[int]]
+
+
+def alu_result(op: OpCode, left: int, right: int) -> tuple[int, int]:
+    """Result and condition code as ALU.exec would produce them,
+    with the condition code as an int.
+    """
+    try:
+        result = ARITH[op](left, right)
+    except ZeroDivisionError:
+        return (0, V)
+    if result < 0:
+        return (result, M)
+    if result > 0:
+        return (result, P)
+    return (0, Z)
+
+
+class ThreadedEngine(object):
+    """Runs the program in a CPU's memory as threaded code.
+    The translated code works directly on the CPU's register
+    file, except that r15 is only brought up to date when the run
+    stops.  The condition code is kept as an int while running.
+    """
+
+    def __init__(self, cpu: "CPU", tracer: "Tracer"=None) -> None:
+        self.cpu = cpu
+        self.memory = cpu.memory
+        self.regs = cpu.regs
+        self.cc = [CondFlag.ALWAYS.value]
+        self.tracer = tracer
+        # Translated instructions, by address.  A store to an
+        # address discards its translation.
+        self.code: dict[int, Op] = {}
+
+    def run(self, from_addr: int = 0) -> None:
+        """Execute from from_addr until a HALT"""
+        self._sync_in()
+        code = self.code
+        pc = from_addr
+        steps = 0
+        self.memory.block_write_hooks.append(self.discard)
+        try:
+            while pc is not None:
+                try:
+                    while pc is not None:
+                        pc = code[pc]()
+                        steps += 1
+                except KeyError:
+                    if pc in code:
+                        raise  # From inside the instruction, not ours
+                    code[pc] = self._translate(pc)
+        except BaseException:
+            # Like CPU.step, a fault while fetching leaves the pc at
+            # the instruction, but a fault while executing it leaves
+            # the pc already incremented.
+            self.regs[15] = pc if pc not in code else pc + 1
+            raise
+        finally:
+            self.memory.block_write_hooks.remove(self.discard)
+            self._sync_out(halted=pc is None)
+            self.cpu.step_count = steps
+
+    def discard(self, base: int, length: int) -> None:
+        """Memory from base to base + length - 1 has changed"""
+        code = self.code
+        if length > len(code):
+            changed = [addr for addr in code if base <= addr < base + length]
+        else:
+            changed = [addr for addr in range(base, base + length) if addr in code]
+        for addr in changed:
+            del code[addr]
+
+    def _sync_in(self) -> None:
+        self.cc[0] = self.cpu.cc
+
+    def _sync_out(self, halted: bool) -> None:
+        self.cpu.cc = self.cc[0]
+        self.cpu.halted = halted
+
+    def _translate(self, addr: int) -> Op:
+        """Translate the instruction at addr (fetching it the
+        same way CPU.step would)
+        """
+        hooks = getattr(self.memory, "hooks_read", {})
+        if addr in hooks:
+            # Fetching calls a device, so we must fetch every time
+            def refetch():
+                return self._bind(addr, self.memory.get(addr))()
+            return refetch
+        return self._bind(addr, self.memory.get(addr))
+
+    def _bind(self, addr: int, word: int) -> Op:
+        """The function for the word at addr, traced if there
+        is a tracer
+        """
+        body = self._specialize(addr, decode(word))
+        if self.tracer is None:
+            return body
+        cpu, regs, cc, tracer = self.cpu, self.regs, self.cc, self.tracer
+        nxt = addr + 1
+        def traced():
+            # The tracer sees the CPU as CPU.step leaves it
+            regs[15] = addr
+            cpu.cc = cc[0]
+            tracer.fetched(cpu, addr, word)
+            pc = body()
+            regs[15] = nxt if pc is None else pc
+            cpu.cc = cc[0]
+            tracer.retired(cpu)
+            return pc
+        return traced
+
+    def _specialize(self, addr: int, instr: Instruction) -> Op:
+        """The function for instr, bound to its address"""
+        nxt = addr + 1
+        mask = instr.cond.value
+        if mask == NEVER:
+            return lambda: nxt
+        op = instr.op
+        if op is OpCode.HALT:
+            body = self._halt(addr)
+        elif op is OpCode.LOAD:
+            body = self._load(addr, instr)
+        elif op is OpCode.STORE:
+            body = self._store(addr, instr)
+        else:
+            body = self._alu(addr, instr)
+        if mask == ALWAYS:
+            # The condition code always has exactly one bit set
+            return body
+        cc = self.cc
+        def predicated():
+            if cc[0] & mask:
+                return body()
+            return nxt
+        return predicated
+
+    @staticmethod
+    def _constant(addr: int, reg: int) -> Optional[int]:
+        """Value of reg if it is known at translation time:  r0 is
+        always zero and r15 holds the address of the instruction.
+        """
+        if reg == 0:
+            return 0
+        if reg == 15:
+            return addr
+        return None
+
+    def _operands(self, addr: int, instr: Instruction) -> tuple[Optional[int], Optional[int]]:
+        """Left and right ALU inputs, where they are constants"""
+        left = self._constant(addr, instr.reg_src1)
+        right = self._constant(addr, instr.reg_src2)
+        if right is not None:
+            right += instr.offset
+        return left, right
+
+    def _halt(self, addr: int) -> Op:
+        regs = self.regs
+        nxt = addr + 1
+        def halt():
+            regs[15] = nxt
+            return None
+        return halt
+
+    def _alu(self, addr: int, instr: Instruction) -> Op:
+        regs, cc = self.regs, self.cc
+        nxt = addr + 1
+        t, s1, s2, off = instr.reg_target, instr.reg_src1, instr.reg_src2, instr.offset
+        left, right = self._operands(addr, instr)
+        if left is not None and right is not None:
+            # Constant folded, e.g., ADD r1,r0,r0[5] or a jump
+            result, flag = alu_result(instr.op, left, right)
+            if t == 15:
+                def jump_const():
+                    cc[0] = flag
+                    return result
+                return jump_const
+            if t == 0:
+                def flag_const():
+                    cc[0] = flag
+                    return nxt
+                return flag_const
+            def move_const():
+                regs[t] = result
+                cc[0] = flag
+                return nxt
+            return move_const
+        if s1 == 15 or s2 == 15:
+            return self._generic(addr, instr)
+        fn = ARITH[instr.op]
+        if t == 15:
+            def jump():
+                try:
+                    r = fn(regs[s1], regs[s2] + off)
+                except ZeroDivisionError:
+                    cc[0] = V
+                    return 0
+                cc[0] = M if r < 0 else P if r > 0 else Z
+                return r
+            return jump
+        if t == 0:
+            def compare():
+                try:
+                    r = fn(regs[s1], regs[s2] + off)
+                except ZeroDivisionError:
+                    cc[0] = V
+                    return nxt
+                cc[0] = M if r < 0 else P if r > 0 else Z
+                return nxt
+            return compare
+        def arith():
+            try:
+                r = fn(regs[s1], regs[s2] + off)
+            except ZeroDivisionError:
+                regs[t] = 0
+                cc[0] = V
+                return nxt
+            regs[t] = r
+            cc[0] = M if r < 0 else P if r > 0 else Z
+            return nxt
+        return arith
+
+    def _load(self, addr: int, instr: Instruction) -> Op:
+        regs, get = self.regs, self.memory.get
+        nxt = addr + 1
+        t, s1, s2, off = instr.reg_target, instr.reg_src1, instr.reg_src2, instr.offset
+        if t == 0 or t == 15:
+            return self._generic(addr, instr)
+        left, right = self._operands(addr, instr)
+        if left is not None and right is not None:
+            a = left + right
+            def load_const():
+                regs[t] = get(a)
+                return nxt
+            return load_const
+        if s1 == 15 or s2 == 15:
+            return self._generic(addr, instr)
+        def load():
+            regs[t] = get(regs[s1] + regs[s2] + off)
+            return nxt
+        return load
+
+    def _store(self, addr: int, instr: Instruction) -> Op:
+        regs, put, code = self.regs, self.memory.put, self.code
+        nxt = addr + 1
+        t, s1, s2, off = instr.reg_target, instr.reg_src1, instr.reg_src2, instr.offset
+        if t == 15:
+            return self._generic(addr, instr)
+        left, right = self._operands(addr, instr)
+        if left is not None and right is not None:
+            a = left + right
+            def store_const():
+                put(a, regs[t])
+                code.pop(a, None)
+                return nxt
+            return store_const
+        if s1 == 15 or s2 == 15:
+            return self._generic(addr, instr)
+        def store():
+            a = regs[s1] + regs[s2] + off
+            put(a, regs[t])
+            code.pop(a, None)
+            return nxt
+        return store
+
+    def _generic(self, addr: int, instr: Instruction) -> Op:
+        """Unspecialized translation for the unusual forms
+        (e.g., LOAD into r15, or r15 in a register expression),
+        following CPU.step exactly.
+        """
+        regs, cc, code = self.regs, self.cc, self.code
+        memory = self.memory
+        nxt = addr + 1
+        op, t, s1, s2, off = instr.op, instr.reg_target, instr.reg_src1, instr.reg_src2, instr.offset
+        def generic():
+            regs[15] = addr
+            left = regs[s1]
+            right = regs[s2] + off
+            regs[15] = nxt
+            if op is OpCode.STORE:
+                a = left + right
+                memory.put(a, regs[t])
+                code.pop(a, None)
+            elif op is OpCode.LOAD:
+                value = memory.get(left + right)
+                if t != 0:
+                    regs[t] = value
+            else:
+                result, flag = alu_result(op, left, right)
+                if t != 0:
+                    regs[t] = result
+                cc[0] = flag
+            return regs[15]
+        return generic
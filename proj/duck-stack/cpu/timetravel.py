@@ -0,0 +1,182 @@
+"""
+Time-travel debugging for the Duck Machine.
+
+A History listens to a CPU and its memory while CPU.run executes a
+program.  Every so often (every `interval` steps) it takes a
+checkpoint, a full copy of the registers, condition code, and
+memory.  Between checkpoints it logs only what each step changed:
+the registers whose values differ after the step, the condition
+code if it changed, and the memory writes announced by MemoryWrite
+events or made in bulk (by a DMA transfer).  To go to step n, it
+restores the latest checkpoint at or before n and replays the
+logged changes up to n, rather than re-executing the program.
+
+Checkpoints are kept in a ring buffer of `capacity` entries, so
+memory use stays bounded on long runs; steps older than the oldest
+checkpoint are forgotten.
+
+Step n is the state after n steps have been executed, i.e., just
+before the CPU executes its nth instruction (counting from 0).
+"""
+
+import context  # Python import search from project root
+from cpu.cpu import CPU, CPUStep
+from cpu.memory import MemoryWrite
+from cpu.mvc import MVCEvent, MVCListener
+
+from collections import deque
+from typing import NamedTuple, Optional
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class Delta(NamedTuple):
+    """What one step changed"""
+    regs: tuple[tuple[int, int], ...]    # (register, new value) pairs
+    cc: Optional[int]                    # Condition code, None if unchanged
+    writes: tuple[tuple[int, int], ...]  # (address, new value) pairs
+
+
+class Checkpoint(object):
+    """Complete machine state at one step, followed by the
+    changes made by each step after it
+    """
+
+    def __init__(self, step: int, cpu: CPU) -> None:
+        self.step = step
+        self.regs = list(cpu.regs)
+        self.cc = cpu.cc
+        self.mem = cpu.memory.snapshot()
+        self.deltas: list[Delta] = []
+
+    def last_step(self) -> int:
+        return self.step + len(self.deltas)
+
+
+class HistoryError(Exception):
+    """Step is not (or no longer) in the history"""
+    pass
+
+
+class History(MVCListener):
+    """Records a CPU's execution so that it can be rewound"""
+
+    def __init__(self, cpu: CPU, interval: int=1000, capacity: int=100) -> None:
+        assert interval > 0 and capacity > 0
+        self.cpu = cpu
+        self.interval = interval
+        self.checkpoints: deque[Checkpoint] = deque(maxlen=capacity)
+        self.position = 0           # Step the CPU is at, if recorded
+        self.halted = False         # Whether the last step halted
+        self._shadow = list(cpu.regs)
+        self._cc = cpu.cc
+        self._writes: list[tuple[int, int]] = []
+        self._in_step = False
+        cpu.register_listener(self)
+        cpu.memory.register_listener(self)
+        cpu.memory.block_write_hooks.append(self._block_written)
+
+    def notify(self, event: MVCEvent) -> None:
+        if isinstance(event, MemoryWrite):
+            self._writes.append((event.addr, event.value))
+        elif isinstance(event, CPUStep):
+            self.end_step()
+            self._in_step = True
+
+    def _block_written(self, base: int, length: int) -> None:
+        """Words were stored without events, e.g., by DMA"""
+        addrs = range(base, base + length)
+        self._writes.extend(zip(addrs, self.cpu.memory.dump(addrs)))
+
+    def end_step(self) -> None:
+        """Record the changes made by the step in progress, if any.
+        Each CPUStep event ends the previous step; call this after
+        CPU.run returns to record the last step of the run.
+        """
+        cpu = self.cpu
+        if not self.checkpoints:
+            self.checkpoints.append(Checkpoint(0, cpu))
+            self._resync()
+            return
+        if not self._in_step:
+            return
+        self._in_step = False
+        if self.position != self.latest():
+            self._truncate()   # A new future after going back in time
+        regs, shadow = cpu.regs, self._shadow
+        if regs == shadow:
+            changed_regs = ()
+        else:
+            changed_regs = tuple((i, regs[i]) for i in range(16) if regs[i] != shadow[i])
+        cc = cpu.cc if cpu.cc != self._cc else None
+        latest = self.checkpoints[-1]
+        latest.deltas.append(Delta(changed_regs, cc, tuple(self._writes)))
+        self.position = latest.last_step()
+        self.halted = cpu.halted
+        if self.position - latest.step >= self.interval:
+            self.checkpoints.append(Checkpoint(self.position, cpu))
+        self._resync()
+
+    def _resync(self) -> None:
+        """The current state is the one we last recorded"""
+        self._shadow[:] = self.cpu.regs
+        self._cc = self.cpu.cc
+        self._writes.clear()
+
+    def _truncate(self) -> None:
+        """Forget the steps after the current position"""
+        while self.checkpoints[-1].step > self.position:
+            self.checkpoints.pop()
+        latest = self.checkpoints[-1]
+        del latest.deltas[self.position - latest.step:]
+        self.halted = False
+
+    def earliest(self) -> int:
+        """Oldest step that can still be restored"""
+        if not self.checkpoints:
+            raise HistoryError("Nothing recorded yet")
+        return self.checkpoints[0].step
+
+    def latest(self) -> int:
+        """Newest recorded step"""
+        if not self.checkpoints:
+            raise HistoryError("Nothing recorded yet")
+        return self.checkpoints[-1].last_step()
+
+    def goto(self, step: int) -> None:
+        """Put the CPU and memory into their state at step"""
+        if not self.earliest() <= step <= self.latest():
+            raise HistoryError(f"Step {step} is not in the history "
+                               f"({self.earliest()} to {self.latest()})")
+        for checkpoint in reversed(self.checkpoints):
+            if checkpoint.step <= step:
+                break
+        cpu = self.cpu
+        # Update registers in place; the CPU's register views share them
+        regs = cpu.regs
+        regs[:] = checkpoint.regs
+        cc = checkpoint.cc
+        writes = {}
+        for delta in checkpoint.deltas[:step - checkpoint.step]:
+            for index, value in delta.regs:
+                regs[index] = value
+            if delta.cc is not None:
+                cc = delta.cc
+            for addr, value in delta.writes:
+                writes[addr] = value
+        cpu.memory.restore(checkpoint.mem)
+        for addr, value in writes.items():
+            cpu.memory.load_words([value], addr)
+        cpu.cc = cc
+        cpu.halted = self.halted and step == self.latest()
+        self.position = step
+        self._in_step = False
+        self._resync()
+        log.debug(f"Restored step {step} from checkpoint at {checkpoint.step}")
+
+    def step_back(self, steps: int=1) -> None:
+        """Undo the last steps"""
+        self.goto(self.position - steps)
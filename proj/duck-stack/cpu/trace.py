@@ -0,0 +1,340 @@
+"""
+Execution traces for the Duck Machine.
+
+While CPU.run (or CPU.run_threaded) is given a tracer, each
+executed instruction is written as a compact fixed-size binary
+record:  the step number, the instruction's address and word, the
+register it wrote (or -1), the condition code after it, the memory
+address it loaded or stored (or -1), and the value written to the
+register or memory.
+Predicated instructions that were skipped are recorded too, with
+no register or memory address.
+
+A TraceWriter streams records to a file through a buffer, so a
+long run costs one write per few thousand steps.  A RingTracer
+keeps only the most recent records in memory and saves them on
+request, e.g., when a run fails.
+
+From a complete trace and the object code that produced it, replay
+reconstructs the registers, condition code, memory, and output at
+any step, without the devices the program used.  (So memory a DMA
+transfer wrote is not reconstructed, though the values the program
+then loaded from it are in the trace.)  first_divergence
+compares two traces (e.g., of the same program under two builds,
+or of a run that failed and one that did not) and finds the first
+step at which they differ.
+
+    python3 cpu/trace.py show run.trace [--start N] [--count K]
+    python3 cpu/trace.py replay prog.obj run.trace --step N
+    python3 cpu/trace.py diff a.trace b.trace
+
+Values are stored as 64-bit integers; larger ones are wrapped.
+"""
+import io
+
+import context  # Python import search from project root
+from instruction_set.instr_format import (Instruction, OpCode, CondFlag, decode, op_field,
+                                          to_word)
+from instruction_set.objfile import read_object
+from cpu.devices import OUTPUT_PORT
+
+from collections import deque
+from typing import Iterable, Iterator, NamedTuple, Optional
+import argparse
+import struct
+import sys
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MAGIC = b"DTRC"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")         # magic, version, record size
+# step, pc, word, register written, condition code, address, value
+RECORD = struct.Struct("<QIIbBiq")
+
+NO_REGISTER = -1
+NO_ADDRESS = -1
+
+LOAD = OpCode.LOAD.value
+STORE = OpCode.STORE.value
+HALT = OpCode.HALT.value
+
+
+class TraceError(Exception):
+    """Not a trace, or not one that can be used as asked"""
+    pass
+
+
+class TraceRecord(NamedTuple):
+    """One executed instruction"""
+    step: int
+    pc: int
+    word: int
+    reg: int       # Register written, or NO_REGISTER
+    cc: int        # Condition code after the step
+    addr: int      # Memory address loaded or stored, or NO_ADDRESS
+    value: int     # Value written to the register or memory
+
+    def instruction(self) -> Instruction:
+        return decode(self.word)
+
+    def __str__(self) -> str:
+        try:
+            text = str(self.instruction())
+        except ValueError:
+            text = f"DATA {self.word}"
+        effects = []
+        if self.reg != NO_REGISTER:
+            effects.append(f"r{self.reg}={self.value}")
+        if self.addr != NO_ADDRESS:
+            if self.reg == NO_REGISTER and op_field.extract(self.word) == STORE:
+                effects.append(f"[{self.addr}]={self.value}")
+            else:
+                effects.append(f"[{self.addr}]")
+        return (f"{self.step:>10} {self.pc:>6}  {text:<28} "
+                f"{CondFlag(self.cc)!s:<6} {' '.join(effects)}")
+
+
+def _wrap64(value: int) -> int:
+    """value as a signed 64-bit integer"""
+    if -(1 << 63) <= value < (1 << 63):
+        return value
+    value &= (1 << 64) - 1
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class Tracer(object):
+    """Abstract base class for tracers.  CPU.step calls fetched
+    with each decoded instruction, and CPU.run calls retired when
+    the step is complete (the threaded engine calls both the same
+    way); subclasses decide where records go.
+    """
+
+    def __init__(self) -> None:
+        self.steps = 0    # Records made
+        self._pending = None
+
+    def fetched(self, cpu: "CPU", addr: int, word: int) -> None:
+        """The CPU is about to execute the word fetched from addr"""
+        op, cond, target, src1, src2, offset, _instr = \
+            cpu.decoder.decode_fields(addr, word)
+        if not cpu.cc & cond:
+            self._pending = (addr, word, HALT, 0, NO_ADDRESS)   # Skipped
+            return
+        if op == LOAD or op == STORE:
+            # Registers as the CPU sees them for the address calculation
+            regs = cpu.regs
+            mem_addr = regs[src1] + regs[src2] + offset
+        else:
+            mem_addr = NO_ADDRESS
+        self._pending = (addr, word, op, target, mem_addr)
+
+    def retired(self, cpu: "CPU") -> None:
+        """The CPU has completed the step last fetched"""
+        addr, word, op, target, mem_addr = self._pending
+        if op == HALT or op == STORE or target == 0:
+            reg = NO_REGISTER
+        else:
+            reg = target
+        # A stored register is unchanged by the STORE (r15 already
+        # held the incremented PC when it was stored)
+        value = cpu.regs[target] if reg != NO_REGISTER or op == STORE else 0
+        self.emit(RECORD.pack(self.steps, addr & 0xFFFFFFFF, word & 0xFFFFFFFF,
+                              reg, cpu.cc, mem_addr, _wrap64(value)))
+        self.steps += 1
+
+    def emit(self, record: bytes) -> None:
+        raise NotImplementedError("Tracer subclass must define emit")
+
+    def flush(self) -> None:
+        pass
+
+
+class TraceWriter(Tracer):
+    """Streams records to a binary file, buffer_size records
+    at a time
+    """
+
+    def __init__(self, file: io.IOBase, buffer_size: int=4096) -> None:
+        super().__init__()
+        self.file = file
+        self.limit = buffer_size * RECORD.size
+        self._buffer = bytearray()
+        file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def emit(self, record: bytes) -> None:
+        self._buffer += record
+        if len(self._buffer) >= self.limit:
+            self.flush()
+
+    def flush(self) -> None:
+        self.file.write(self._buffer)
+        self._buffer.clear()
+        self.file.flush()
+
+
+class RingTracer(Tracer):
+    """Keeps the most recent capacity records in memory"""
+
+    def __init__(self, capacity: int=100_000) -> None:
+        super().__init__()
+        self.ring: deque[bytes] = deque(maxlen=capacity)
+        self.emit = self.ring.append
+
+    def records(self) -> list[TraceRecord]:
+        return [TraceRecord(*RECORD.unpack(record)) for record in self.ring]
+
+    def save(self, file: io.IOBase) -> None:
+        """Write the records kept, in the format of TraceWriter"""
+        file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        file.write(b"".join(self.ring))
+        file.flush()
+
+
+def read_trace(file: io.IOBase) -> Iterator[TraceRecord]:
+    """The records of a trace file, in order"""
+    header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise TraceError("File is too short to be a trace")
+    magic, version, size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise TraceError("Not a Duck Machine trace")
+    if version != VERSION or size != RECORD.size:
+        raise TraceError(f"Unsupported trace version {version}")
+    while True:
+        chunk = file.read(size * 4096)
+        if not chunk:
+            return
+        if len(chunk) % size:
+            raise TraceError("Trace ends in a partial record")
+        for fields in RECORD.iter_unpack(chunk):
+            yield TraceRecord(*fields)
+
+
+class MachineState(NamedTuple):
+    """Machine state reconstructed from a trace"""
+    step: int
+    regs: list[int]
+    cc: int
+    memory: list[int]
+    outputs: list[int]
+
+
+def replay(words: list[int], records: Iterable[TraceRecord], step: int,
+           memory_size: int=512) -> MachineState:
+    """State after the first step records of a trace of the program
+    words (i.e., just before it executed instruction number step),
+    starting from a freshly loaded memory.  Writes to the output
+    port are collected as outputs rather than stored; transfers by
+    a DMA device are not traced, so are not replayed.
+    """
+    memory = list(words) + [0] * max(0, memory_size - len(words))
+    regs = 16 * [0]
+    cc = CondFlag.ALWAYS.value
+    outputs = []
+    done = 0
+    for record in records:
+        if done == 0 and record.step != 0:
+            raise TraceError(f"Trace starts at step {record.step}, not at the beginning")
+        if done == step:
+            regs[15] = record.pc
+            break
+        regs[15] = record.pc + 1
+        if record.reg != NO_REGISTER:
+            regs[record.reg] = record.value
+        cc = record.cc
+        if record.addr != NO_ADDRESS and op_field.extract(record.word) == STORE:
+            if record.addr == OUTPUT_PORT:
+                outputs.append(record.value)
+            else:
+                if record.addr >= len(memory):
+                    memory.extend([0] * (record.addr + 1 - len(memory)))
+                memory[record.addr] = to_word(record.value)   # As Memory.put
+        done += 1
+    else:
+        if done < step:
+            raise TraceError(f"Trace has only {done} steps")
+    return MachineState(done, regs, cc, memory, outputs)
+
+
+def first_divergence(a: Iterable[TraceRecord], b: Iterable[TraceRecord]
+                     ) -> Optional[tuple[int, Optional[TraceRecord], Optional[TraceRecord]]]:
+    """The first step at which traces a and b differ, with their
+    records for that step (None where a trace has ended), or None
+    if they are the same.  Traces that start at different steps
+    (e.g., saved by a RingTracer) are compared where they overlap.
+    """
+    a, b = iter(a), iter(b)
+    rec_a, rec_b = next(a, None), next(b, None)
+    # Line up the starts
+    while rec_a is not None and rec_b is not None and rec_a.step != rec_b.step:
+        if rec_a.step < rec_b.step:
+            rec_a = next(a, None)
+        else:
+            rec_b = next(b, None)
+    while rec_a is not None or rec_b is not None:
+        if rec_a != rec_b:
+            return ((rec_a or rec_b).step, rec_a, rec_b)
+        rec_a, rec_b = next(a, None), next(b, None)
+    return None
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Duck Machine trace tool")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="List trace records")
+    show.add_argument("trace", type=argparse.FileType('rb'))
+    show.add_argument("--start", type=int, default=0, help="First step to list")
+    show.add_argument("--count", type=int, help="Number of steps to list")
+    state = commands.add_parser("replay", help="Machine state at a step")
+    state.add_argument("objfile", type=argparse.FileType('rb'),
+                       help="Object file the trace was made from")
+    state.add_argument("trace", type=argparse.FileType('rb'))
+    state.add_argument("--step", type=int, required=True)
+    state.add_argument("--memory", type=int, default=512,
+                       help="Memory size in words")
+    diff = commands.add_parser("diff", help="First divergence of two traces")
+    diff.add_argument("trace_a", type=argparse.FileType('rb'))
+    diff.add_argument("trace_b", type=argparse.FileType('rb'))
+    args = parser.parse_args()
+    return args
+
+
+def main(args) -> int:
+    if args.command == "show":
+        end = None if args.count is None else args.start + args.count
+        for record in read_trace(args.trace):
+            if end is not None and record.step >= end:
+                break
+            if record.step >= args.start:
+                print(record)
+    elif args.command == "replay":
+        words, _symbols = read_object(args.objfile)
+        state = replay(words, read_trace(args.trace), args.step, args.memory)
+        print(f"Step {state.step}, condition {CondFlag(state.cc)}")
+        for i in range(0, 16, 4):
+            print("   ".join(f"r{r:<2} {state.regs[r]:>10}" for r in range(i, i + 4)))
+        changed = [addr for addr, value in enumerate(state.memory)
+                   if value != (words[addr] if addr < len(words) else 0)]
+        for addr in changed:
+            print(f"[{addr}] = {state.memory[addr]}")
+        print(f"Output: {state.outputs}")
+    else:
+        divergence = first_divergence(read_trace(args.trace_a), read_trace(args.trace_b))
+        if divergence is None:
+            print("Traces are the same")
+            return 0
+        step, rec_a, rec_b = divergence
+        print(f"First difference at step {step}")
+        print(f"< {rec_a if rec_a else '(trace ended)'}")
+        print(f"> {rec_b if rec_b else '(trace ended)'}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(cli()))
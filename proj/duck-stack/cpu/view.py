@@ -1,34 +1,59 @@
 """
 Graphical display of the duck machine state. 
+
+Events from the CPU and memory only mark registers and memory
+cells as changed; the window is redrawn once per frame, either
+at most fps times per second or once every steps_per_frame steps.
+Redrawing on every event would make the display the bottleneck.
 """
 import context   # Import paths are relative to project root
 from cpu.mvc import MVCEvent
 from cpu.cpu import CPU, CPUStep
 from cpu.memory import MemoryEvent, MemoryRead, MemoryWrite
 
-from graphics.graphics import Rectangle, Point, Text, GraphWin
+from graphics.graphics import Rectangle, Point, Text, GraphWin, update
+
+import time
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Fill colors for memory cells
+READ_COLOR = "#DDFFDD"
+WRITE_COLOR = "#DDDDFF"
+
+
 class MachineStateView(object):
     """View of the CPU and memory state"""
 
     def __init__(self, model: CPU,
-                     width: int, height: int):
-        """Create a view width x height"""
+                     width: int, height: int,
+                     fps: float = 30, steps_per_frame: int = None):
+        """Create a view width x height, redrawn at most fps times
+        a second, or (if steps_per_frame is given) after every
+        steps_per_frame steps.  fps=None redraws every step.
+        """
         log.debug(f"Creating MachineStateView")
         self.width = width
         self.height = height
         self.model = model
+        self.frame_seconds = 1.0 / fps if fps else 0.0
+        self.steps_per_frame = steps_per_frame
+        # Changes not yet drawn
+        self.steps_pending = 0
+        self.next_frame = time.perf_counter()
+        self.instr_pending = None           # (word, instr) of the latest step
+        self.cells_pending: dict[int, tuple[str, int]] = {}   # addr -> (color, value)
+        # What is on screen, to skip redrawing unchanged registers
+        self.reg_shown = [None] * 16
         log.debug("Registering listeners")
         model.register_listener(self)
         model.memory.register_listener(self)
 
         log.debug("Creating GraphWin to display machine state")
-        self.window = GraphWin("Duck Machine", width, height)
+        self.window = GraphWin("Duck Machine", width, height, autoflush=False)
 
         # CPU in left 1/3 of window
         cpu_region = Rectangle(Point(5,5),
@@ -51,6 +76,9 @@ class MachineStateView(object):
         # Memory in right 2/3 of window
         log.debug("Drawing the computer memory")
         self._draw_memory()
+        # Loading the program (and DMA) writes memory in bulk,
+        # without events
+        model.memory.block_write_hooks.append(self._block_written)
 
     def _draw_instruction(self, in_rect):
         x_center = (in_rect.p1.x + in_rect.p2.x)/2.0
@@ -133,50 +161,58 @@ class MachineStateView(object):
         self.mem_cells.append(mem_cell)
 
     def notify(self, event: MVCEvent):
-        """Something to depict"""
-        log.debug(f"Notified of event {event}")
+        """Something to depict (in the next frame)"""
         if isinstance(event, CPUStep):
-            self._cpu_step(event)
+            self.instr_pending = (event.instr_word, event.instr)
+            self.steps_pending += 1
+            if self._frame_due():
+                self.flush()
         elif isinstance(event, MemoryEvent):
             self._memory_event(event)
         else:
             log.debug(f"Ignoring unknown event kind {event}")
 
-    def _cpu_step(self, event: CPUStep):
-        self.instr_raw.setText(str(event.instr_word))
-        self.instr_decoded.setText(str(event.instr))
+    def _frame_due(self) -> bool:
+        if self.steps_per_frame:
+            return self.steps_pending >= self.steps_per_frame
+        return time.perf_counter() >= self.next_frame
+
+    def flush(self):
+        """Draw everything that has changed since the last frame"""
+        if self.instr_pending is not None:
+            instr_word, instr = self.instr_pending
+            self.instr_raw.setText(str(instr_word))
+            self.instr_decoded.setText(str(instr))
+            self.instr_pending = None
         for reg_index in range(16):
             # Index both the display and the model registers
             reg_value = self.model.registers[reg_index].get()
-            reg_display = self.registers[reg_index]
-            reg_display.label.setText(str(reg_value))
+            if reg_value != self.reg_shown[reg_index]:
+                self.registers[reg_index].label.setText(str(reg_value))
+                self.reg_shown[reg_index] = reg_value
+        for address, (color, value) in self.cells_pending.items():
+            cell_display = self.mem_cells[address]
+            cell_display.setFill(color)
+            cell_display.label.setText(str(value))
+        self.cells_pending.clear()
+        self.steps_pending = 0
+        self.next_frame = time.perf_counter() + self.frame_seconds
+        update()
+
+    def _block_written(self, base: int, length: int):
+        """Words were stored in bulk; show their new values"""
+        shown = range(base, min(base + length, len(self.mem_cells)))
+        for address, value in zip(shown, self.model.memory.dump(shown)):
+            self.cells_pending[address] = (WRITE_COLOR, value)
 
     def _memory_event(self, event):
-        """Memory was accessed"""
-        log.debug(f"Memory event: {event}")
-        memory = event.subject
+        """Memory was accessed; the latest access to each cell
+        determines how it is drawn.
+        """
         address = event.addr
-        value = event.value
         if address >= len(self.mem_cells):
             return
-        cell_display = self.mem_cells[address]
         if isinstance(event, MemoryRead):
-            cell_display.setFill("#DDFFDD")
-        elif isinstance(event,MemoryWrite):
-            cell_display.setFill("#DDDDFF")
-        cell_display.label.setText(str(value))
-
-
-
-
-
-
-
-
-    
-            
-
-            
-            
-        
-            
+            self.cells_pending[address] = (READ_COLOR, event.value)
+        elif isinstance(event, MemoryWrite):
+            self.cells_pending[address] = (WRITE_COLOR, event.value)
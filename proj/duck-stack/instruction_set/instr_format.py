@@ -31,6 +31,10 @@ reg_src1_field = BitField(14, 17)
 reg_src2_field = BitField(10, 13)
 offset_field = BitField(0, 9)
 
+# Memory words are 32-bit two's complement integers
+WORD_MIN = -(1 << 31)
+WORD_MASK = (1 << 32) - 1
+
 # Registers are numbered from 0 to 15, and have names
 # like r3, r15, etc.  Two special registers have additional
 # names:  r0 is called 'zero' because on the DM2022 it always
@@ -152,3 +156,10 @@ def decode(word: int) -> Instruction:
     reg_src2 = reg_src2_field.extract(word)
     offset = offset_field.extract_signed(word)
     return Instruction(op, cond, reg_target, reg_src1, reg_src2, offset)
+
+
+def to_word(value: int) -> int:
+    """The value a 32-bit memory cell holds after storing value:
+    the low-order 32 bits, read as a signed integer.
+    """
+    return ((value - WORD_MIN) & WORD_MASK) + WORD_MIN
@@ -0,0 +1,129 @@
+"""
+Object file formats for the Duck Machine.
+
+Text object files (.obj) hold one decimal integer per line.
+Binary object files hold the same words packed, so that a large
+program can be loaded with one copy rather than parsing a line
+per word:
+
+    header    magic b"DUCK", format version, flags, word count,
+              and symbol count (little-endian, see HEADER)
+    payload   word count 32-bit signed little-endian words
+    symbols   symbol count entries, each an address (32 bits),
+              a name length in bytes (16 bits), and the name
+              (UTF-8)
+
+Symbols (labels from the assembly source) are optional; they are
+for tools like disassemblers, and do not affect loading.
+"""
+
+import context   # Search starting at project root
+from instruction_set.instr_format import to_word
+
+from array import array
+import io
+import mmap
+import struct
+import sys
+from typing import Optional, Sequence
+
+MAGIC = b"DUCK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")   # magic, version, flags, words, symbols
+SYMBOL = struct.Struct("<IH")       # address, name length
+WORD_TYPECODE = "i"
+assert array(WORD_TYPECODE).itemsize == 4
+
+
+class ObjectFileError(Exception):
+    """Malformed object file"""
+    pass
+
+
+def write_binary(words: list[int], file: io.IOBase,
+                 symbols: Optional[dict[str, int]] = None) -> None:
+    """Write words (and optionally a table of label addresses)
+    to a file opened in binary mode.  Like a store to memory,
+    a word outside the 32-bit range keeps its low-order 32 bits.
+    """
+    symbols = symbols or {}
+    payload = array(WORD_TYPECODE)
+    for word in words:
+        try:
+            payload.append(word)
+        except OverflowError:
+            payload.append(to_word(word))
+    if sys.byteorder == "big":
+        payload.byteswap()
+    file.write(HEADER.pack(MAGIC, VERSION, 0, len(payload), len(symbols)))
+    file.write(payload.tobytes())
+    for name, addr in symbols.items():
+        encoded = name.encode("utf-8")
+        file.write(SYMBOL.pack(addr, len(encoded)))
+        file.write(encoded)
+
+
+def parse_binary(data: bytes) -> tuple[array, dict[str, int]]:
+    """Words and symbol table from the contents of a binary
+    object file (bytes, or a buffer such as an mmap)
+    """
+    if len(data) < HEADER.size:
+        raise ObjectFileError("Object file is too short for its header")
+    magic, version, _flags, n_words, n_symbols = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ObjectFileError("Not a binary object file")
+    if version != VERSION:
+        raise ObjectFileError(f"Unsupported object file version {version}")
+    start = HEADER.size
+    end = start + 4 * n_words
+    if len(data) < end:
+        raise ObjectFileError(f"Object file is truncated ({n_words} words expected)")
+    words = array(WORD_TYPECODE)
+    words.frombytes(data[start:end])
+    if sys.byteorder == "big":
+        words.byteswap()
+    symbols = {}
+    pos = end
+    for _ in range(n_symbols):
+        try:
+            addr, length = SYMBOL.unpack_from(data, pos)
+        except struct.error:
+            raise ObjectFileError("Object file symbol table is truncated")
+        pos += SYMBOL.size
+        symbols[bytes(data[pos:pos + length]).decode("utf-8")] = addr
+        pos += length
+    return words, symbols
+
+
+def parse_text(lines) -> list[int]:
+    """Words from a text object file, one integer per line"""
+    return [int(line) for line in lines if line.strip()]
+
+
+def _map(file: io.IOBase) -> Optional[mmap.mmap]:
+    """Read-only memory map of file, or None if it cannot be
+    mapped (e.g., a pipe, an empty file, or a StringIO)
+    """
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def read_object(file: io.IOBase) -> tuple[Sequence[int], dict[str, int]]:
+    """Words and symbol table (empty for text) from an object
+    file in either format, opened in text or binary mode.
+    Regular files are memory-mapped rather than read.
+    """
+    mapped = _map(file)
+    if mapped is not None:
+        with mapped:
+            if mapped[:len(MAGIC)] == MAGIC:
+                return parse_binary(mapped)
+            return parse_text(mapped.read().splitlines()), {}
+    data = file.read()
+    if isinstance(data, str):
+        return parse_text(data.splitlines()), {}
+    if data[:len(MAGIC)] == MAGIC:
+        return parse_binary(data)
+    return parse_text(data.splitlines()), {}
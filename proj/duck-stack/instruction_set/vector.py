@@ -0,0 +1,67 @@
+"""
+Whole-image instruction encoding and decoding with NumPy.
+
+decode_image splits every word of an object image into its
+instruction fields at once, giving a structured array with one
+record per word; encode_image packs such an array back into words.
+The field positions are those of the BitField definitions in
+instr_format, so the two cannot drift apart.
+
+Words that are data rather than instructions decode too (every
+bit pattern has fields); is_instruction tells which words hold a
+valid operation code.
+
+Requires NumPy, which the rest of the instruction set does not.
+"""
+
+import context   # Search starting at project root
+from instruction_set.instr_format import (OpCode, op_field, cond_field,
+    reg_target_field, reg_src1_field, reg_src2_field, offset_field)
+
+import numpy as np
+from typing import Sequence
+
+# Record layout, with the BitField each field comes from
+FIELDS = [
+    ("op", op_field, np.uint8),
+    ("cond", cond_field, np.uint8),
+    ("target", reg_target_field, np.uint8),
+    ("src1", reg_src1_field, np.uint8),
+    ("src2", reg_src2_field, np.uint8),
+    ("offset", offset_field, np.int16)
+]
+INSTR_DTYPE = np.dtype([(name, dtype) for name, _field, dtype in FIELDS])
+
+VALID_OPS = np.array([op.value for op in OpCode], dtype=np.uint8)
+
+
+def decode_image(words: Sequence[int]) -> np.ndarray:
+    """Fields of every word, as a structured array of INSTR_DTYPE"""
+    # Work on the 32-bit two's complement pattern of each word
+    bits = np.asarray(words, dtype=np.int64) & 0xFFFFFFFF
+    fields = np.empty(len(bits), dtype=INSTR_DTYPE)
+    for name, field, dtype in FIELDS:
+        value = (bits >> field.from_bit) & field.mask
+        if field is offset_field:
+            sign_bit = 1 << (field.width - 1)
+            value = (value ^ sign_bit) - sign_bit
+        fields[name] = value.astype(dtype)
+    return fields
+
+
+def encode_image(fields: np.ndarray) -> np.ndarray:
+    """Words (as int64) for a structured array of INSTR_DTYPE,
+    the inverse of decode_image for instruction words
+    """
+    words = np.zeros(len(fields), dtype=np.int64)
+    for name, field, _dtype in FIELDS:
+        value = fields[name].astype(np.int64) & field.mask
+        words |= value << field.from_bit
+    return words
+
+
+def is_instruction(fields: np.ndarray) -> np.ndarray:
+    """Mask of the records whose operation code is valid, i.e.,
+    the words decode() would accept
+    """
+    return np.isin(fields["op"], VALID_OPS)
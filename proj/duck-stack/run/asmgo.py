@@ -1,17 +1,24 @@
 """Translate and run an assembly language program.
 Top-level script chains together assembler phase 1,
-assembler phase 2, and CPU simulator
+assembler phase 2, and CPU simulator.  The stages pass their
+results in memory (see pipeline.py); no temporary files.
+Programs built before are loaded from the build cache (see cache.py).
 """
 import io
 
 import context
-import asm.assembler_phase1 as asm1
-import asm.assembler_phase2 as asm2
-import cpu.duck_machine as machine
+from run.pipeline import build, PipelineError
+from run.cache import BuildCache
+# cpu.duck_machine and instruction_set.objfile are imported
+# when the program is ready to run
 
 import sys
 import argparse
-import os.path
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
 
 def cli():
     """Get arguments from command line"""
@@ -23,30 +30,30 @@ def cli():
                         action="store_true")
     parser.add_argument("-s", "--step", help="Single step mode",
                         action="store_true")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Translate the program even if it was built before")
+    parser.add_argument("--cache-dir",
+                        help="Build cache directory (default $DUCK_CACHE_DIR or ~/.cache/duck-stack)")
     args = parser.parse_args()
     return args
 
-def main(source: io.IOBase, display=False, step=False):
-    # Create and use temporary files in ../programs/tmp
-    this_dir = os.path.abspath(os.path.join(os.path.dirname(__file__)))
-    tmp_dir = os.path.abspath(os.path.join(this_dir, "../programs/tmp"))
-    # Assembler phase 1
-    dasm_path = os.path.join(tmp_dir, "tmp.dasm")
-    dasm = open(dasm_path, "w")
-    asm1.main(source, dasm)
-    dasm.close()
-    # Assembler phase 2
-    obj_path = os.path.join(tmp_dir, "tmp.obj")
-    dasm = open(dasm_path, "r")
-    obj = open(obj_path, "w")
-    asm2.main(dasm, obj)
-    obj.close()
-    # Execute in simulator
-    obj = open(obj_path, "r")
+def main(source: io.IOBase, display=False, step=False, cache: BuildCache=None):
+    try:
+        program = build(source, "asm", cache)
+    except PipelineError as e:
+        for message in e.messages:
+            log.error(message)
+        sys.exit(f"{e.stage} failed")
+    # Execute in simulator, loading the object code from memory
+    import cpu.duck_machine as machine
+    from instruction_set.objfile import write_binary
+    obj = io.BytesIO()
+    write_binary(program.words, obj, program.symbols)
+    obj.seek(0)
     machine.main(obj, display=display, single_step=step)
 
 
 if __name__ == "__main__":
     args = cli()
-    main(args.sourcefile, display=args.display, step=args.step)
-
+    cache = None if args.no_cache else BuildCache(args.cache_dir)
+    main(args.sourcefile, display=args.display, step=args.step, cache=cache)
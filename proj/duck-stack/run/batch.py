@@ -0,0 +1,169 @@
+"""Run many Duck Machine programs, each with its own input,
+in parallel worker processes.
+
+Jobs are JSON lines, each naming an object file and the list of
+integers to supply to the input port (address 510), e.g.,
+    {"id": "fact-5", "obj": "programs/obj/fact.obj", "inputs": [5]}
+For each job, one JSON line of results is written (in job order,
+as soon as it is available):  the status ("ok", "error",
+"step limit", or "timeout"), the values written to the output
+port (address 511), the number of steps, and the run time.
+Each job has a step budget and a time limit, so a program stuck
+in a loop cannot hang the batch.  The time limit is checked
+between steps; a job still running KILL_GRACE seconds past it
+(in one very slow step) has its worker process killed, and is
+reported as "timeout" with no output and null steps.
+"""
+import io
+
+import context
+from cpu.memory import MemoryMappedIO
+from cpu.cpu import CPU
+from cpu.devices import InputDevice, BufferedOutput, attach
+from instruction_set.objfile import read_object
+from run.workers import WorkerPool, JobKilled, WorkerDied
+
+from concurrent.futures import Future
+from collections import deque
+from functools import lru_cache
+import argparse
+import json
+import os
+import sys
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MEMORY_SIZE = 512
+CHECK_TIME_EVERY = 1024   # Steps between checks of the time limit
+KILL_GRACE = 1.0          # Seconds past the time limit before a job is killed
+
+
+def cli():
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Run a batch of Duck Machine jobs")
+    parser.add_argument("jobs", type=argparse.FileType('r'),
+                        nargs="?", default=sys.stdin,
+                        help="Jobs, as JSON lines")
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'),
+                        default=sys.stdout, help="Results, as JSON lines")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--max-steps", type=int, default=10**7,
+                        help="Step budget per job")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="Seconds allowed per job")
+    args = parser.parse_args()
+    return args
+
+
+@lru_cache(maxsize=64)
+def loaded_image(path: str) -> MemoryMappedIO:
+    """Memory with an object file loaded; each worker loads a
+    file once however many jobs run it, and each job runs in a
+    fork of it.
+    """
+    mem = MemoryMappedIO(MEMORY_SIZE)
+    with open(path, "rb") as f:
+        words, _symbols = read_object(f)
+    mem.load_words(words, 0)
+    return mem
+
+
+def run_limited(cpu: CPU, max_steps: int, timeout: float) -> str:
+    """Step cpu until it halts ("ok") or exceeds its budget
+    ("step limit" or "timeout").  Like CPU.run, leaves the
+    number of steps executed in cpu.step_count, even if a step
+    raises an exception.
+    """
+    deadline = time.perf_counter() + timeout
+    steps = 0
+    try:
+        while not cpu.halted:
+            if steps >= max_steps:
+                return "step limit"
+            if steps % CHECK_TIME_EVERY == 0 and time.perf_counter() > deadline:
+                return "timeout"
+            cpu.step()
+            steps += 1
+        return "ok"
+    finally:
+        cpu.step_count = steps
+
+
+def run_job(job: dict, max_steps: int, timeout: float) -> dict:
+    """Run one job to completion, or until it exceeds its
+    budget, and describe the result.
+    """
+    output = BufferedOutput()
+    result = {"id": job.get("id"), "obj": job["obj"], "status": "ok",
+              "output": output.values, "steps": 0}
+    started = time.perf_counter()
+    cpu = None
+    try:
+        mem = loaded_image(job["obj"]).fork()
+        attach(mem, InputDevice(job.get("inputs", [])), output)
+        cpu = CPU(mem)
+        result["status"] = run_limited(cpu, max_steps, timeout)
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = f"{e.__class__.__name__}: {e}"
+    result["steps"] = cpu.step_count if cpu else 0
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def _job_result(job: dict, future: Future, limit: float) -> dict:
+    """The result of a job run in a worker, or of its worker
+    being killed
+    """
+    try:
+        return future.result()
+    except (JobKilled, WorkerDied) as e:
+        killed = isinstance(e, JobKilled)
+        return {"id": job.get("id"), "obj": job.get("obj"),
+                "status": "timeout" if killed else "error",
+                "output": [], "steps": None,
+                "seconds": limit if killed else None,
+                "message": f"{e.__class__.__name__}: {e}"}
+
+
+def run_batch(jobs, max_steps: int=10**7, timeout: float=10.0,
+              workers: int=None):
+    """Generate the result of each job, in order, running
+    them in a pool of worker processes
+    """
+    limit = timeout + KILL_GRACE
+    with WorkerPool(workers) as pool:
+        # A few jobs queued per worker keeps workers busy, without
+        # reading far ahead of the results
+        running = deque()
+        for job in jobs:
+            running.append((job, pool.submit(run_job, (job, max_steps, timeout), limit)))
+            if len(running) >= 4 * pool.size:
+                yield _job_result(*running.popleft(), limit)
+        while running:
+            yield _job_result(*running.popleft(), limit)
+
+
+def read_jobs(file: io.IOBase):
+    """Jobs from JSON lines, skipping blank lines"""
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def main(jobs: io.IOBase, output: io.IOBase, workers: int=None,
+         max_steps: int=10**7, timeout: float=10.0):
+    for result in run_batch(read_jobs(jobs), max_steps=max_steps,
+                            timeout=timeout, workers=workers):
+        print(json.dumps(result), file=output, flush=True)
+
+
+if __name__ == "__main__":
+    args = cli()
+    main(args.jobs, args.output, workers=args.workers,
+         max_steps=args.max_steps, timeout=args.timeout)
@@ -0,0 +1,249 @@
+"""Build a tree of Duck Machine programs, rebuilding only what changed.
+
+The tree is laid out like programs/:  Mallard sources in mal/,
+assembly language in asm/, resolved assembly language in dasm/,
+and object code in obj/, with matching names (and subdirectories).
+Each program is built by a chain of stages:
+
+    mal/foo.mal  --compile-->  asm/foo.asm
+    asm/foo.asm  --assembler phase 1-->  dasm/foo.dasm
+    dasm/foo.dasm  --assembler phase 2-->  obj/foo.obj
+
+An .asm file with no .mal file of the same name is a source.
+
+A manifest (.build-manifest.json in the tree) records, for each
+output, a hash of the input and the stage's code it was built from
+and a hash of the output itself.  An output is rebuilt only if it
+is missing or either hash no longer matches, so editing a source,
+an output, or the compiler or assembler rebuilds just what it
+affects.  Programs are built in parallel worker processes; each
+output's status, time, and error messages are reported.
+
+    python3 run/build.py programs
+"""
+import io
+
+import context
+from run.cache import tool_version
+from run.pipeline import compile_mallard, transform, assemble_resolved, PipelineError
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MANIFEST = ".build-manifest.json"
+
+# (input folder, output folder, stage), in build order
+STAGES = [("mal", "asm", "compile"),
+          ("asm", "dasm", "assembler_phase1"),
+          ("dasm", "obj", "assembler_phase2")]
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Build Duck Machine programs")
+    parser.add_argument("root", nargs="?", default="programs",
+                        help="Tree with mal, asm, dasm, and obj folders")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild every output")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Also list outputs that were up to date")
+    parser.add_argument("--json", action="store_true",
+                        help="Report each output as a JSON line")
+    args = parser.parse_args()
+    return args
+
+
+def digest(*parts: bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def run_stage(stage: str, source: bytes) -> bytes:
+    """Output of a stage for the contents of its input file"""
+    try:
+        text = source.decode()
+    except UnicodeDecodeError as e:
+        raise PipelineError(stage, [f"Input is not UTF-8 text: {e}"])
+    if stage == "compile":
+        lines = compile_mallard(text)
+    elif stage == "assembler_phase1":
+        lines = transform(text)
+    else:
+        lines = [str(word) for word in assemble_resolved(text).words]
+    return "".join(f"{line}\n" for line in lines).encode()
+
+
+def write_atomic(path: pathlib.Path, data: bytes) -> None:
+    """Replace the contents of path, so that no reader sees a
+    partly written file
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def sources(root: pathlib.Path) -> Iterator[tuple[str, pathlib.Path]]:
+    """(first stage folder, path relative to it without suffix)
+    of each program in the tree
+    """
+    mal = root / "mal"
+    compiled = set()
+    for path in sorted(mal.rglob("*.mal")):
+        name = path.relative_to(mal).with_suffix("")
+        compiled.add(name)
+        yield "mal", name
+    asm = root / "asm"
+    for path in sorted(asm.rglob("*.asm")):
+        name = path.relative_to(asm).with_suffix("")
+        if name not in compiled:
+            yield "asm", name
+
+
+def chain(first: str) -> list[tuple[str, str, str]]:
+    """The stages that build a program from its first folder"""
+    start = [in_folder for in_folder, _out, _stage in STAGES].index(first)
+    return STAGES[start:]
+
+
+def output_of(out_folder: str, name: pathlib.Path) -> str:
+    """Path of an output, relative to the root of the tree"""
+    return (pathlib.PurePosixPath(out_folder) / name.as_posix()).with_suffix(f".{out_folder}").as_posix()
+
+
+def build_program(root: pathlib.Path, first: str, name: pathlib.Path,
+                  manifest: dict, force: bool=False) -> list[dict]:
+    """Bring the outputs of one program up to date, given their
+    manifest entries.  Returns a report (with the new manifest
+    entry) for each stage, in order; after an error, the later
+    stages are not attempted.
+    """
+    reports = []
+    for in_folder, out_folder, stage in chain(first):
+        source = (root / in_folder / name).with_suffix(f".{in_folder}")
+        output = root / output_of(out_folder, name)
+        report = {"source": source.relative_to(root).as_posix(),
+                  "output": output.relative_to(root).as_posix(),
+                  "stage": stage}
+        reports.append(report)
+        started = time.perf_counter()
+        try:
+            data = source.read_bytes()
+            input_hash = digest(stage.encode(), tool_version(stage).encode(), data)
+            recorded = manifest.get(report["output"])
+            current = output.read_bytes() if output.exists() else None
+            if (not force and current is not None and recorded is not None
+                    and recorded["input"] == input_hash
+                    and recorded["output"] == digest(current)):
+                report["status"] = "up to date"
+                report["entry"] = recorded
+            else:
+                result = run_stage(stage, data)
+                write_atomic(output, result)
+                report["status"] = "built"
+                report["entry"] = {"input": input_hash, "output": digest(result)}
+        except Exception as e:
+            # Any failure is reported for this output, rather than
+            # ending the whole build
+            report["status"] = "error"
+            if isinstance(e, PipelineError):
+                report["messages"] = e.messages
+            elif isinstance(e, OSError):
+                report["messages"] = [str(e)]
+            else:
+                report["messages"] = [f"{e.__class__.__name__}: {e}"]
+        report["seconds"] = time.perf_counter() - started
+        if report["status"] == "error":
+            break
+    return reports
+
+
+def _build_program_args(args: tuple) -> list[dict]:
+    return build_program(*args)
+
+
+def build(root: pathlib.Path, jobs: int=None, force: bool=False) -> Iterator[dict]:
+    """Build every program in the tree, generating a report for
+    each output (as soon as its program is done), and record the
+    results in the manifest
+    """
+    manifest_path = root / MANIFEST
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    work = []
+    for first, name in sources(root):
+        # Each task carries just its own program's manifest entries
+        outputs = [output_of(out_folder, name) for _in, out_folder, _stage in chain(first)]
+        entries = {output: manifest[output] for output in outputs if output in manifest}
+        work.append((root, first, name, entries, force))
+    if jobs == 1:
+        results = map(_build_program_args, work)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(_build_program_args, work, chunksize=8)
+    try:
+        for reports in results:
+            for report in reports:
+                entry = report.pop("entry", None)
+                if entry is None:
+                    manifest.pop(report["output"], None)
+                else:
+                    manifest[report["output"]] = entry
+                yield report
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        write_atomic(manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+
+def main(root: str, jobs: int=None, force: bool=False, verbose: bool=False,
+         as_json: bool=False, out: io.IOBase=sys.stdout) -> bool:
+    """Build and report; False if any output failed to build"""
+    started = time.perf_counter()
+    counts = {"built": 0, "up to date": 0, "error": 0}
+    for report in build(pathlib.Path(root), jobs, force):
+        counts[report["status"]] += 1
+        if as_json:
+            print(json.dumps(report), file=out)
+        elif verbose or report["status"] != "up to date":
+            print(f"{report['status']:<10} {report['source']} -> {report['output']}"
+                  f"  {1000 * report['seconds']:.1f} ms", file=out)
+            for message in report.get("messages", []):
+                print(f"    {message}", file=out)
+    if not as_json:
+        print(f"{counts['built']} built, {counts['up to date']} up to date, "
+              f"{counts['error']} failed in {time.perf_counter() - started:.2f} s", file=out)
+    return counts["error"] == 0
+
+
+if __name__ == "__main__":
+    args = cli()
+    ok = main(args.root, jobs=args.jobs, force=args.force,
+              verbose=args.verbose, as_json=args.json)
+    sys.exit(0 if ok else 1)
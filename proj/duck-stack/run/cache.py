@@ -0,0 +1,230 @@
+"""Content-addressed cache of build artifacts.
+
+The compiler and assembler stages are pure functions of their
+input text and of the code of the stage itself, so their outputs
+can be kept on disk and reused.  Each artifact is stored under the
+SHA-256 hash of the stage name, a version of the stage (a hash of
+its source files, so changing the compiler or assembler makes old
+entries unreachable), and the input.
+
+Entries are written to a temporary file and renamed into place,
+so a reader never sees a partial entry, even with several
+processes building at once.  Reading an entry refreshes its
+modification time.  The total size of the entries is kept in a
+small file (USAGE), updated under a lock by each write, so that
+writing an entry does not have to look at every other entry; only
+when the total grows beyond the size limit is the cache scanned,
+and the least recently used entries removed.
+"""
+
+import context
+
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, Optional
+import hashlib
+import os
+import pathlib
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None   # Not on Windows; a lost update is corrected by the next scan
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+PROJECT_DIR = pathlib.Path(__file__).resolve().parent.parent
+MAX_BYTES = 64 * 1024 * 1024
+# Eviction removes entries until the cache is this fraction of its
+# limit, so that the next few writes do not scan it again
+LOW_WATER = 0.9
+# Total size of the entries, in the cache directory
+USAGE = "usage"
+
+# The source files whose code determines the output of each stage
+STAGE_SOURCES = {
+    "compile": ["compiler/*.py"],
+    "assembler_phase1": ["asm/assembler_phase1.py", "instruction_set/instr_format.py",
+                         "instruction_set/bitfield.py"],
+    "assembler_phase2": ["asm/assembler_phase2.py", "instruction_set/instr_format.py",
+                         "instruction_set/bitfield.py", "instruction_set/objfile.py"]
+}
+# A whole build, from source language to object code
+STAGE_SOURCES["object"] = sorted(set(sum(STAGE_SOURCES.values(), [])))
+
+
+def default_dir() -> pathlib.Path:
+    """$DUCK_CACHE_DIR, or duck-stack in the user's cache directory"""
+    if "DUCK_CACHE_DIR" in os.environ:
+        return pathlib.Path(os.environ["DUCK_CACHE_DIR"])
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "duck-stack"
+
+
+@lru_cache(maxsize=None)
+def tool_version(stage: str) -> str:
+    """Hash of the source code of a stage"""
+    digest = hashlib.sha256()
+    for pattern in STAGE_SOURCES[stage]:
+        for path in sorted(PROJECT_DIR.glob(pattern)):
+            digest.update(path.relative_to(PROJECT_DIR).as_posix().encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    """Artifacts on disk, by content hash"""
+
+    def __init__(self, directory: pathlib.Path=None, max_bytes: int=MAX_BYTES) -> None:
+        self.directory = pathlib.Path(directory) if directory else default_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, stage: str, data: bytes) -> str:
+        """Key of the output of stage for input data"""
+        digest = hashlib.sha256()
+        digest.update(stage.encode())
+        digest.update(b"\0" + tool_version(stage).encode() + b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / key[:2] / key[2:]
+
+    def get(self, key: str) -> bytes:
+        """The artifact stored under key, or None"""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:   # Usually not found; an unreadable cache is a miss too
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)   # Recently used
+        except OSError:
+            pass   # Evicted meanwhile; we have the data anyway
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store an artifact under key.  The cache is only an
+        optimization, so if it cannot be written (e.g., the
+        directory is read-only or the disk is full), the artifact
+        is just not kept.
+        """
+        try:
+            replaced = self._write(self._path(key), data)
+        except OSError as e:
+            log.warning(f"Not caching {key[:12]}: {e}")
+            return
+        try:
+            with self._usage() as usage:
+                total = self._read_usage(usage)
+                if total is None:
+                    total = sum(size for _used, size, _path in self.entries())
+                else:
+                    total += len(data) - replaced
+                if total > self.max_bytes:
+                    total = self._evict()
+                self._write_usage(usage, total)
+        except OSError as e:
+            # The recorded total may be off until the next scan
+            log.warning(f"Could not update cache usage: {e}")
+
+    @staticmethod
+    def _write(path: pathlib.Path, data: bytes) -> int:
+        """Write an entry, atomically; the size of the entry it replaced"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return replaced
+
+    @contextmanager
+    def _usage(self) -> Iterator:
+        """The usage file, open and locked against other processes"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / USAGE, "a+") as usage:
+            if fcntl is not None:
+                fcntl.flock(usage, fcntl.LOCK_EX)
+            yield usage   # Closing the file releases the lock
+
+    @staticmethod
+    def _read_usage(usage) -> Optional[int]:
+        """Recorded total size, or None if there is no record"""
+        usage.seek(0)
+        try:
+            return int(usage.read())
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _write_usage(usage, total: int) -> None:
+        usage.seek(0)
+        usage.truncate()
+        usage.write(str(total))
+        usage.flush()
+
+    def entries(self) -> list[tuple[float, int, pathlib.Path]]:
+        """(last use, size, path) of each entry"""
+        found = []
+        if not self.directory.is_dir():
+            return found
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, pathlib.Path(entry.path)))
+        return found
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache
+        fits in its size limit
+        """
+        with self._usage() as usage:
+            self._write_usage(usage, self._evict())
+
+    def _evict(self) -> int:
+        """Scan the cache and evict (with the usage file locked);
+        the new total size
+        """
+        entries = self.entries()
+        total = sum(size for _used, size, _path in entries)
+        if total <= self.max_bytes:
+            return total
+        for _used, size, path in sorted(entries):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass   # Removed by clear in another process
+            log.debug(f"Evicted {path.name}")
+            total -= size
+            if total <= LOW_WATER * self.max_bytes:
+                break
+        return total
+
+    def clear(self) -> None:
+        with self._usage() as usage:
+            for _used, _size, path in self.entries():
+                path.unlink(missing_ok=True)
+            self._write_usage(usage, 0)
@@ -0,0 +1,151 @@
+"""Compile (or assemble) and go, through the duck-stack daemon.
+
+Like malgo.py and asmgo.py, but the work is done by a running
+daemon (daemon.py), which already has the compiler, assembler,
+and simulator loaded, so a small program is done in a few
+milliseconds rather than after a full interpreter start.
+
+    python3 run/daemon.py &
+    python3 run/client.py programs/mal/fact.mal --input-file in.txt
+    python3 run/client.py --asm programs/asm/sum.asm < in.txt
+
+Inputs for the input port are read from --input-file or standard
+input (whitespace-separated integers) before the program is sent;
+a program read from standard input needs --input-file.
+The graphical display and single stepping are interactive, so
+with -d or -s the program runs here, through malgo.py or asmgo.py.
+
+Client is also the API for other Python programs; it keeps its
+connection open for any number of requests (see daemon.py for the
+requests and replies).
+"""
+import io
+
+import context
+# Only what a request needs; the point is to start quickly
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+def default_socket() -> str:
+    """$DUCK_SOCKET, or a socket private to this user"""
+    if "DUCK_SOCKET" in os.environ:
+        return os.environ["DUCK_SOCKET"]
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "duck-stack.sock")
+    return f"/tmp/duck-stack-{os.getuid()}.sock"
+
+
+class DaemonError(Exception):
+    """The daemon is not running or did not answer"""
+    pass
+
+
+class Client(object):
+    """A connection to the daemon"""
+
+    def __init__(self, path: str=None) -> None:
+        self.path = path or default_socket()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(self.path)
+        except OSError as e:
+            self.sock.close()
+            raise DaemonError(f"No daemon at {self.path} ({e.strerror}); "
+                              f"start one with run/daemon.py")
+        self.replies = self.sock.makefile("rb")
+
+    def call(self, request: dict) -> dict:
+        """Send a request and wait for its reply"""
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+        line = self.replies.readline()
+        if not line:
+            raise DaemonError("Daemon closed the connection")
+        return json.loads(line)
+
+    def close(self) -> None:
+        self.replies.close()
+        self.sock.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def cli():
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Compile and go, using the daemon")
+    parser.add_argument("sourcefile", type=argparse.FileType('r'),
+                            nargs="?", default=sys.stdin,
+                            help="Mallard (or, with --asm, assembly code) source file")
+    parser.add_argument("--asm", action="store_true",
+                        help="Source is Duck Machine assembly code, as for asmgo.py")
+    parser.add_argument("-d", "--display", help="Graphical display (runs locally)",
+                        action="store_true")
+    parser.add_argument("-s", "--step", help="Single step mode (runs locally)",
+                        action="store_true")
+    parser.add_argument("--input-file", type=argparse.FileType('r'),
+                        help="Input values (default standard input)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Translate the program even if it was built before")
+    parser.add_argument("--socket", default=None,
+                        help="Daemon socket (default $DUCK_SOCKET)")
+    args = parser.parse_args()
+    if (args.sourcefile is sys.stdin and args.input_file is None
+            and not (args.display or args.step)):
+        parser.error("with the program on standard input, give inputs with --input-file")
+    return args
+
+
+def read_inputs(file: io.IOBase) -> list[int]:
+    return [int(value) for value in file.read().split()]
+
+
+def main(source: io.IOBase, language: str="mal", inputs: list[int]=(),
+         cache: bool=True, path: str=None) -> int:
+    """Run a program through the daemon and print its output
+    the way duck_machine.py does; the exit status
+    """
+    request = {"op": "run", "language": language, "source": source.read(),
+               "inputs": list(inputs), "cache": cache}
+    try:
+        with Client(path) as client:
+            reply = client.call(request)
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return 2
+    for value in reply.get("output", []):
+        print(f"Quack!: {value}")
+    if reply["status"] == "ok":
+        print("Halted")
+        return 0
+    if "stage" in reply:
+        print(f"{reply['stage']} failed:", file=sys.stderr)
+        for message in reply["messages"]:
+            print(f"    {message}", file=sys.stderr)
+    else:
+        print(f"{reply['status']}: {reply.get('message', '')}".rstrip(": "), file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    args = cli()
+    if args.display or args.step:
+        if args.asm:
+            import run.asmgo as go
+        else:
+            import run.malgo as go
+        from run.cache import BuildCache
+        go.main(args.sourcefile, display=args.display, step=args.step,
+                cache=None if args.no_cache else BuildCache())
+        sys.exit(0)
+    inputs = read_inputs(args.input_file or sys.stdin)
+    sys.exit(main(args.sourcefile, "asm" if args.asm else "mal", inputs,
+                  cache=not args.no_cache, path=args.socket))
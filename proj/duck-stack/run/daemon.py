@@ -0,0 +1,275 @@
+"""Long-lived compile, assemble, and run server.
+
+Starting Python and importing the compiler, assembler, and
+simulator costs far more than translating and running a small
+program.  The daemon pays that once: it listens on a Unix domain
+socket and hands each request to a pool of worker processes that
+keep those modules loaded (and share the build cache, cache.py).
+
+Requests and replies are JSON objects, one per line, and a client
+may send any number of them on one connection.  Requests:
+
+    {"op": "compile", "source": "..."}
+        -> {"status": "ok", "lines": [...]}
+    {"op": "assemble", "source": "..."}
+        -> {"status": "ok", "words": [...], "symbols": {...}}
+    {"op": "run", "language": "mal" | "asm", "source": "...", "inputs": [...]}
+    {"op": "run", "words": [...], "inputs": [...]}
+        -> {"status": "ok", "output": [...], "steps": n}
+    {"op": "ping"}
+        -> {"status": "ok"}
+
+A run may also give "max_steps" and "timeout" (seconds), and any
+request may give "cache": false to bypass the build cache.  A
+failed request has status "error" (with a message, and for a
+translation error the stage and its messages), "step limit", or
+"timeout".  Every reply includes the time spent, in "seconds".
+A run still going KILL_GRACE seconds past its timeout (counted
+from the start of the request, and so including its build) has
+its worker process killed and replaced, and gets status "timeout"
+with no output.
+
+    python3 run/daemon.py [--socket PATH] [-w WORKERS]
+
+client.py is the command line client and Python API.
+"""
+
+import context
+from run.client import default_socket
+from run.cache import BuildCache
+from run.pipeline import compile_mallard, build, PipelineError
+from run.batch import run_limited, KILL_GRACE
+from run.workers import WorkerPool, JobKilled, WorkerDied
+from cpu.memory import MemoryMappedIO
+from cpu.cpu import CPU
+from cpu.devices import InputDevice, BufferedOutput, attach
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MEMORY_SIZE = 512
+MAX_STEPS = 10**7
+TIMEOUT = 10.0
+# Longest request line, in bytes (asyncio's default is only 64 KiB)
+REQUEST_LIMIT = 64 * 1024 * 1024
+
+# Each worker process's build cache (None for no cache)
+_cache = None
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Duck Machine compile and run daemon")
+    parser.add_argument("--socket", default=default_socket(),
+                        help="Unix domain socket to listen on (default $DUCK_SOCKET)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not use the build cache")
+    parser.add_argument("--cache-dir",
+                        help="Build cache directory (default $DUCK_CACHE_DIR or ~/.cache/duck-stack)")
+    args = parser.parse_args()
+    return args
+
+
+def init_worker(cache_dir: str, use_cache: bool) -> None:
+    """Set up a worker process, loading every stage now rather
+    than on its first request
+    """
+    global _cache
+    import compiler.compile, asm.assembler_phase1, asm.assembler_phase2
+    import instruction_set.objfile
+    _cache = BuildCache(cache_dir) if use_cache else None
+
+
+def handle(request: dict) -> dict:
+    """Carry out one request (in a worker process)"""
+    started = time.perf_counter()
+    try:
+        reply = _dispatch(request)
+    except PipelineError as e:
+        reply = {"status": "error", "message": str(e), "stage": e.stage,
+                 "messages": e.messages}
+    except Exception as e:
+        reply = {"status": "error", "message": f"{e.__class__.__name__}: {e}"}
+    reply["seconds"] = time.perf_counter() - started
+    return reply
+
+
+def _dispatch(request: dict) -> dict:
+    op = request.get("op")
+    cache = _cache if request.get("cache", True) else None
+    if op == "ping":
+        return {"status": "ok", "pid": os.getpid()}
+    if op == "compile":
+        return {"status": "ok", "lines": compile_mallard(request["source"], cache)}
+    if op == "assemble":
+        program = build(request["source"], "asm", cache)
+        return {"status": "ok", "words": program.words, "symbols": program.symbols}
+    if op == "run":
+        if "words" in request:
+            words = request["words"]
+        else:
+            words = build(request["source"], request.get("language", "mal"), cache).words
+        return run_words(words, request.get("inputs", []),
+                         request.get("max_steps", MAX_STEPS),
+                         request.get("timeout", TIMEOUT))
+    raise ValueError(f"Unknown request {op!r}")
+
+
+def run_words(words: list[int], inputs: list[int], max_steps: int, timeout: float) -> dict:
+    """Run object code on a fresh machine, within a budget"""
+    mem = MemoryMappedIO(MEMORY_SIZE)
+    output = BufferedOutput()
+    attach(mem, InputDevice(inputs), output)
+    mem.load_words(words, 0)
+    cpu = CPU(mem)
+    reply = {"output": output.values}
+    try:
+        reply["status"] = run_limited(cpu, max_steps, timeout)
+    except Exception as e:
+        reply["status"] = "error"
+        reply["message"] = f"{e.__class__.__name__}: {e}"
+    reply["steps"] = cpu.step_count
+    return reply
+
+
+class Daemon(object):
+    """Serves requests from a socket on a pool of workers"""
+
+    def __init__(self, path: str, workers: int=None, cache_dir: str=None,
+                 use_cache: bool=True, limit: int=REQUEST_LIMIT) -> None:
+        self.path = path
+        self.limit = limit
+        self.workers = workers or os.cpu_count()
+        self.pool = WorkerPool(self.workers, initializer=init_worker,
+                               initargs=(cache_dir, use_cache))
+        self.requests = 0
+
+    async def serve_client(self, reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter) -> None:
+        """Answer a connection's requests, in order"""
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    line = e.partial   # A last request with no newline
+                    if not line:
+                        break
+                except asyncio.LimitOverrunError:
+                    await self._skip_line(reader)
+                    line = None
+                try:
+                    if line is None:
+                        raise ValueError(f"Request is longer than {self.limit} bytes")
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request must be a JSON object")
+                except ValueError as e:
+                    reply = {"status": "error", "message": f"Bad request: {e}"}
+                else:
+                    reply = await self.submit(request)
+                self.requests += 1
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass   # Client went away
+        finally:
+            writer.close()
+
+    async def submit(self, request: dict) -> dict:
+        """Carry out a request in a worker, killing the worker if
+        a run goes on past its timeout
+        """
+        deadline = None
+        if request.get("op") == "run":
+            deadline = request.get("timeout", TIMEOUT) + KILL_GRACE
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self.pool.submit(handle, (request,), deadline))
+        except JobKilled as e:
+            reply = {"status": "timeout", "output": [], "message": str(e)}
+        except WorkerDied as e:
+            reply = {"status": "error", "message": str(e)}
+        reply["seconds"] = time.perf_counter() - started
+        return reply
+
+    @staticmethod
+    async def _skip_line(reader: asyncio.StreamReader) -> None:
+        """Discard the rest of a line too long to read, so that
+        the next request starts at the next line
+        """
+        while True:
+            try:
+                await reader.readuntil(b"\n")
+                return
+            except asyncio.LimitOverrunError as e:
+                await reader.readexactly(e.consumed)
+            except asyncio.IncompleteReadError:
+                return
+
+    def _claim_socket(self) -> None:
+        """Remove a socket file left by a daemon that is gone;
+        refuse to start if one is still answering on it
+        """
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+        else:
+            raise SystemExit(f"A daemon is already listening at {self.path}")
+        finally:
+            probe.close()
+
+    async def start(self) -> asyncio.AbstractServer:
+        """Start the workers, then listen on the socket"""
+        self._claim_socket()
+        # Wait for the workers to load every stage, so the first
+        # request finds them warm
+        await asyncio.gather(*(self.submit({"op": "ping"}) for _ in range(self.workers)))
+        server = await asyncio.start_unix_server(self.serve_client, path=self.path,
+                                                 limit=self.limit)
+        os.chmod(self.path, 0o600)
+        return server
+
+    async def serve(self) -> None:
+        """Serve until interrupted or terminated"""
+        server = await self.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        log.info(f"Listening on {self.path}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.pool.shutdown()
+            log.info(f"Served {self.requests} requests")
+
+
+def main(path: str, workers: int=None, cache_dir: str=None, use_cache: bool=True):
+    daemon = Daemon(path, workers, cache_dir, use_cache)
+    asyncio.run(daemon.serve())
+
+
+if __name__ == "__main__":
+    args = cli()
+    main(args.socket, workers=args.workers, cache_dir=args.cache_dir,
+         use_cache=not args.no_cache)
@@ -0,0 +1,211 @@
+"""In-process compile, assemble, and run.
+
+The same stages as malgo.py and asmgo.py (compiler, assembler
+phase 1, assembler phase 2, loader, CPU), chained as a library:
+each stage hands the next an in-memory list of lines or words, so
+nothing is written to disk.  Every call has its own compiler
+context, symbol table, memory, and devices, and errors are
+collected per call rather than printed, so calls from several
+threads at once do not interfere.
+
+    from run.pipeline import compile_and_run
+    compile_and_run("x = read; print x * x;", [7])    # [49]
+
+Given a BuildCache (see cache.py), each stage's output is kept
+on disk, keyed by its input, and a build whose source has been
+built before goes straight to loading the object code.
+"""
+import io
+
+import context
+# The stages are imported when first used, like in malgo.py
+
+from run.cache import BuildCache
+
+from typing import Iterable, NamedTuple, Optional, Union
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MEMORY_SIZE = 512
+
+Source = Union[str, list[str], io.TextIOBase]
+
+
+class PipelineError(Exception):
+    """A stage could not translate its input"""
+
+    def __init__(self, stage: str, messages: list[str]) -> None:
+        super().__init__(f"{stage} failed: " + "; ".join(messages))
+        self.stage = stage
+        self.messages = messages
+
+
+class Program(NamedTuple):
+    """Object code, with the address of each label"""
+    words: list[int]
+    symbols: dict[str, int]
+
+
+class RunResult(NamedTuple):
+    """What a run wrote to the output port, and the CPU it ran on"""
+    output: list[int]
+    cpu: "CPU"
+
+
+def _lines(source: Source) -> list[str]:
+    if isinstance(source, str):
+        return source.splitlines()
+    if isinstance(source, list):
+        return source
+    return source.readlines()
+
+
+def _text(lines: list[str]) -> bytes:
+    """Lines as cache input or artifact"""
+    return "\n".join(line.rstrip("\n") for line in lines).encode()
+
+
+def _encode_program(program: Program) -> bytes:
+    from instruction_set.objfile import write_binary
+    obj = io.BytesIO()
+    write_binary(program.words, obj, program.symbols)
+    return obj.getvalue()
+
+
+def _decode_program(data: bytes) -> Program:
+    from instruction_set.objfile import parse_binary
+    words, symbols = parse_binary(data)
+    return Program(list(words), symbols)
+
+
+def compile_mallard(source: Source, cache: Optional[BuildCache]=None) -> list[str]:
+    """Assembly language lines for a Mallard program"""
+    from compiler.compile import compile_program
+    from compiler.llparse import InputError
+    from compiler.lex import LexicalError
+    lines = _lines(source)
+    if cache is not None:
+        key = cache.key("compile", _text(lines))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode().split("\n")
+    try:
+        assm = compile_program(io.StringIO(_text(lines).decode() + "\n"))
+    except (InputError, LexicalError) as e:
+        raise PipelineError("compile", [f"{e.__class__.__name__}: {e}"])
+    except Exception as e:
+        # A program the compiler cannot handle, e.g., an expression
+        # that needs more registers than there are
+        raise PipelineError("compile", [f"Compiler failed: {e.__class__.__name__}: {e}"])
+    if cache is not None:
+        cache.put(key, _text(assm))
+    return assm
+
+
+def transform(source: Source, cache: Optional[BuildCache]=None) -> list[str]:
+    """Assembly language lines with labels resolved and JUMP
+    replaced (assembler phase 1)
+    """
+    import asm.assembler_phase1 as asm1
+    lines = _lines(source)
+    if cache is not None:
+        key = cache.key("assembler_phase1", _text(lines))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode().split("\n")
+    errors = []
+    resolved = asm1.transform(lines, errors)
+    if errors:
+        raise PipelineError("assembler phase 1", errors)
+    if cache is not None:
+        cache.put(key, _text(resolved))
+    return resolved
+
+
+def assemble_resolved(source: Source, cache: Optional[BuildCache]=None) -> Program:
+    """Object code for resolved assembly language, as from
+    transform (assembler phase 2)
+    """
+    import asm.assembler_phase2 as asm2
+    lines = _lines(source)
+    if cache is not None:
+        key = cache.key("assembler_phase2", _text(lines))
+        cached = cache.get(key)
+        if cached is not None:
+            return _decode_program(cached)
+    errors = []
+    symbols = {}
+    words = asm2.assemble(lines, symbols, errors)
+    if errors:
+        raise PipelineError("assembler phase 2", errors)
+    program = Program(words, symbols)
+    if cache is not None:
+        cache.put(key, _encode_program(program))
+    return program
+
+
+def assemble(source: Source, cache: Optional[BuildCache]=None) -> Program:
+    """Object code for an assembly language program, which
+    may use labels and JUMP (i.e., both assembler phases)
+    """
+    return assemble_resolved(transform(source, cache), cache)
+
+
+def build(source: Source, language: str="mal",
+          cache: Optional[BuildCache]=None) -> Program:
+    """Object code for a Mallard ("mal") or assembly language
+    ("asm") program.  With a cache, a source built before is
+    not translated again, nor are its intermediate forms looked up.
+    """
+    assert language in ("mal", "asm")
+    lines = _lines(source)
+    if cache is not None:
+        key = cache.key("object", language.encode() + b"\0" + _text(lines))
+        cached = cache.get(key)
+        if cached is not None:
+            return _decode_program(cached)
+    if language == "mal":
+        lines = compile_mallard(lines, cache)
+    program = assemble(lines, cache)
+    if cache is not None:
+        cache.put(key, _encode_program(program))
+    return program
+
+
+def run(words: list[int], inputs: Iterable[int]=(), engine: str="step",
+        memory_size: int=MEMORY_SIZE) -> RunResult:
+    """Load object code into a fresh machine and run it to HALT,
+    reading inputs from the input port.  Raises InputExhausted
+    (see cpu/devices.py) if the program reads more inputs than
+    it was given.
+    """
+    from cpu.memory import MemoryMappedIO
+    from cpu.cpu import CPU
+    from cpu.devices import InputDevice, BufferedOutput, attach
+    mem = MemoryMappedIO(memory_size)
+    output = BufferedOutput()
+    attach(mem, InputDevice(inputs), output)
+    mem.load_words(words, 0)
+    cpu = CPU(mem)
+    if engine == "threaded":
+        cpu.run_threaded()
+    elif engine == "blocks":
+        cpu.run_blocks()
+    else:
+        cpu.run()
+    return RunResult(output.values, cpu)
+
+
+def assemble_and_run(source: Source, inputs: Iterable[int]=(), engine: str="step",
+                     cache: Optional[BuildCache]=None) -> list[int]:
+    """Output of an assembly language program given inputs"""
+    return run(build(source, "asm", cache).words, inputs, engine).output
+
+
+def compile_and_run(source: Source, inputs: Iterable[int]=(), engine: str="step",
+                    cache: Optional[BuildCache]=None) -> list[int]:
+    """Output of a Mallard program given inputs"""
+    return run(build(source, "mal", cache).words, inputs, engine).output
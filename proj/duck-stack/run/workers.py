@@ -0,0 +1,207 @@
+"""A pool of worker processes that can stop a runaway job.
+
+A job's own time limit is checked between CPU steps, but one step
+can take arbitrarily long (e.g., a multiplication of a number that
+has been squared over and over), and a ProcessPoolExecutor cannot
+stop one of its workers without breaking the whole pool.  Each
+worker here runs one job at a time, so the pool knows which job
+each worker is on and since when; if a job is still running at its
+deadline, the pool kills that worker, fails the job's future with
+JobKilled, and starts a replacement worker.
+
+Workers are started with the "spawn" method, so a worker started
+to replace another does not inherit files or sockets the parent
+opened since (e.g., a daemon's client connections).
+
+    with WorkerPool(4) as pool:
+        future = pool.submit(run_job, (job, max_steps, timeout), deadline=11.0)
+        result = future.result()
+"""
+
+import context
+
+from concurrent.futures import Future
+from multiprocessing.connection import Connection, wait
+from typing import Callable, Optional
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class JobKilled(Exception):
+    """The job was still running at its deadline, so its worker
+    was killed
+    """
+    pass
+
+
+class WorkerDied(Exception):
+    """The worker process running the job exited without a result"""
+    pass
+
+
+def _serve(conn: Connection, initializer: Optional[Callable], initargs: tuple) -> None:
+    """Body of a worker process:  run jobs until told to stop"""
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, args = task
+        try:
+            reply = (True, fn(*args))
+        except Exception as e:
+            reply = (False, e)
+        conn.send(reply)
+
+
+class _Worker(object):
+    """A worker process, and the job it is running"""
+
+    def __init__(self, ctx, initializer: Optional[Callable], initargs: tuple) -> None:
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve, args=(child, initializer, initargs),
+                                   daemon=True)
+        self.process.start()
+        child.close()
+        self.future: Optional[Future] = None
+        self.deadline: Optional[float] = None
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool(object):
+    """Runs functions in worker processes, each job with an
+    optional deadline (seconds from when it starts)
+    """
+
+    def __init__(self, workers: int=None, initializer: Callable=None,
+                 initargs: tuple=()) -> None:
+        self.size = workers or os.cpu_count()
+        self._ctx = multiprocessing.get_context("spawn")
+        self._initializer = initializer
+        self._initargs = initargs
+        self._workers = [self._start() for _ in range(self.size)]
+        self._pending: queue.SimpleQueue = queue.SimpleQueue()
+        self._wake_recv, self._wake_send = multiprocessing.Pipe(duplex=False)
+        self._closed = False
+        self.killed = 0
+        self._manager = threading.Thread(target=self._manage, daemon=True)
+        self._manager.start()
+
+    def _start(self) -> _Worker:
+        return _Worker(self._ctx, self._initializer, self._initargs)
+
+    def submit(self, fn: Callable, args: tuple=(), deadline: float=None) -> Future:
+        """Run fn(*args) in a worker; if it has not returned deadline
+        seconds after it starts, its worker is killed and the
+        future fails with JobKilled
+        """
+        if self._closed:
+            raise RuntimeError("Pool is shut down")
+        future = Future()
+        self._pending.put((future, fn, args, deadline))
+        self._wake_send.send_bytes(b"")
+        return future
+
+    def _manage(self) -> None:
+        """Hand out jobs, collect results, and enforce deadlines"""
+        idle = list(self._workers)
+        busy: dict[Connection, _Worker] = {}
+        waiting = []
+        while not (self._closed and not busy and self._pending.empty()):
+            while True:
+                try:
+                    waiting.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            while idle and waiting:
+                future, fn, args, deadline = waiting.pop(0)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                worker = idle.pop()
+                try:
+                    worker.conn.send((fn, args))
+                except OSError:
+                    future.set_exception(WorkerDied("Worker exited while idle"))
+                    self._replace(worker, idle)
+                    continue
+                except Exception as e:
+                    future.set_exception(e)    # Could not pickle the job
+                    idle.append(worker)
+                    continue
+                worker.future = future
+                worker.deadline = None if deadline is None else time.monotonic() + deadline
+                busy[worker.conn] = worker
+            deadlines = [w.deadline for w in busy.values() if w.deadline is not None]
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            for ready in wait([self._wake_recv] + list(busy), timeout=wait_for):
+                if ready is self._wake_recv:
+                    self._wake_recv.recv_bytes()
+                    continue
+                worker = busy.pop(ready)
+                try:
+                    ok, value = worker.conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(1)
+                    worker.future.set_exception(WorkerDied(
+                        f"Worker exited with code {worker.process.exitcode}"))
+                    self._replace(worker, idle)
+                    continue
+                if ok:
+                    worker.future.set_result(value)
+                else:
+                    worker.future.set_exception(value)
+                worker.future = None
+                idle.append(worker)
+            now = time.monotonic()
+            for conn, worker in list(busy.items()):
+                if worker.deadline is not None and now >= worker.deadline:
+                    del busy[conn]
+                    log.warning(f"Killing worker {worker.process.pid}: job past its deadline")
+                    worker.future.set_exception(JobKilled("Killed at its deadline"))
+                    self.killed += 1
+                    self._replace(worker, idle)
+        for worker in idle:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+
+    def _replace(self, worker: _Worker, idle: list[_Worker]) -> None:
+        worker.kill()
+        replacement = self._start()
+        self._workers[self._workers.index(worker)] = replacement
+        idle.append(replacement)
+
+    def shutdown(self) -> None:
+        """Finish the jobs submitted, then stop the workers"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake_send.send_bytes(b"")
+        self._manager.join()
+        for worker in self._workers:
+            worker.process.join()
+        self._wake_send.close()
+        self._wake_recv.close()
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
@@ -0,0 +1,59 @@
+"""Unit tests for the batch runner"""
+
+import context
+from run.batch import run_job, run_batch
+from run.pipeline import assemble
+from instruction_set.objfile import write_binary
+import os
+import tempfile
+import time
+import unittest
+
+FACT = os.path.join(os.path.dirname(__file__), "..", "programs", "obj", "fact.obj")
+
+
+class TestRunJob(unittest.TestCase):
+    """Jobs read from their input list and stop within budget"""
+
+    def test_output(self):
+        result = run_job({"obj": FACT, "inputs": [5]}, max_steps=1000, timeout=10)
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(result["output"], [120])
+        self.assertEqual(result["steps"], 63)
+
+    def test_step_limit(self):
+        result = run_job({"obj": FACT, "inputs": [5]}, max_steps=50, timeout=10)
+        self.assertEqual(result["status"], "step limit")
+        self.assertEqual(result["steps"], 50)
+
+    def test_input_exhausted(self):
+        result = run_job({"obj": FACT, "inputs": []}, max_steps=1000, timeout=10)
+        self.assertEqual(result["status"], "error")
+        self.assertIn("InputExhausted", result["message"])
+
+
+class TestRunBatch(unittest.TestCase):
+    """Results come back in order, even from a job that must be killed"""
+
+    def test_runaway_step(self):
+        # Each MUL squares a number that keeps growing, so one step
+        # soon takes longer than the whole time limit
+        program = assemble(["ADD r1,r0,r0[3]", "loop: MUL r1,r1,r1", "JUMP loop"])
+        with tempfile.TemporaryDirectory() as tmp:
+            squares = os.path.join(tmp, "squares.obj")
+            with open(squares, "wb") as f:
+                write_binary(program.words, f)
+            jobs = [{"id": 1, "obj": FACT, "inputs": [5]},
+                    {"id": 2, "obj": squares},
+                    {"id": 3, "obj": FACT, "inputs": [4]}]
+            started = time.perf_counter()
+            results = list(run_batch(jobs, timeout=1, workers=1))
+            self.assertLess(time.perf_counter() - started, 20)
+        self.assertEqual([r["id"] for r in results], [1, 2, 3])
+        self.assertEqual([r["status"] for r in results], ["ok", "timeout", "ok"])
+        self.assertEqual(results[2]["output"], [24])
+        self.assertIsNone(results[1]["steps"])
+
+
+if __name__ == "__main__":
+    unittest.main()
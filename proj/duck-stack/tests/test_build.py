@@ -0,0 +1,72 @@
+"""Unit tests for the incremental program builder"""
+
+import context
+from run.build import build
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+PROGRAMS = pathlib.Path(__file__).resolve().parent.parent / "programs"
+
+
+class TestBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        for folder, name in [("mal", "fact"), ("asm", "sum"), ("asm", "bad_label")]:
+            (self.root / folder).mkdir(exist_ok=True)
+            shutil.copy(PROGRAMS / folder / f"{name}.{folder}", self.root / folder)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def statuses(self, jobs: int=1) -> dict[str, str]:
+        return {report["output"]: report["status"] for report in build(self.root, jobs)}
+
+    def test_incremental(self):
+        self.assertEqual(self.statuses(), {
+            "asm/fact.asm": "built", "dasm/fact.dasm": "built", "obj/fact.obj": "built",
+            "dasm/sum.dasm": "built", "obj/sum.obj": "built",
+            "dasm/bad_label.dasm": "error"})
+        self.assertEqual((self.root / "obj" / "sum.obj").read_text(),
+                         (PROGRAMS / "obj" / "sum.obj").read_text())
+        self.assertEqual(set(self.statuses().values()), {"up to date", "error"})
+        # Changing a source rebuilds what depends on it
+        with open(self.root / "asm" / "sum.asm", "a") as f:
+            f.write("# Changed\n")
+        # Changing an output rebuilds just that output
+        (self.root / "obj" / "fact.obj").write_text("0\n")
+        built = [output for output, status in self.statuses().items() if status == "built"]
+        self.assertEqual(sorted(built), ["dasm/sum.dasm", "obj/fact.obj", "obj/sum.obj"])
+
+    def test_parallel(self):
+        reports = list(build(self.root, jobs=2))
+        self.assertEqual([report["output"] for report in reports],
+                         ["asm/fact.asm", "dasm/fact.dasm", "obj/fact.obj",
+                          "dasm/bad_label.dasm", "dasm/sum.dasm", "obj/sum.obj"])
+        error = reports[3]
+        self.assertEqual(error["messages"], ["Unknown word in line 1: 'pair'"])
+        self.assertTrue(all(report["seconds"] >= 0 for report in reports))
+
+    def test_compiler_failures(self):
+        """A source the compiler cannot handle or cannot read is an
+        error for its output, not the end of the build
+        """
+        expr = "1"
+        for i in range(20):
+            expr = f"({i} + {expr})"
+        (self.root / "mal" / "deep.mal").write_text(f"x = {expr};\nprint x;\n")
+        (self.root / "mal" / "latin1.mal").write_bytes(b"x = 1; # caf\xe9\n")
+        for jobs in [1, 2]:
+            reports = {report["output"]: report for report in build(self.root, jobs)}
+            self.assertEqual(reports["asm/deep.asm"]["status"], "error")
+            self.assertIn("IndexError", reports["asm/deep.asm"]["messages"][0])
+            self.assertEqual(reports["asm/latin1.asm"]["status"], "error")
+            self.assertIn("UTF-8", reports["asm/latin1.asm"]["messages"][0])
+            self.assertEqual(reports["obj/fact.obj"]["status"], "up to date" if jobs == 2 else "built")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""Unit tests for the build cache"""
+
+import context
+from run.cache import BuildCache
+from run.pipeline import build, compile_and_run, assemble_and_run
+import os
+import tempfile
+import time
+import unittest
+
+FACT = os.path.join(os.path.dirname(__file__), "..", "programs", "mal", "fact.mal")
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = BuildCache(self.tmp.name, max_bytes=1000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_put(self):
+        key = self.cache.key("compile", b"x = 1;")
+        self.assertNotEqual(key, self.cache.key("assembler_phase1", b"x = 1;"))
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, b"artifact")
+        self.assertEqual(self.cache.get(key), b"artifact")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # Only the entry itself; the temporary file was renamed
+        self.assertEqual([path.name for _t, _s, path in self.cache.entries()], [key[2:]])
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp.name, key[:2]))), 1)
+
+    def test_lru_eviction(self):
+        keys = [self.cache.key("compile", bytes([i])) for i in range(3)]
+        past = time.time() - 100
+        for i, key in enumerate(keys):
+            self.cache.put(key, bytes(400))
+            path = os.path.join(self.tmp.name, key[:2], key[2:])
+            if os.path.exists(path):
+                os.utime(path, (past + i, past + i))
+        # The third put evicted the least recently used entry
+        self.assertIsNone(self.cache.get(keys[0]))
+        self.cache.get(keys[1])   # Now more recent than keys[2]
+        self.cache.put(self.cache.key("compile", b"new"), bytes(400))
+        self.assertIsNone(self.cache.get(keys[2]))
+        self.assertIsNotNone(self.cache.get(keys[1]))
+
+    def test_usage(self):
+        """Writes keep a running total rather than scanning the cache"""
+        keys = [self.cache.key("compile", bytes([i])) for i in range(4)]
+        self.cache.put(keys[0], bytes(100))   # No record yet: one scan
+        scans = []
+        entries = self.cache.entries
+        self.cache.entries = lambda: scans.append(1) or entries()
+        self.cache.put(keys[1], bytes(200))
+        self.cache.put(keys[1], bytes(300))   # Replaces the 200 bytes
+        self.assertEqual(scans, [])
+        with open(os.path.join(self.tmp.name, "usage")) as f:
+            self.assertEqual(int(f.read()), 400)
+        self.cache.put(keys[2], bytes(700))   # Over the limit: scan and evict
+        self.assertEqual(scans, [1])
+        with open(os.path.join(self.tmp.name, "usage")) as f:
+            self.assertEqual(int(f.read()), sum(size for _t, size, _p in entries()))
+        self.cache.clear()
+        self.assertEqual(entries(), [])
+
+    def test_pipeline(self):
+        cache = BuildCache(self.tmp.name)
+        with open(FACT) as f:
+            source = f.read()
+        cold = build(source, "mal", cache)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(len(cache.entries()), 4)   # Three stages and the whole build
+        warm = build(source, "mal", cache)
+        self.assertEqual(warm, cold)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(compile_and_run(source, [5], cache=cache), [120])
+        self.assertEqual(len(cache.entries()), 4)
+
+    def test_wide_data(self):
+        """Words beyond 32 bits wrap, as when stored, rather than
+        failing to be cached
+        """
+        cache = BuildCache(self.tmp.name)
+        source = "LOAD r1,x\nSTORE r1,r0,r0[511]\nHALT r0,r0,r0\nx: DATA 3000000000\n"
+        for _ in range(2):
+            self.assertEqual(assemble_and_run(source, cache=cache), [3000000000 - 2**32])
+
+    def test_unwritable(self):
+        """A cache that cannot be written is skipped, with a warning"""
+        blocked = os.path.join(self.tmp.name, "file")
+        open(blocked, "w").close()   # Not a directory
+        cache = BuildCache(blocked)
+        with open(FACT) as f:
+            source = f.read()
+        with self.assertLogs("run.cache", "WARNING"):
+            self.assertEqual(compile_and_run(source, [5], cache=cache), [120])
+        self.assertEqual(cache.entries(), [])
+        # Entries can be written, but not the usage record
+        os.mkdir(os.path.join(self.tmp.name, "usage"))
+        key = self.cache.key("compile", b"x = 1;")
+        with self.assertLogs("run.cache", "WARNING"):
+            self.cache.put(key, b"artifact")
+        self.assertEqual(self.cache.get(key), b"artifact")
+
+
+if __name__ == "__main__":
+    unittest.main()
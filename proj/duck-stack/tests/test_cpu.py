@@ -1,5 +1,10 @@
 import context
 from cpu.cpu import *
+from cpu.memory import MemoryWrite
+from cpu.mvc import MVCListener
+from cpu.profiler import Profiler
+import io
+import random
 import unittest
 
 class TestALU(unittest.TestCase):
@@ -32,5 +37,222 @@ class TestALU(unittest.TestCase):
         self.assertEqual(alu.exec(OpCode.STORE, 27, 13), (40, CondFlag.P))
         self.assertEqual(alu.exec(OpCode.HALT, 99, 98), (0, CondFlag.Z))
 
+class TestDecodeCache(unittest.TestCase):
+    """Decoded instructions are reused until their memory cell changes"""
+
+    def test_write_invalidates(self):
+        mem = Memory(16)
+        cache = DecodeCache()
+        add = Instruction(OpCode.ADD, CondFlag.ALWAYS, 1, 0, 0, 5).encode()
+        sub = Instruction(OpCode.SUB, CondFlag.ALWAYS, 1, 0, 0, 5).encode()
+        mem.put(3, add)
+        first = cache.decode(3, mem.get(3))
+        self.assertIs(cache.decode(3, mem.get(3)), first)
+        mem.put(3, sub)
+        self.assertEqual(cache.decode(3, mem.get(3)).op, OpCode.SUB)
+
+
+def self_modifying_program() -> list[int]:
+    """Runs the instruction at address 2 twice, replacing it
+    with a SUB between the two executions, and divides by zero.
+    Halts with r4 == -9.
+    """
+    A = CondFlag.ALWAYS
+    program = [
+        Instruction(OpCode.ADD, A, 1, 0, 0, 7),
+        Instruction(OpCode.DIV, A, 2, 1, 0, 0),
+        Instruction(OpCode.ADD, A, 4, 4, 0, 1),
+        Instruction(OpCode.ADD, A, 5, 5, 0, 1),
+        Instruction(OpCode.SUB, A, 0, 5, 0, 2),
+        Instruction(OpCode.ADD, CondFlag.Z, 15, 0, 15, 4),
+        Instruction(OpCode.LOAD, A, 3, 0, 15, 4),
+        Instruction(OpCode.STORE, A, 3, 0, 15, -5),
+        Instruction(OpCode.ADD, A, 15, 0, 15, -6),
+        Instruction(OpCode.HALT, A, 0, 0, 0, 0),
+        Instruction(OpCode.SUB, A, 4, 4, 0, 10)
+    ]
+    return [instr.encode() for instr in program]
+
+
+def load_cpu(words: list[int], size: int=32) -> CPU:
+    mem = Memory(size)
+    for addr, word in enumerate(words):
+        mem.put(addr, word)
+    return CPU(mem)
+
+
+class Recorder(MVCListener):
+    """Keeps every event it is notified of"""
+
+    def __init__(self):
+        self.events = []
+
+    def notify(self, event: MVCEvent) -> None:
+        self.events.append(event)
+
+
+class TestCondition(unittest.TestCase):
+    """The core keeps the condition code as an int, but the
+    condition attribute is still a CondFlag
+    """
+
+    def test_condition(self):
+        cpu = load_cpu([Instruction(OpCode.DIV, CondFlag.ALWAYS, 1, 0, 0, 0).encode(),
+                        Instruction(OpCode.HALT, CondFlag.V, 0, 0, 0, 0).encode()])
+        self.assertIs(cpu.condition, CondFlag.ALWAYS)
+        cpu.step()
+        self.assertIs(cpu.condition, CondFlag.V)
+        self.assertEqual(cpu.cc, CondFlag.V.value)
+        cpu.condition = CondFlag.Z
+        cpu.step()
+        self.assertFalse(cpu.halted)
+
+
+class TestListeners(unittest.TestCase):
+    """Events are announced only when something is listening"""
+
+    def test_listener_turns_on_events(self):
+        cpu = load_cpu(self_modifying_program())
+        recorder = Recorder()
+        cpu.register_listener(recorder)
+        cpu.memory.register_listener(recorder)
+        cpu.run()
+        steps = [e for e in recorder.events if isinstance(e, CPUStep)]
+        writes = [e for e in recorder.events if isinstance(e, MemoryWrite)]
+        self.assertEqual(len(steps), 14)
+        self.assertEqual([(e.addr, e.value) for e in writes],
+                         [(2, self_modifying_program()[10])])
+
+
+class TestProfiler(unittest.TestCase):
+    """Profiling counts steps by address and operation"""
+
+    def test_counts(self):
+        cpu = load_cpu(self_modifying_program())
+        profiler = Profiler()
+        cpu.run(profiler=profiler)
+        self.assertIsNone(cpu.profiler)
+        self.assertEqual(profiler.total_steps(), 14)
+        self.assertEqual(profiler.hits[2], 2)
+        self.assertEqual(profiler.hits[5], 2)
+        self.assertEqual(profiler.skipped, {5: 1})
+        self.assertEqual(profiler.ops[OpCode.ADD], 7)
+        self.assertEqual(profiler.ops[OpCode.SUB], 3)
+        self.assertEqual(profiler.reads, {10: 1})
+        self.assertEqual(profiler.writes, {2: 1})
+        report = io.StringIO()
+        profiler.report(cpu.memory, file=report)
+        self.assertIn("Profile: 14 steps", report.getvalue())
+        self.assertIn("13 taken, 1 skipped", report.getvalue())
+
+    def test_report_overwritten_code(self):
+        cpu = load_cpu(self_modifying_program())
+        profiler = Profiler()
+        cpu.run(profiler=profiler)
+        cpu.memory.put(2, -1)   # No longer an instruction
+        report = io.StringIO()
+        profiler.report(cpu.memory, file=report)
+        self.assertIn("DATA -1", report.getvalue())
+
+
+class TestClone(unittest.TestCase):
+    """Clones run independently from the same loaded image"""
+
+    def test_clone(self):
+        cpu = load_cpu(self_modifying_program())
+        twins = [cpu.clone() for _ in range(3)]
+        twins[0].run()
+        self.assertEqual(twins[0].regs[4], -9)
+        self.assertEqual(cpu.regs, 16 * [0])
+        self.assertEqual(cpu.memory.dump(range(0, 11)), self_modifying_program())
+        twins[1].run_blocks()
+        self.assertEqual(twins[1].regs, twins[0].regs)
+        self.assertEqual(twins[2].regs, 16 * [0])
+
+
+class TestEngines(unittest.TestCase):
+    """Every execution engine must match CPU.step exactly"""
+
+    def check_engine(self, run_name: str):
+        reference = load_cpu(self_modifying_program())
+        reference.run()
+        self.assertEqual(reference.registers[4].get(), -9)
+        cpu = load_cpu(self_modifying_program())
+        getattr(cpu, run_name)()
+        self.assertEqual([r.get() for r in cpu.registers],
+                         [r.get() for r in reference.registers])
+        self.assertEqual(cpu.condition, reference.condition)
+        self.assertEqual(cpu.memory._mem, reference.memory._mem)
+        self.assertEqual(cpu.step_count, reference.step_count)
+        self.assertTrue(cpu.halted)
+
+    def test_threaded(self):
+        self.check_engine("run_threaded")
+
+    def test_blocks(self):
+        self.check_engine("run_blocks")
+
+    def test_predicated_load_r0(self):
+        program = [Instruction(OpCode.LOAD, CondFlag.P, 0, 0, 0, 5),
+                   Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0)]
+        for run_name in ["run_threaded", "run_blocks"]:
+            cpu = load_cpu([instr.encode() for instr in program])
+            getattr(cpu, run_name)()
+            self.assertEqual(cpu.step_count, 2)
+
+    def test_random_programs(self):
+        rng = random.Random(211)
+        for _ in range(300):
+            words = random_program(rng)
+            reference = load_cpu(words, RANDOM_MEMORY)
+            reference.run()
+            for run_name in ["run_threaded", "run_blocks"]:
+                cpu = load_cpu(words, RANDOM_MEMORY)
+                getattr(cpu, run_name)()
+                state = (cpu.regs, cpu.cc, cpu.memory._mem, cpu.step_count, cpu.halted)
+                self.assertEqual(state, (reference.regs, reference.cc, reference.memory._mem,
+                                         reference.step_count, reference.halted),
+                                 f"{run_name} differs on {words}")
+
+
+RANDOM_MEMORY = 64
+
+
+def random_program(rng: random.Random) -> list[int]:
+    """A random program that always halts: code, then a HALT, then
+    a jump table cell (the address of the HALT) and scratch data.
+    Jumps (ALU and LOAD into r15) only go forward, and stores only
+    go to scratch, so every program runs straight to the HALT.
+    """
+    length = rng.randint(1, 24)
+    halt, table = length, length + 1
+    scratch = range(table + 1, RANDOM_MEMORY)
+    ops = [OpCode.LOAD, OpCode.STORE, OpCode.ADD, OpCode.SUB, OpCode.MUL, OpCode.DIV]
+    program = []
+    for pc in range(length):
+        op = rng.choice(ops)
+        cond = CondFlag(rng.randrange(16))
+        target = rng.choice([0, 15] + list(range(1, 15)))
+        if op is OpCode.LOAD and target == 15:
+            instr = Instruction(op, cond, 15, 0, 0, table)
+        elif op in (OpCode.LOAD, OpCode.STORE):
+            addr = rng.choice(scratch)
+            if rng.random() < 0.5:
+                instr = Instruction(op, cond, target, 0, 0, addr)
+            else:
+                instr = Instruction(op, cond, target, 15, 0, addr - pc)
+        elif target == 15:
+            # Forward to somewhere up to the HALT
+            instr = Instruction(OpCode.ADD, cond, 15, 15, 0, rng.randint(1, halt - pc))
+        else:
+            instr = Instruction(op, cond, target, rng.randrange(16), rng.randrange(16),
+                                rng.randint(-20, 20))
+        program.append(instr.encode())
+    program.append(Instruction(OpCode.HALT, CondFlag.ALWAYS, 0, 0, 0, 0).encode())
+    program.append(halt)
+    program.extend(rng.randint(-100, 100) for _ in scratch)
+    return program
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,129 @@
+"""Unit tests for the compile and run daemon and its client"""
+
+import context
+from run.daemon import Daemon
+from run.client import Client, DaemonError
+import asyncio
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+
+PROGRAMS = pathlib.Path(__file__).resolve().parent.parent / "programs"
+
+
+class TestDaemon(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp.name, "duck.sock")
+        cls.daemon = Daemon(cls.path, workers=2, use_cache=False, limit=1024 * 1024)
+        cls.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        async def serve():
+            server = await cls.daemon.start()
+            ready.set()
+            async with server:
+                await server.serve_forever()
+
+        def run():
+            cls.task = cls.loop.create_task(serve())
+            try:
+                cls.loop.run_until_complete(cls.task)
+            except asyncio.CancelledError:
+                pass
+            # Let connection handlers see their clients have gone
+            cls.loop.run_until_complete(asyncio.sleep(0.1))
+            cls.loop.close()
+
+        cls.thread = threading.Thread(target=run, daemon=True)
+        cls.thread.start()
+        ready.wait(10)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.call_soon_threadsafe(cls.task.cancel)
+        cls.thread.join(10)
+        cls.daemon.pool.shutdown()
+        cls.tmp.cleanup()
+
+    def test_requests(self):
+        with Client(self.path) as client:
+            reply = client.call({"op": "compile", "source": "print 3;"})
+            self.assertEqual(reply["status"], "ok")
+            self.assertIn("HALT r0,r0,r0", " ".join(" ".join(reply["lines"]).split()))
+            reply = client.call({"op": "assemble",
+                                 "source": (PROGRAMS / "asm" / "sum.asm").read_text()})
+            self.assertEqual(reply["words"],
+                             [int(w) for w in (PROGRAMS / "obj" / "sum.obj").read_text().split()])
+            fact = (PROGRAMS / "mal" / "fact.mal").read_text()
+            reply = client.call({"op": "run", "source": fact, "inputs": [5]})
+            self.assertEqual((reply["status"], reply["output"]), ("ok", [120]))
+            words = client.call({"op": "assemble", "source": "HALT r0,r0,r0"})["words"]
+            reply = client.call({"op": "run", "words": words})
+            self.assertEqual((reply["status"], reply["steps"]), ("ok", 1))
+            # A warm daemon answers small requests quickly
+            started = time.perf_counter()
+            for n in range(20):
+                self.assertEqual(client.call({"op": "run", "source": fact, "inputs": [3]})["output"], [6])
+            self.assertLess((time.perf_counter() - started) / 20, 0.1)
+
+    def test_errors(self):
+        with Client(self.path) as client:
+            reply = client.call({"op": "run", "language": "asm", "source": "FOO r1,r2,r3"})
+            self.assertEqual(reply["status"], "error")
+            self.assertEqual(reply["stage"], "assembler phase 2")
+            reply = client.call({"op": "run", "source": "x = read; print x;", "inputs": []})
+            self.assertEqual(reply["status"], "error")
+            self.assertIn("InputExhausted", reply["message"])
+            loop = "while 1 > 0 do x = 1; od;"
+            reply = client.call({"op": "run", "source": loop, "max_steps": 1000})
+            self.assertEqual((reply["status"], reply["steps"]), ("step limit", 1000))
+            reply = client.call({"op": "nonsense"})
+            self.assertEqual(reply["status"], "error")
+            # The connection is still usable after errors
+            self.assertEqual(client.call({"op": "ping"})["status"], "ok")
+
+    def test_long_requests(self):
+        """Requests beyond asyncio's default 64 KiB line limit are
+        served, and ones beyond the daemon's limit are refused
+        without closing the connection
+        """
+        with Client(self.path) as client:
+            padding = 1000 * ("# " + 100 * "x" + "\n")
+            reply = client.call({"op": "run", "language": "asm",
+                                 "source": padding + "HALT r0,r0,r0\n"})
+            self.assertEqual((reply["status"], reply["steps"]), ("ok", 1))
+            reply = client.call({"op": "run", "language": "asm",
+                                 "source": 20 * padding + "HALT r0,r0,r0\n"})
+            self.assertEqual(reply["status"], "error")
+            self.assertIn("longer than", reply["message"])
+            self.assertEqual(client.call({"op": "ping"})["status"], "ok")
+
+    def test_runaway_step(self):
+        """A run stuck in one very long step is stopped, and its
+        worker replaced
+        """
+        squares = "ADD r1,r0,r0[3]\nloop: MUL r1,r1,r1\nJUMP loop\n"
+        with Client(self.path) as client:
+            started = time.perf_counter()
+            reply = client.call({"op": "run", "language": "asm", "source": squares,
+                                 "timeout": 1})
+            self.assertLess(time.perf_counter() - started, 20)
+            self.assertEqual(reply["status"], "timeout")
+            fact = (PROGRAMS / "mal" / "fact.mal").read_text()
+            for n in range(4):
+                reply = client.call({"op": "run", "source": fact, "inputs": [4]})
+                self.assertEqual((reply["status"], reply["output"]), ("ok", [24]))
+
+    def test_no_daemon(self):
+        with self.assertRaises(DaemonError):
+            Client(os.path.join(self.tmp.name, "absent.sock"))
+
+
+if __name__ == "__main__":
+    unittest.main()
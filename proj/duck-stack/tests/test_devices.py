@@ -0,0 +1,60 @@
+"""Unit tests for the input and output port devices"""
+
+import context
+from cpu.devices import *
+from cpu.cpu import CPU
+import asyncio
+import io
+import os
+import unittest
+
+SUM = os.path.join(os.path.dirname(__file__), "..", "programs", "obj", "sum.obj")
+
+
+def sum_machine(input_device, output_device) -> CPU:
+    mem = MemoryMappedIO(512)
+    attach(mem, input_device, output_device)
+    mem.load_words([int(line) for line in open(SUM)], 0)
+    return CPU(mem)
+
+
+class TestDevices(unittest.TestCase):
+
+    def test_file_input(self):
+        device = InputDevice.from_file(io.StringIO("4 5\n\n6\n"))
+        self.assertEqual([device(510) for _ in range(3)], [4, 5, 6])
+        self.assertRaises(InputExhausted, device, 510)
+
+    def test_buffered_output(self):
+        sink = io.StringIO()
+        device = BufferedOutput(sink, buffer_size=2)
+        device(511, 1)
+        self.assertEqual(sink.getvalue(), "")
+        device(511, 2)
+        device(511, 3)
+        self.assertEqual(sink.getvalue(), "1\n2\n")
+        device.flush()
+        self.assertEqual(sink.getvalue(), "1\n2\n3\n")
+
+    def test_program(self):
+        output = BufferedOutput()
+        sum_machine(InputDevice([1, 2, 3, 0]), output).run()
+        self.assertEqual(output.values, [6])
+
+    def test_async_input(self):
+        async def produce():
+            for value in [10, 20, 0]:
+                await asyncio.sleep(0)
+                yield value
+
+        async def main():
+            output = BufferedOutput()
+            device = AsyncInput(produce(), asyncio.get_running_loop())
+            await run_async(sum_machine(device, output))
+            return output.values
+
+        self.assertEqual(asyncio.run(main()), [30])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Unit tests for lockstep execution over many inputs"""
+
+import context
+from test_cpu import self_modifying_program, load_cpu
+from instruction_set.instr_format import Instruction, OpCode, CondFlag, op_field
+import os
+import unittest
+
+try:
+    from cpu.lockstep import Lockstep
+except ImportError:
+    Lockstep = None   # NumPy is not installed
+
+FACT = os.path.join(os.path.dirname(__file__), "..", "programs", "obj", "fact.obj")
+
+
+@unittest.skipIf(Lockstep is None, "NumPy is not installed")
+class TestLockstep(unittest.TestCase):
+    """Each lane matches CPU.run on its own input"""
+
+    def test_fact(self):
+        words = [int(line) for line in open(FACT)]
+        machine = Lockstep(words, [[n] for n in range(8)] + [[]])
+        machine.run()
+        self.assertEqual(machine.outputs[:8], [[1], [1], [2], [6], [24], [120], [720], [5040]])
+        self.assertTrue(machine.halted[:8].all())
+        self.assertEqual(int(machine.steps[5]), 63)
+        self.assertFalse(machine.halted[8])
+        self.assertEqual(machine.errors[8], "Read past the end of input")
+
+    def test_self_modifying(self):
+        reference = load_cpu(self_modifying_program())
+        reference.run()
+        machine = Lockstep(self_modifying_program(), [[]], capacity=32)
+        machine.run()
+        self.assertEqual(machine.regs[0].tolist(), reference.regs)
+        self.assertEqual(int(machine.cond[0]), reference.condition.value)
+        self.assertEqual(machine.mem[0].tolist(), reference.memory._mem.tolist())
+        self.assertEqual(int(machine.steps[0]), reference.step_count)
+
+    def test_step_limit(self):
+        words = [int(line) for line in open(FACT)]
+        machine = Lockstep(words, [[5], [2]])
+        machine.run(max_steps=40)
+        self.assertEqual(machine.errors, ["step limit", None])
+        self.assertEqual(machine.outputs, [[], [2]])
+
+    def test_invalid_instruction(self):
+        """Only the lanes that reach a word that is not an
+        instruction stop
+        """
+        A = CondFlag.ALWAYS
+        program = [Instruction(OpCode.LOAD, A, 1, 0, 0, 510),
+                   Instruction(OpCode.SUB, A, 0, 1, 0, 0),
+                   Instruction(OpCode.ADD, CondFlag.P, 15, 0, 15, 3),
+                   Instruction(OpCode.STORE, A, 1, 0, 0, 511),
+                   Instruction(OpCode.HALT, A, 0, 0, 0, 0)]
+        words = [instr.encode() for instr in program] + [op_field.insert(4, 0)]
+        machine = Lockstep(words, [[1], [-1]])
+        machine.run()
+        self.assertEqual(machine.errors, [f"Word {words[5]} at address 5 is not an instruction", None])
+        self.assertEqual(machine.halted.tolist(), [False, True])
+        self.assertEqual(machine.outputs, [[], [-1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
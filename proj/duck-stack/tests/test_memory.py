@@ -0,0 +1,193 @@
+"""Unit tests for the Duck Machine memory"""
+
+import context
+from cpu.memory import *
+from cpu.cpu import CPU
+from instruction_set.instr_format import Instruction, OpCode, CondFlag
+import os
+import tempfile
+import unittest
+
+
+class TestMemory(unittest.TestCase):
+    """Words are 32 bits, and addresses must be in bounds"""
+
+    def test_put_get(self):
+        mem = Memory(8)
+        mem.put(3, 42)
+        mem.put(4, -17)
+        self.assertEqual(mem.get(3), 42)
+        self.assertEqual(mem.get(4), -17)
+        self.assertEqual(mem.get(5), 0)
+
+    def test_32_bit_words(self):
+        mem = Memory(8)
+        mem.put(0, 2**31 - 1)
+        self.assertEqual(mem.get(0), 2**31 - 1)
+        mem.put(0, 2**31)
+        self.assertEqual(mem.get(0), -2**31)
+        mem.put(0, 2**32 + 5)
+        self.assertEqual(mem.get(0), 5)
+
+    def test_bounds(self):
+        mem = Memory(8)
+        self.assertRaises(SegFault, mem.get, 8)
+        self.assertRaises(SegFault, mem.put, -1, 0)
+
+    def test_load_dump(self):
+        mem = Memory(8)
+        mem.load_words([1, 2, 3, 2**32 - 1], 2)
+        self.assertEqual(mem.dump(range(0, 8)), [0, 0, 1, 2, 3, -1, 0, 0])
+        self.assertEqual(mem.dump(range(5, 1, -2)), [-1, 2])
+        self.assertRaises(SegFault, mem.load_words, [1, 2, 3], 6)
+        self.assertRaises(SegFault, mem.dump, range(4, 9))
+
+
+class TestMemoryMappedIO(unittest.TestCase):
+    """Device addresses call hooks instead of reading or writing memory"""
+
+    def test_hooks(self):
+        mem = MemoryMappedIO(16)
+        written = []
+        mem.map_address_in(14, lambda addr: 99)
+        mem.map_address_out(15, lambda addr, value: written.append(value))
+        mem.put(15, 7)
+        self.assertEqual(written, [7])
+        self.assertEqual(mem.get(14), 99)
+        self.assertEqual(mem.dump(range(14, 16)), [0, 0])
+
+
+class TestPagedMemory(unittest.TestCase):
+    """Paged memory behaves like Memory, allocating only what is used"""
+
+    def test_sparse(self):
+        mem = PagedMemory(10**7, page_size=16)
+        self.assertEqual(mem.get(9_999_999), 0)
+        mem.put(5_000_000, 2**32 + 5)
+        self.assertEqual(mem.get(5_000_000), 5)
+        self.assertEqual(mem.pages_allocated(), 1)
+        self.assertRaises(SegFault, mem.get, 10**7)
+        self.assertRaises(SegFault, mem.put, -1, 0)
+
+    def test_load_dump(self):
+        mem = PagedMemory(64, page_size=8)
+        mem.load_words(range(1, 21), 5)
+        self.assertEqual(mem.pages_allocated(), 4)
+        self.assertEqual(mem.dump(range(0, 40)), [0] * 5 + list(range(1, 21)) + [0] * 15)
+        self.assertEqual(mem.dump(range(24, 4, -5)), [20, 15, 10, 5])
+        self.assertRaises(SegFault, mem.load_words, [1, 2], 63)
+
+    def test_engines(self):
+        from test_cpu import self_modifying_program
+        for run_name in ["run", "run_threaded", "run_blocks"]:
+            mem = PagedMemoryMappedIO(32, page_size=4)
+            mem.load_words(self_modifying_program(), 0)
+            cpu = CPU(mem)
+            getattr(cpu, run_name)()
+            self.assertEqual(cpu.regs[4], -9, run_name)
+            self.assertEqual(cpu.step_count, 14, run_name)
+
+
+class TestFork(unittest.TestCase):
+    """A fork starts with the same contents, then goes its own way"""
+
+    def check_fork(self, mem: Memory):
+        mem.load_words([1, 2, 3], 0)
+        clone = mem.fork()
+        clone.put(1, 20)
+        mem.put(2, 30)
+        self.assertEqual(mem.dump(range(0, 3)), [1, 2, 30])
+        self.assertEqual(clone.dump(range(0, 3)), [1, 20, 3])
+        return clone
+
+    def test_flat(self):
+        self.check_fork(Memory(16))
+
+    def test_paged_copy_on_write(self):
+        mem = PagedMemory(64, page_size=8)
+        mem.put(40, 7)
+        clone = self.check_fork(mem)
+        # The untouched page is still shared, the written one is not
+        self.assertIs(clone._pages[5], mem._pages[5])
+        self.assertIsNot(clone._pages[0], mem._pages[0])
+
+    def test_devices(self):
+        mem = MemoryMappedIO(16)
+        written = []
+        mem.map_address_out(15, lambda addr, value: written.append(value))
+        clone = mem.fork()
+        clone.map_address_out(15, lambda addr, value: None)
+        clone.put(15, 1)
+        mem.put(15, 2)
+        self.assertEqual(written, [2])
+
+
+def dma_program() -> list[int]:
+    """Copies two data words from the DMA file to addresses 20
+    and 21, then one instruction over address 16 (later in the
+    same basic block), which loads the first data word into r3.
+    """
+    A = CondFlag.ALWAYS
+    def command(file_offset, addr, length):
+        words = []
+        for reg, value in enumerate([file_offset, addr, length, DMAController.TO_MEMORY]):
+            words.append(Instruction(OpCode.ADD, A, 1, 0, 0, value))
+            words.append(Instruction(OpCode.STORE, A, 1, 0, 0, 506 + reg))
+        return words
+    program = command(0, 20, 2) + command(2, 16, 1) + [
+        Instruction(OpCode.ADD, A, 3, 0, 0, 1),     # Replaced
+        Instruction(OpCode.LOAD, A, 4, 0, 0, 21),
+        Instruction(OpCode.LOAD, A, 2, 0, 0, 509),
+        Instruction(OpCode.HALT, A, 0, 0, 0, 0)
+    ]
+    return [instr.encode() for instr in program]
+
+
+class TestDMA(unittest.TestCase):
+    """Block transfers between memory and a host file"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "dma.bin")
+        loader = Instruction(OpCode.LOAD, CondFlag.ALWAYS, 3, 0, 0, 20)
+        with open(self.path, "wb") as f:
+            f.write(b"".join(word.to_bytes(4, "little", signed=True)
+                             for word in [5, 7, loader.encode()]))
+
+    def test_program(self):
+        for run_name in ["run", "run_threaded", "run_blocks"]:
+            mem = MemoryMappedIO(512)
+            dma = DMAController(mem, self.path)
+            self.addCleanup(dma.close)
+            mem.load_words(dma_program(), 0)
+            cpu = CPU(mem)
+            getattr(cpu, run_name)()
+            self.assertEqual(cpu.regs[2:5], [1, 5, 7], run_name)
+
+    def test_to_file(self):
+        mem = MemoryMappedIO(512)
+        dma = DMAController(mem, self.path, writable=True)
+        mem.load_words([-1, 2**31 - 1], 40)
+        for reg, value in enumerate([1, 40, 2, DMAController.TO_FILE]):
+            mem.put(dma.base + reg, value)
+        self.assertEqual(mem.get(dma.base + 3), 2)
+        dma.close()
+        with open(self.path, "rb") as f:
+            data = f.read()
+        self.assertEqual(data[4:12], (-1).to_bytes(4, "little", signed=True)
+                         + (2**31 - 1).to_bytes(4, "little"))
+
+    def test_out_of_bounds(self):
+        mem = MemoryMappedIO(512)
+        dma = DMAController(mem, self.path)
+        self.addCleanup(dma.close)
+        for reg, value in enumerate([2, 0, 2, DMAController.TO_MEMORY]):
+            mem.put(dma.base + reg, value)
+        self.assertEqual(mem.get(dma.base + 3), -1)
+        mem.put(dma.base + 3, DMAController.TO_FILE)   # Read-only file
+        self.assertEqual(mem.get(dma.base + 3), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Unit tests for text and binary object files"""
+
+import context
+from instruction_set.objfile import *
+import io
+import os
+import tempfile
+import unittest
+
+
+class TestObjectFiles(unittest.TestCase):
+    """Both formats read back the words that were written"""
+
+    WORDS = [133708810, 0, -1, 2**31 - 1, -2**31, 42]
+    SYMBOLS = {"start": 0, "answer": 5}
+
+    def test_binary_round_trip(self):
+        out = io.BytesIO()
+        write_binary(self.WORDS, out, self.SYMBOLS)
+        words, symbols = read_object(io.BytesIO(out.getvalue()))
+        self.assertEqual(list(words), self.WORDS)
+        self.assertEqual(symbols, self.SYMBOLS)
+
+    def test_wide_words_wrap(self):
+        out = io.BytesIO()
+        write_binary([3000000000, -2**31 - 1], out)
+        words, _symbols = read_object(io.BytesIO(out.getvalue()))
+        self.assertEqual(list(words), [3000000000 - 2**32, 2**31 - 1])
+
+    def test_mapped_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "prog.obj")
+            with open(path, "wb") as f:
+                write_binary(self.WORDS, f)
+            with open(path, "rb") as f:
+                words, symbols = read_object(f)
+        self.assertEqual(list(words), self.WORDS)
+        self.assertEqual(symbols, {})
+
+    def test_text(self):
+        text = "".join(f"{word}\n" for word in self.WORDS)
+        self.assertEqual(read_object(io.StringIO(text)), (self.WORDS, {}))
+        self.assertEqual(read_object(io.BytesIO(text.encode())), (self.WORDS, {}))
+
+    def test_truncated(self):
+        out = io.BytesIO()
+        write_binary(self.WORDS, out)
+        self.assertRaises(ObjectFileError, parse_binary, out.getvalue()[:-4])
+
+
+if __name__ == "__main__":
+    unittest.main()
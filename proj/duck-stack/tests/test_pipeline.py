@@ -0,0 +1,60 @@
+"""Unit tests for the in-process compile, assemble, and run pipeline"""
+
+import context
+from run.pipeline import *
+from concurrent.futures import ThreadPoolExecutor
+import os
+import unittest
+
+PROGRAMS = os.path.join(os.path.dirname(__file__), "..", "programs")
+TMP = os.path.join(PROGRAMS, "tmp")
+
+
+def source(kind: str, name: str) -> str:
+    with open(os.path.join(PROGRAMS, kind, f"{name}.{kind}")) as f:
+        return f.read()
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_compile_and_run(self):
+        self.assertEqual(compile_and_run(source("mal", "fact"), [5]), [120])
+        self.assertEqual(compile_and_run("x = read; print x * x;", [7]), [49])
+
+    def test_assemble_and_run(self):
+        self.assertEqual(assemble_and_run(source("asm", "sum"), [1, 2, 3, 0]), [6])
+        program = assemble(source("asm", "countdown"))
+        self.assertEqual(program.symbols["while_do_1"], 2)
+        with open(os.path.join(PROGRAMS, "obj", "countdown.obj")) as f:
+            self.assertEqual(program.words, [int(line) for line in f])
+
+    def test_errors(self):
+        with self.assertRaises(PipelineError) as caught:
+            compile_and_run("x = = 3;")
+        self.assertEqual(caught.exception.stage, "compile")
+        with self.assertRaises(PipelineError) as caught:
+            assemble("  JUMP nowhere\n")
+        self.assertEqual(caught.exception.stage, "assembler phase 1")
+        self.assertEqual(len(caught.exception.messages), 1)
+        # Too deeply nested for the compiler's registers
+        with self.assertRaises(PipelineError) as caught:
+            compile_and_run("x = " + 20 * "(1 + " + "1" + 20 * ")" + ";")
+        self.assertEqual(caught.exception.stage, "compile")
+
+    def test_concurrent(self):
+        """Threads do not share state, and nothing is written to disk
+        (n! for n up to 12, which fits in a 32-bit word)
+        """
+        before = sorted(os.listdir(TMP))
+        fact = source("mal", "fact")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            outputs = list(pool.map(lambda n: compile_and_run(fact, [n]), range(1, 13)))
+        expected = [1]
+        for n in range(2, 13):
+            expected.append(expected[-1] * n)
+        self.assertEqual(outputs, [[value] for value in expected])
+        self.assertEqual(sorted(os.listdir(TMP)), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Unit tests for checkpoints and replay"""
+
+import context
+from cpu.timetravel import *
+from test_cpu import self_modifying_program, load_cpu
+from test_memory import dma_program
+from cpu.memory import MemoryMappedIO, DMAController
+from instruction_set.instr_format import Instruction, OpCode, CondFlag
+import os
+import tempfile
+import unittest
+
+
+def state_after(steps: int) -> tuple:
+    """Registers, condition, and memory after executing steps"""
+    cpu = load_cpu(self_modifying_program())
+    for _ in range(steps):
+        cpu.step()
+    return list(cpu.regs), cpu.condition, cpu.memory._mem.tolist()
+
+
+class TestHistory(unittest.TestCase):
+    """Going to step n restores exactly the state after n steps"""
+
+    def record(self, interval: int, capacity: int) -> tuple[CPU, History]:
+        cpu = load_cpu(self_modifying_program())
+        history = History(cpu, interval=interval, capacity=capacity)
+        cpu.run()
+        history.end_step()
+        return cpu, history
+
+    def state(self, cpu: CPU) -> tuple:
+        return list(cpu.regs), cpu.condition, cpu.memory._mem.tolist()
+
+    def test_goto(self):
+        cpu, history = self.record(interval=4, capacity=10)
+        self.assertEqual((history.earliest(), history.latest()), (0, 14))
+        for step in [14, 0, 7, 8, 3, 13, 5]:
+            history.goto(step)
+            self.assertEqual(self.state(cpu), state_after(step))
+        history.goto(14)
+        self.assertTrue(cpu.halted)
+
+    def test_step_back_and_rerun(self):
+        cpu, history = self.record(interval=4, capacity=10)
+        final = self.state(cpu)
+        history.goto(9)   # After the self-modifying store
+        history.step_back(3)
+        self.assertEqual(self.state(cpu), state_after(6))
+        self.assertFalse(cpu.halted)
+        cpu.run(from_addr=cpu.regs[15])
+        history.end_step()
+        self.assertEqual(self.state(cpu), final)
+        self.assertEqual(history.latest(), 14)
+        history.goto(10)
+        self.assertEqual(self.state(cpu), state_after(10))
+
+    def test_ring_buffer(self):
+        cpu, history = self.record(interval=3, capacity=2)
+        self.assertEqual(history.earliest(), 9)
+        self.assertRaises(HistoryError, history.goto, 8)
+        history.goto(11)
+        self.assertEqual(self.state(cpu), state_after(11))
+
+    def test_dma(self):
+        """Words moved by DMA, which announces no events, are recorded"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dma.bin")
+            loader = Instruction(OpCode.LOAD, CondFlag.ALWAYS, 3, 0, 0, 20)
+            with open(path, "wb") as f:
+                f.write(b"".join(word.to_bytes(4, "little", signed=True)
+                                 for word in [5, 7, loader.encode()]))
+            mem = MemoryMappedIO(512)
+            dma = DMAController(mem, path)
+            self.addCleanup(dma.close)
+            mem.load_words(dma_program(), 0)
+            cpu = CPU(mem)
+            history = History(cpu, interval=100)
+            cpu.run()
+            history.end_step()
+            final = self.state(cpu)
+            self.assertEqual(mem.dump(range(20, 22)), [5, 7])
+            history.goto(0)
+            self.assertEqual(mem.dump(range(20, 22)), [0, 0])
+            history.goto(history.latest())
+            self.assertEqual(self.state(cpu), final)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Unit tests for execution traces, replay, and trace comparison"""
+
+import context
+from cpu.trace import *
+from test_cpu import self_modifying_program, load_cpu, random_program, RANDOM_MEMORY
+from test_timetravel import state_after
+from run.pipeline import assemble
+import io
+import random
+import unittest
+
+
+def traced_run(words: list[int], tracer: Tracer) -> "CPU":
+    cpu = load_cpu(words)
+    cpu.run(tracer=tracer)
+    return cpu
+
+
+def trace_of(words: list[int]) -> list[TraceRecord]:
+    file = io.BytesIO()
+    traced_run(words, TraceWriter(file, buffer_size=4))
+    file.seek(0)
+    return list(read_trace(file))
+
+
+class TestTrace(unittest.TestCase):
+
+    def test_records(self):
+        records = trace_of(self_modifying_program())
+        self.assertEqual([r.step for r in records], list(range(14)))
+        self.assertEqual(records[0].reg, 1)
+        self.assertEqual(records[0].value, 7)
+        # The self-modifying store
+        store = records[7]
+        self.assertEqual((store.pc, store.reg, store.addr), (7, NO_REGISTER, 2))
+        self.assertEqual(store.value, records[6].value)
+
+    def test_replay(self):
+        words = self_modifying_program()
+        records = trace_of(words)
+        for step in [0, 5, 9, 14]:
+            state = replay(words, records, step, memory_size=32)
+            regs, condition, memory = state_after(step)
+            self.assertEqual(state.regs, regs)
+            self.assertEqual(state.cc, condition.value)
+            self.assertEqual(state.memory, memory)
+        self.assertRaises(TraceError, replay, words, records, 15)
+
+    def test_replay_wide_store(self):
+        """A stored value wider than a word is wrapped, as in memory"""
+        words = assemble(["ADD r1,r0,r0[3]"] + 5 * ["MUL r1,r1,r1"]
+                         + ["STORE r1,cell", "HALT r0,r0,r0", "cell: DATA 0"]).words
+        file = io.BytesIO()
+        cpu = traced_run(words, TraceWriter(file))
+        file.seek(0)
+        state = replay(words, read_trace(file), cpu.step_count, memory_size=32)
+        self.assertEqual(state.regs[1], 3 ** 32)
+        self.assertEqual(state.memory, cpu.memory._mem.tolist())
+
+    def test_divergence(self):
+        words = self_modifying_program()
+        records = trace_of(words)
+        self.assertIsNone(first_divergence(records, records))
+        changed = list(words)
+        changed[10] = changed[2]   # Replaced with the same instruction
+        step, a, b = first_divergence(records, trace_of(changed))
+        self.assertEqual(step, 6)
+        self.assertEqual((a.pc, a.reg, a.addr), (b.pc, b.reg, b.addr))
+        self.assertNotEqual(a.value, b.value)
+        step, a, b = first_divergence(records, records[:-1])
+        self.assertEqual((step, b), (13, None))
+
+    def test_ring(self):
+        words = self_modifying_program()
+        ring = RingTracer(capacity=5)
+        traced_run(words, ring)
+        self.assertEqual(ring.records(), trace_of(words)[-5:])
+        file = io.BytesIO()
+        ring.save(file)
+        file.seek(0)
+        saved = list(read_trace(file))
+        self.assertIsNone(first_divergence(saved, trace_of(words)))
+        self.assertRaises(TraceError, replay, words, saved, 12)
+
+    def test_threaded(self):
+        """The threaded engine traces the same steps as CPU.run"""
+        rng = random.Random(20)
+        for words in [self_modifying_program()] + [random_program(rng) for _ in range(100)]:
+            traces = []
+            for run_name in ["run", "run_threaded"]:
+                ring = RingTracer()
+                cpu = load_cpu(words, RANDOM_MEMORY)
+                getattr(cpu, run_name)(tracer=ring)
+                traces.append(ring.records())
+            self.assertIsNone(first_divergence(*traces), words)
+            self.assertEqual(len(traces[1]), cpu.step_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Unit tests for whole-image encoding, decoding, and disassembly"""
+
+import context
+from instruction_set.instr_format import Instruction, OpCode, CondFlag, decode
+import glob
+import os
+import unittest
+
+try:
+    from instruction_set.vector import decode_image, encode_image, is_instruction
+    from asm.disasm import listing
+except ImportError:
+    decode_image = None   # NumPy is not installed
+
+OBJ = os.path.join(os.path.dirname(__file__), "..", "programs", "obj")
+
+
+def program_words() -> list[int]:
+    words = []
+    for path in sorted(glob.glob(os.path.join(OBJ, "*.obj"))):
+        words.extend(int(line) for line in open(path))
+    return words
+
+
+@unittest.skipIf(decode_image is None, "NumPy is not installed")
+class TestVector(unittest.TestCase):
+
+    def test_decode_matches(self):
+        words = program_words() + [-1, -512, 2**31 - 1]
+        fields = decode_image(words)
+        valid = is_instruction(fields)
+        for word, record, ok in zip(words, fields, valid):
+            try:
+                instr = decode(word)
+            except ValueError:
+                self.assertFalse(ok)
+                continue
+            self.assertTrue(ok)
+            self.assertEqual(tuple(int(v) for v in record),
+                             (instr.op.value, instr.cond.value, instr.reg_target,
+                              instr.reg_src1, instr.reg_src2, instr.offset))
+
+    def test_round_trip(self):
+        words = [w for w in program_words() if w >= 0]
+        fields = decode_image(words)
+        instrs = fields[is_instruction(fields)]
+        self.assertEqual(encode_image(instrs).tolist(),
+                         [instr_word for instr_word, ok
+                          in zip(words, is_instruction(fields)) if ok])
+
+    def test_listing(self):
+        words = [Instruction(OpCode.SUB, CondFlag.ALWAYS, 1, 1, 0, 1).encode(),
+                 Instruction(OpCode.STORE, CondFlag.P, 1, 0, 15, -1).encode(),
+                 15 << 26]   # Not a valid operation code
+        lines = listing(words, {"loop": 0})
+        self.assertEqual(lines[0], "loop:")
+        self.assertTrue(lines[1].endswith(str(decode(words[0]))))
+        self.assertIn(str(decode(words[1])), lines[2])
+        self.assertTrue(lines[2].endswith("# loop"))
+        self.assertTrue(lines[3].endswith(f"DATA {15 << 26}"))
+
+if __name__ == "__main__":
+    unittest.main()